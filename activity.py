@@ -0,0 +1,153 @@
+import datetime
+import json
+import time
+
+import db
+
+# ----------------- Activities -----------------
+# Daily Summary task -> event kind that completes it
+TASK_EVENTS = {
+    "notifications_checked": "reminder_acknowledged",
+    "medications_taken": "dose_taken",
+    "cognitive_exercises_completed": "exercise_finished",
+    "emergency_contacts_updated": "contacts_updated",
+    "progress_logged": "progress_logged"
+}
+
+DOSES_PER_DAY = {
+    "Once daily": 1,
+    "Twice daily": 2,
+    "Three times daily": 3,
+    "As needed": 0
+}
+
+
+def expected_doses(medications):
+    return sum(DOSES_PER_DAY.get(med["frequency"], 1) for med in medications)
+
+
+def confirmed_kind(task):
+    # Recorded by the "Mark Complete" buttons on the Daily Summary page
+    return f"confirmed:{task}"
+
+
+def task_status(rollup, doses_due=0):
+    """Map a day's rollup onto the Daily Summary tasks."""
+    counts = rollup["counts"]
+    status = {}
+    for task, kind in TASK_EVENTS.items():
+        needed = max(doses_due, 1) if kind == "dose_taken" else 1
+        status[task] = counts.get(kind, 0) >= needed or counts.get(confirmed_kind(task), 0) > 0
+    return status
+
+
+def empty_rollup(day):
+    return {"day": day.isoformat(), "counts": {}, "events": 0, "last_seq": 0, "last_ts": None}
+
+
+# ----------------- Event Log -----------------
+class ActivityLog:
+    """Append-only activity log for one patient with per-day rollups.
+
+    Every append updates that day's rollup row in the same transaction, so a
+    day's view is a single primary-key lookup and a month of history is one
+    row per day. Rollups can always be rebuilt from the events.
+    """
+
+    def __init__(self, path, patient_id):
+        self.path = path
+        self.patient_id = patient_id
+        db.prepare(path)
+        with db.connect(path) as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id TEXT, day TEXT, ts REAL, kind TEXT, payload TEXT
+                );
+                CREATE INDEX IF NOT EXISTS events_day ON events (patient_id, day);
+                CREATE INDEX IF NOT EXISTS events_kind ON events (kind, day);
+                CREATE TABLE IF NOT EXISTS rollups (
+                    patient_id TEXT, day TEXT, data TEXT,
+                    PRIMARY KEY (patient_id, day)
+                );
+            """)
+
+    def record(self, kind, payload=None, ts=None):
+        ts = time.time() if ts is None else ts
+        day = datetime.date.fromtimestamp(ts).isoformat()
+        with db.connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            seq = conn.execute(
+                "INSERT INTO events (patient_id, day, ts, kind, payload) VALUES (?, ?, ?, ?, ?)",
+                (self.patient_id, day, ts, kind, json.dumps(payload or {}, default=str))
+            ).lastrowid
+            row = conn.execute(
+                "SELECT data FROM rollups WHERE patient_id = ? AND day = ?", (self.patient_id, day)
+            ).fetchone()
+            rollup = json.loads(row[0]) if row else empty_rollup(datetime.date.fromisoformat(day))
+            rollup["counts"][kind] = rollup["counts"].get(kind, 0) + 1
+            rollup["events"] += 1
+            rollup["last_seq"] = seq
+            rollup["last_ts"] = ts
+            conn.execute(
+                "INSERT OR REPLACE INTO rollups VALUES (?, ?, ?)", (self.patient_id, day, json.dumps(rollup))
+            )
+            conn.execute("COMMIT")
+        return seq
+
+    def day(self, date=None):
+        date = date or datetime.date.today()
+        with db.connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT data FROM rollups WHERE patient_id = ? AND day = ?", (self.patient_id, date.isoformat())
+            ).fetchone()
+        return json.loads(row[0]) if row else empty_rollup(date)
+
+    def history(self, start, end):
+        """Rollups for every day in [start, end], including days with no activity."""
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT day, data FROM rollups WHERE patient_id = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (self.patient_id, start.isoformat(), end.isoformat())
+            ).fetchall()
+        found = {day: json.loads(data) for day, data in rows}
+        days = (end - start).days + 1
+        return [
+            found.get(d.isoformat()) or empty_rollup(d)
+            for d in (start + datetime.timedelta(days=i) for i in range(days))
+        ]
+
+    def events(self, date=None, kind=None):
+        day = (date or datetime.date.today()).isoformat()
+        query = "SELECT seq, ts, kind, payload FROM events WHERE patient_id = ? AND day = ?"
+        params = [self.patient_id, day]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        with db.connect(self.path) as conn:
+            rows = conn.execute(query + " ORDER BY seq", params).fetchall()
+        return [{"seq": seq, "ts": ts, "kind": k, "payload": json.loads(p)} for seq, ts, k, p in rows]
+
+    def recent(self, kind, limit=20):
+        """The latest events of one kind, oldest first."""
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT seq, ts, kind, payload FROM events WHERE patient_id = ? AND kind = ? ORDER BY seq DESC LIMIT ?",
+                (self.patient_id, kind, limit)
+            ).fetchall()
+        return [{"seq": seq, "ts": ts, "kind": k, "payload": json.loads(p)} for seq, ts, k, p in reversed(rows)]
+
+    def rebuild(self, date):
+        """Recompute a day's rollup from its events."""
+        rollup = empty_rollup(date)
+        for event in self.events(date):
+            rollup["counts"][event["kind"]] = rollup["counts"].get(event["kind"], 0) + 1
+            rollup["events"] += 1
+            rollup["last_seq"] = event["seq"]
+            rollup["last_ts"] = event["ts"]
+        with db.connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO rollups VALUES (?, ?, ?)",
+                (self.patient_id, date.isoformat(), json.dumps(rollup))
+            )
+        return rollup
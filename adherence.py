@@ -0,0 +1,204 @@
+import datetime
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import db
+
+# ----------------- Schedules -----------------
+# Hours after the scheduled "Time to Take" at which each daily dose is due
+DOSE_OFFSETS_HOURS = {
+    "Once daily": [0],
+    "Twice daily": [0, 12],
+    "Three times daily": [0, 6, 12],
+    "As needed": []
+}
+
+# A dose counts as on time up to an hour either side, and as late up to four hours after
+ON_TIME_SECONDS = 3600
+LATE_SECONDS = 4 * 3600
+
+
+def new_medication_id():
+    return uuid.uuid4().hex[:12]
+
+
+def medication_id(med):
+    # Medications added before ids existed fall back to their name
+    return med.get("id") or med["name"]
+
+
+def schedule_payload(med):
+    """Event payload recorded when a medication is added to the schedule."""
+    return {
+        "medication_id": medication_id(med),
+        "name": med["name"],
+        "dosage": med["dosage"],
+        "time": med["time"].strftime("%H:%M"),
+        "frequency": med["frequency"]
+    }
+
+
+def dose_payload(med):
+    return {"medication_id": medication_id(med), "name": med["name"]}
+
+
+# ----------------- Loading -----------------
+def load_cohort(path, start, end, patient_ids=None):
+    """Read schedules and doses for every patient (or the given ones) in one pass over the activity log."""
+    where = ""
+    params = []
+    if patient_ids:
+        where = f" AND patient_id IN ({','.join('?' * len(patient_ids))})"
+        params = list(patient_ids)
+
+    with db.connect(path) as conn:
+        schedules = pd.DataFrame(conn.execute(f"""
+            SELECT patient_id, ts,
+                   json_extract(payload, '$.medication_id'), json_extract(payload, '$.name'),
+                   json_extract(payload, '$.time'), json_extract(payload, '$.frequency')
+            FROM events WHERE kind = 'medication_added' AND day <= ?{where}
+            ORDER BY seq
+        """, [end.isoformat()] + params).fetchall(),
+            columns=["patient_id", "added_ts", "medication_id", "name", "time", "frequency"])
+
+        # Doses a few hours either side of the range can still match a dose inside it
+        doses = pd.DataFrame(conn.execute(f"""
+            SELECT patient_id, json_extract(payload, '$.medication_id'), ts
+            FROM events WHERE kind = 'dose_taken' AND day BETWEEN ? AND ?{where}
+        """, [(start - datetime.timedelta(days=1)).isoformat(), (end + datetime.timedelta(days=1)).isoformat()] + params).fetchall(),
+            columns=["patient_id", "medication_id", "ts"])
+
+    # A medication added twice keeps its latest schedule
+    schedules = schedules.dropna(subset=["medication_id"]).drop_duplicates(["patient_id", "medication_id"], keep="last")
+    return schedules.reset_index(drop=True), doses
+
+
+def day_starts(start, end):
+    days = (end - start).days + 1
+    # mktime per day keeps local midnight correct across DST changes
+    return np.array([
+        time.mktime((start + datetime.timedelta(days=i)).timetuple()) for i in range(days)
+    ], dtype=np.int64)
+
+
+# ----------------- Adherence Engine -----------------
+def expand_schedules(schedules, start, end, now):
+    """All expected doses in [start, end] as (medication row, due timestamp) arrays."""
+    starts = day_starts(start, end)
+    seconds = pd.to_datetime(schedules["time"], format="%H:%M")
+    base = (seconds.dt.hour * 3600 + seconds.dt.minute * 60).to_numpy(dtype=np.int64)
+    added = schedules["added_ts"].to_numpy(dtype=np.float64)
+    frequency = schedules["frequency"].to_numpy()
+
+    med_rows = []
+    due = []
+    for name, hours in DOSE_OFFSETS_HOURS.items():
+        rows = np.flatnonzero(frequency == name)
+        if not len(rows) or not hours:
+            continue
+        offsets = np.array(hours, dtype=np.int64) * 3600
+        # (medication, day, dose of the day)
+        grid = base[rows, None, None] + starts[None, :, None] + offsets[None, None, :]
+        owner = np.broadcast_to(rows[:, None, None], grid.shape)
+        keep = (grid >= added[rows, None, None]) & (grid <= now)
+        med_rows.append(owner[keep])
+        due.append(grid[keep])
+
+    if not med_rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(med_rows), np.concatenate(due)
+
+
+def match_doses(exp_med, exp_due, dose_med, dose_ts):
+    """Pair each taken dose with the nearest expected dose of the same medication.
+
+    Returns the delay in seconds for every expected dose, NaN where none was taken.
+    """
+    delays = np.full(len(exp_due), np.nan)
+    if not len(exp_due) or not len(dose_ts):
+        return delays
+
+    origin = min(exp_due.min(), dose_ts.min())
+    span = int(max(exp_due.max(), dose_ts.max()) - origin) + 2 * LATE_SECONDS + 1
+    exp_key = exp_med * span + (exp_due - origin)
+    order = np.argsort(exp_key, kind="stable")
+    exp_key = exp_key[order]
+    dose_key = dose_med * span + (dose_ts - origin)
+
+    pos = np.searchsorted(exp_key, dose_key)
+    left = np.clip(pos - 1, 0, len(exp_key) - 1)
+    right = np.clip(pos, 0, len(exp_key) - 1)
+    left_delay = (dose_key - exp_key[left]).astype(np.float64)
+    right_delay = (dose_key - exp_key[right]).astype(np.float64)
+
+    def in_window(delay):
+        return (delay >= -ON_TIME_SECONDS) & (delay <= LATE_SECONDS)
+
+    left_ok = in_window(left_delay)
+    right_ok = in_window(right_delay)
+    use_right = right_ok & (~left_ok | (np.abs(right_delay) < np.abs(left_delay)))
+    matched = left_ok | right_ok
+    target = np.where(use_right, right, left)[matched]
+    delay = np.where(use_right, right_delay, left_delay)[matched]
+
+    # One taken dose per expected dose: keep the closest
+    best = np.lexsort((np.abs(delay), target))
+    target, delay = target[best], delay[best]
+    first = np.unique(target, return_index=True)[1]
+    delays[order[target[first]]] = delay[first]
+    return delays
+
+
+def classify(schedules, doses, start, end, now=None):
+    """Per expected dose: medication row, due time and status (on_time, late, missed, pending)."""
+    now = time.time() if now is None else now
+    exp_med, exp_due = expand_schedules(schedules, start, end, now)
+
+    keys = pd.Index(schedules["patient_id"] + "\x1f" + schedules["medication_id"])
+    dose_med = keys.get_indexer(doses["patient_id"] + "\x1f" + doses["medication_id"].fillna(""))
+    known = dose_med >= 0
+    delays = match_doses(
+        exp_med, exp_due,
+        dose_med[known].astype(np.int64), doses["ts"].to_numpy(dtype=np.float64)[known].astype(np.int64)
+    )
+
+    status = np.full(len(exp_due), "pending", dtype=object)
+    status[np.abs(delays) <= ON_TIME_SECONDS] = "on_time"
+    status[delays > ON_TIME_SECONDS] = "late"
+    status[np.isnan(delays) & (exp_due + LATE_SECONDS < now)] = "missed"
+    return exp_med, exp_due, status, dose_med[known]
+
+
+def summarize(groups, n_groups, status):
+    counts = {name: np.bincount(groups[status == name], minlength=n_groups) for name in ("on_time", "late", "missed", "pending")}
+    settled = counts["on_time"] + counts["late"] + counts["missed"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = {f"{name}_rate": np.where(settled > 0, counts[name] / settled, np.nan) for name in ("on_time", "late", "missed")}
+    return {"expected": settled, **counts, **rates}
+
+
+def adherence_report(path, start, end, patient_ids=None, by="patient", now=None):
+    """On-time, late and missed rates for every patient (or medication) over [start, end]."""
+    schedules, doses = load_cohort(path, start, end, patient_ids)
+    exp_med, _, status, dose_med = classify(schedules, doses, start, end, now)
+
+    as_needed = np.bincount(
+        dose_med[schedules["frequency"].to_numpy()[dose_med] == "As needed"], minlength=len(schedules)
+    ) if len(schedules) else np.zeros(0, dtype=np.int64)
+
+    if by == "medication":
+        report = schedules[["patient_id", "medication_id", "name", "frequency"]].copy()
+        for column, values in summarize(exp_med, len(schedules), status).items():
+            report[column] = values
+        report["as_needed_taken"] = as_needed
+        return report
+
+    patients, patient_index = np.unique(schedules["patient_id"].to_numpy(dtype=str), return_inverse=True)
+    report = pd.DataFrame({"patient_id": patients})
+    for column, values in summarize(patient_index[exp_med], len(patients), status).items():
+        report[column] = values
+    report["as_needed_taken"] = np.bincount(patient_index, weights=as_needed, minlength=len(patients)).astype(np.int64)
+    return report
@@ -0,0 +1,567 @@
+import argparse
+import datetime
+import functools
+import hmac
+import json
+import math
+import os
+import threading
+import time
+import tomllib
+
+import pyarrow as pa
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import activity
+import adherence
+import assistant
+import handoff
+import knowledge
+import memprofile
+import ratelimit
+import records
+import scans
+import state
+import usage
+
+SECRETS_FILE = ".streamlit/secrets.toml"
+ACTIVITY_DB = "data/activity.sqlite3"
+
+# URL name -> session field and the records table used to validate it
+COLLECTIONS = {
+    "medications": "medications",
+    "reminders": "notifications",
+    "contacts": "emergency_contacts",
+    "progress": "progress"
+}
+
+MAX_BATCH = 1000
+MAX_SIMILAR = 50
+MAX_SESSIONS = 1000
+MAX_REPORT_DAYS = 366
+
+
+def setting(name, default=None):
+    """Environment variables first, then the Streamlit secrets file the UI reads."""
+    if name in os.environ:
+        return os.environ[name]
+    if os.path.exists(SECRETS_FILE):
+        with open(SECRETS_FILE, "rb") as f:
+            return tomllib.load(f).get(name, default)
+    return default
+
+
+# ----------------- Access -----------------
+def authorized(*roles):
+    """Serve a handler only to requests bearing the bearer token of one of roles.
+
+    Tokens come from the ADMIN_TOKEN and API_TOKEN settings; a role without a
+    token is off, and routes only it may use answer 404.
+    """
+    def wrap(handler):
+        @functools.wraps(handler)
+        async def guarded(request):
+            tokens = [token for token in (request.app.state.tokens.get(role) for role in roles) if token]
+            if not tokens:
+                raise HTTPException(404, "Not Found")
+            supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip().encode("utf-8")
+            if not any(hmac.compare_digest(supplied, token.encode("utf-8")) for token in tokens):
+                raise HTTPException(401, "A valid bearer token is required")
+            return await handler(request)
+
+        return guarded
+
+    return wrap
+
+
+admin_only = authorized("admin")
+# Patient records are for the EHR integration, and operators may use them too
+integration = authorized("api", "admin")
+
+
+# ----------------- JSON -----------------
+def _iso(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+class ApiResponse(JSONResponse):
+    def render(self, content):
+        return json.dumps(content, default=_iso, ensure_ascii=False).encode("utf-8")
+
+
+def query_number(request, name, default, maximum, cast=int, minimum=1):
+    """A numeric query parameter clamped to [minimum, maximum]; anything that is not a number is a 400."""
+    raw = request.query_params.get(name)
+    if raw is None:
+        return default
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise HTTPException(400, f"{name} must be a number")
+    if not math.isfinite(value):
+        raise HTTPException(400, f"{name} must be a finite number")
+    return min(max(value, minimum), maximum)
+
+
+def parse_value(value, field_type):
+    """Coerce one JSON value to a records schema type, raising TypeError or ValueError if it cannot be."""
+    if value is None or value == "":
+        return None
+    if pa.types.is_integer(field_type):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)) \
+                or isinstance(value, float) and not value.is_integer():
+            raise TypeError(f"expected an integer, got {value!r}")
+        value = int(value)
+        limit = 2 ** (field_type.bit_width - 1)
+        if not -limit <= value < limit:
+            raise ValueError(f"{value} is out of range")
+        return value
+    if pa.types.is_boolean(field_type):
+        if not isinstance(value, bool):
+            raise TypeError(f"expected true or false, got {value!r}")
+        return value
+    if not isinstance(value, str):
+        raise TypeError(f"expected a string, got {value!r}")
+    if pa.types.is_date(field_type):
+        return datetime.date.fromisoformat(value)
+    if pa.types.is_time(field_type):
+        return datetime.time.fromisoformat(value)
+    if pa.types.is_timestamp(field_type):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def parse_items(collection, patient_id, items):
+    """Coerce JSON items to the records schema and validate them in one vectorized pass.
+
+    Returns (valid items, rejected entries with their position in the request).
+    """
+    table = COLLECTIONS[collection]
+    schema = records.SCHEMAS[table]
+    rows, positions, rejected = [], [], []
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("item must be an object")
+            row = {field.name: parse_value(item.get(field.name), field.type) for field in schema}
+            row["patient_id"] = patient_id
+            if table == "notifications" and row["active"] is None:
+                row["active"] = True
+            rows.append(row)
+            positions.append(i)
+        except (TypeError, ValueError) as e:
+            rejected.append({"index": i, "error": str(e)})
+    if not rows:
+        return [], rejected
+
+    try:
+        batch = pa.RecordBatch.from_pylist(rows, schema=schema)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # Find the rows Arrow cannot hold, so only those are rejected
+        kept = []
+        for row, i in zip(rows, positions):
+            try:
+                pa.RecordBatch.from_pylist([row], schema=schema)
+                kept.append((row, i))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError) as e:
+                rejected.append({"index": i, "error": str(e)})
+        if not kept:
+            return [], sorted(rejected, key=lambda r: r["index"])
+        rows, positions = (list(column) for column in zip(*kept))
+        batch = pa.RecordBatch.from_pylist(rows, schema=schema)
+    batch = batch.append_column("_position", pa.array(positions, pa.int64()))
+    valid, invalid = records.validate(table, batch)
+    rejected += [{"index": i, "error": "failed validation"} for i in invalid.column("_position").to_pylist()]
+    accepted = records.unflatten(table, valid.drop_columns(["_position"]).to_pylist())
+    if table == "medications":
+        for item in accepted:
+            item["id"] = item.get("id") or adherence.new_medication_id()
+    return accepted, sorted(rejected, key=lambda r: r["index"])
+
+
+# ----------------- Service -----------------
+class CareService:
+    """Patient records and chat over the shared state store, for the HTTP API."""
+
+    def __init__(self, care_assistant, store):
+        self.assistant = care_assistant
+        self.store = store
+        self.activity_logs = {}
+        self.lock = threading.Lock()
+        self.summarizer = handoff.Summarizer(store, care_assistant.model, care_assistant.limiter, care_assistant.ledger)
+
+    def activity_log(self, patient_id):
+        with self.lock:
+            if patient_id not in self.activity_logs:
+                self.activity_logs[patient_id] = activity.ActivityLog(ACTIVITY_DB, patient_id)
+            return self.activity_logs[patient_id]
+
+    def open(self, patient_id):
+        """The patient's state as the UI sees it, plus the sync that writes it back."""
+        sync = state.SessionSync(self.store, f"api:{patient_id}")
+        patient = {"patient_id": patient_id, **{field: state.empty(field) for field in state.PATIENT_FIELDS}}
+        sync.sync(patient)
+        patient["patient_id"] = patient_id
+        patient["last_prediction"] = scans.latest_prediction(patient["scans"]) or patient.get("last_prediction")
+        return patient, sync
+
+    def version(self, patient_id, field):
+        return self.store.get_many([f"patient:{patient_id}:{field}"])[f"patient:{patient_id}:{field}"][0]
+
+    def list(self, patient_id, collection):
+        field = COLLECTIONS[collection]
+        patient, _ = self.open(patient_id)
+        return {"items": patient[field], "version": self.version(patient_id, field)}
+
+    def add(self, patient_id, collection, items):
+        accepted, rejected = parse_items(collection, patient_id, items)
+        if accepted:
+            patient, sync = self.open(patient_id)
+            patient[COLLECTIONS[collection]].extend(accepted)
+            sync.flush(patient)
+            records.record_added(self.activity_log(patient_id), COLLECTIONS[collection], accepted)
+        return {"accepted": accepted, "rejected": rejected}
+
+    def replace(self, patient_id, collection, index, item):
+        accepted, rejected = parse_items(collection, patient_id, [item])
+        if rejected:
+            raise HTTPException(422, rejected[0]["error"])
+        field = COLLECTIONS[collection]
+        patient, sync = self.open(patient_id)
+        if not 0 <= index < len(patient[field]):
+            raise HTTPException(404, "No such item")
+        if collection == "medications":
+            # Keep the id so logged doses stay attached to the medication
+            accepted[0]["id"] = patient[field][index].get("id") or accepted[0]["id"]
+        patient[field][index] = accepted[0]
+        sync.flush(patient)
+        return accepted[0]
+
+    def remove(self, patient_id, collection, index):
+        field = COLLECTIONS[collection]
+        patient, sync = self.open(patient_id)
+        if not 0 <= index < len(patient[field]):
+            raise HTTPException(404, "No such item")
+        removed = patient[field].pop(index)
+        sync.flush(patient)
+        return removed
+
+    def dose_taken(self, patient_id, medication_id):
+        patient, sync = self.open(patient_id)
+        for med in patient["medications"]:
+            if med.get("id") == medication_id:
+                med["last_taken"] = datetime.datetime.now()
+                sync.flush(patient)
+                self.activity_log(patient_id).record("dose_taken", adherence.dose_payload(med))
+                return med
+        raise HTTPException(404, "No such medication")
+
+    def predict(self, image_bytes, patient_id=None):
+        if not patient_id:
+            try:
+                prediction, _ = self.assistant.classify(image_bytes)
+            except Exception:
+                raise HTTPException(422, "Not a readable image")
+            return {"prediction": prediction, "explanation": knowledge.explanation_for(prediction)}
+
+        patient, sync = self.open(patient_id)
+        try:
+            prediction, scan, _ = self.assistant.analyse(patient_id, patient["scans"], image_bytes)
+        except Exception:
+            raise HTTPException(422, "Not a readable image")
+        patient["last_prediction"] = prediction
+        sync.flush(patient)
+        self.assistant.prefetcher.schedule(prediction, patient_id)
+        return {
+            "prediction": prediction,
+            "explanation": knowledge.explanation_for(prediction),
+            "scan_id": scan["scan_id"]
+        }
+
+    def similar(self, patient_id, scan_id, k):
+        index = self.assistant.scan_indexes.get(self.assistant.models.current.embedding)
+        own, others = scans.similar_scans(self.store, index, patient_id, scan_id, k)
+        if not own and not others and index.vector(patient_id, scan_id) is None:
+            raise HTTPException(404, "No such scan in the similarity index")
+        return {"scan_id": scan_id, "patient_scans": own, "similar": others}
+
+    def chat(self, patient_id, message):
+        """Chat events for one message; the exchange is saved to the patient's history."""
+        patient, sync = self.open(patient_id)
+        reply = ""
+        try:
+            for kind, value in self.assistant.respond(message, patient, self.activity_log(patient_id), page="API"):
+                if kind == "reply":
+                    reply = value
+                yield kind, value
+        except ratelimit.RateLimitTimeout as e:
+            reply = assistant.BUSY_REPLY.format(wait=e.wait)
+            yield "reply", reply
+        except Exception as e:
+            yield "error", str(e)
+            return
+        patient["chat_history"].append({"role": "user", "content": message})
+        patient["chat_history"].append({"role": "bot", "content": reply})
+        sync.flush(patient)
+        self.summarizer.notify(patient_id)
+
+
+# ----------------- Endpoints -----------------
+def collection_of(request):
+    collection = request.path_params["collection"]
+    if collection not in COLLECTIONS:
+        raise HTTPException(404, f"Unknown collection '{collection}'")
+    return collection
+
+
+async def json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise HTTPException(400, "Body must be JSON")
+
+
+async def health(request):
+    return ApiResponse({"status": "ok"})
+
+
+async def predict(request):
+    service = request.app.state.service
+    form = await request.form() if request.headers.get("content-type", "").startswith("multipart/") else None
+    image = await form["file"].read() if form and "file" in form else await request.body()
+    if not image:
+        raise HTTPException(400, "Send the image as the body or as a 'file' form field")
+    result = await run_in_threadpool(service.predict, image, request.query_params.get("patient_id"))
+    return ApiResponse(result)
+
+
+async def predict_batch(request):
+    service = request.app.state.service
+    form = await request.form()
+    files = form.getlist("files")
+    if not files or len(files) > MAX_BATCH:
+        raise HTTPException(400, f"Send 1 to {MAX_BATCH} images as 'files' form fields")
+    results = []
+    for upload in files:
+        image = await upload.read()
+        try:
+            result = await run_in_threadpool(service.predict, image)
+        except HTTPException as e:
+            result = {"error": e.detail}
+        results.append({"filename": upload.filename, **result})
+    return ApiResponse({"results": results})
+
+
+async def similar_scans(request):
+    service = request.app.state.service
+    k = query_number(request, "k", scans.SIMILAR_SCANS, MAX_SIMILAR)
+    result = await run_in_threadpool(
+        service.similar, request.path_params["patient_id"], request.path_params["scan_id"], k
+    )
+    return ApiResponse(result)
+
+
+async def list_items(request):
+    service = request.app.state.service
+    result = await run_in_threadpool(service.list, request.path_params["patient_id"], collection_of(request))
+    return ApiResponse(result)
+
+
+async def add_items(request):
+    service = request.app.state.service
+    collection = collection_of(request)
+    body = await json_body(request)
+    result = await run_in_threadpool(service.add, request.path_params["patient_id"], collection, [body])
+    if result["rejected"]:
+        raise HTTPException(422, result["rejected"][0]["error"])
+    return ApiResponse(result["accepted"][0], status_code=201)
+
+
+async def add_batch(request):
+    service = request.app.state.service
+    collection = collection_of(request)
+    body = await json_body(request)
+    items = body.get("items") if isinstance(body, dict) else None
+    if not isinstance(items, list) or len(items) > MAX_BATCH:
+        raise HTTPException(400, f"Body must be {{\"items\": [...]}} with at most {MAX_BATCH} items")
+    result = await run_in_threadpool(service.add, request.path_params["patient_id"], collection, items)
+    return ApiResponse({"accepted": len(result["accepted"]), "rejected": result["rejected"]})
+
+
+async def replace_item(request):
+    service = request.app.state.service
+    collection = collection_of(request)
+    body = await json_body(request)
+    result = await run_in_threadpool(
+        service.replace, request.path_params["patient_id"], collection, request.path_params["index"], body
+    )
+    return ApiResponse(result)
+
+
+async def remove_item(request):
+    service = request.app.state.service
+    result = await run_in_threadpool(
+        service.remove, request.path_params["patient_id"], collection_of(request), request.path_params["index"]
+    )
+    return ApiResponse(result)
+
+
+async def dose_taken(request):
+    service = request.app.state.service
+    result = await run_in_threadpool(
+        service.dose_taken, request.path_params["patient_id"], request.path_params["medication_id"]
+    )
+    return ApiResponse(result)
+
+
+async def summary(request):
+    service = request.app.state.service
+    result = await run_in_threadpool(service.summarizer.get, request.path_params["patient_id"])
+    if result is None:
+        raise HTTPException(404, "No summary yet")
+    return ApiResponse(result)
+
+
+async def chat(request):
+    service = request.app.state.service
+    body = await json_body(request)
+    message = body.get("message") if isinstance(body, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        raise HTTPException(400, "Body must be {\"message\": \"...\"}")
+    events = service.chat(request.path_params["patient_id"], message)
+
+    if request.query_params.get("stream") == "false":
+        result = {}
+        for kind, value in await run_in_threadpool(list, events):
+            if kind in ("reply", "error"):
+                result[kind] = value
+        return ApiResponse(result, status_code=502 if "error" in result else 200)
+
+    def event_stream():
+        # Server-sent events; Starlette runs this blocking generator in its thread pool
+        for kind, value in events:
+            yield f"event: {kind}\ndata: {json.dumps(value, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# ----------------- Admin -----------------
+async def memory_sessions(request):
+    service = request.app.state.service
+    sessions = await run_in_threadpool(memprofile.published_sessions, service.store)
+    limit = query_number(request, "limit", 50, MAX_SESSIONS)
+    return ApiResponse({
+        "sessions": [{**snapshot, "keys": dict(list(snapshot["keys"].items())[:10])} for snapshot in sessions[:limit]],
+        "total_bytes": sum(snapshot["total_bytes"] for snapshot in sessions),
+        "alerts": [{"session": s["session"], "alert": alert} for s in sessions for alert in s["alerts"]]
+    })
+
+
+async def memory_session(request):
+    service = request.app.state.service
+    _, snapshot = await run_in_threadpool(service.store.get, f"memory:{request.path_params['session']}")
+    if snapshot is None:
+        raise HTTPException(404, "No published sizes for this session")
+    return ApiResponse(snapshot)
+
+
+async def model_status(request):
+    models = request.app.state.service.assistant.models
+    hours = query_number(request, "hours", 24, MAX_REPORT_DAYS * 24, cast=float, minimum=0.01)
+    report = await run_in_threadpool(models.shadow_log.report, time.time() - hours * 3600)
+    return ApiResponse({**models.status(), "shadow_report": report})
+
+
+async def usage_report(request):
+    """Usage rollups for the last ?days, grouped by ?by (comma separated); ?format=csv|parquet exports every call."""
+    ledger = request.app.state.service.assistant.ledger
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=query_number(request, "days", 7, MAX_REPORT_DAYS) - 1)
+    fmt = request.query_params.get("format")
+    await run_in_threadpool(ledger.flush)
+    if fmt in ("csv", "parquet"):
+        body = await run_in_threadpool(ledger.export, start, end, fmt)
+        return Response(body, media_type="text/csv" if fmt == "csv" else "application/octet-stream")
+    by = [column for column in request.query_params.get("by", "day").split(",") if column]
+    unknown = set(by) - set(usage.GROUPS)
+    if unknown:
+        raise HTTPException(400, f"Cannot group by {', '.join(sorted(unknown))}")
+    report = await run_in_threadpool(ledger.rollup, start, end, by)
+    latency = await run_in_threadpool(ledger.latency, start, end)
+    return ApiResponse({
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "rollup": json.loads(report.to_json(orient="records")),
+        "latency": latency
+    })
+
+
+async def http_error(request, exc):
+    return ApiResponse({"error": exc.detail}, status_code=exc.status_code)
+
+
+def create_app(service=None, admin_token=None, api_token=None):
+    if service is None:
+        assistant.configure(setting("GOOGLE_API_KEY"), setting("GEMINI_ENDPOINT"))
+        backend = setting("LLM_BACKEND", "gemini")
+        model = assistant.chat_model(backend, setting)
+        care_assistant = assistant.build(
+            model,
+            rpm=int(setting("GEMINI_RPM", 60)),
+            tpm=int(setting("GEMINI_TPM", 1000000))
+        )
+        store = state.SharedState(state.open_backend(setting("STATE_BACKEND", "sqlite:///data/state.sqlite3")))
+        service = CareService(care_assistant, store)
+
+    app = Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/admin/memory", admin_only(memory_sessions)),
+            Route("/admin/memory/{session}", admin_only(memory_session)),
+            Route("/admin/models", admin_only(model_status)),
+            Route("/admin/usage", admin_only(usage_report)),
+            Route("/predict", integration(predict), methods=["POST"]),
+            Route("/predict/batch", integration(predict_batch), methods=["POST"]),
+            Route("/patients/{patient_id}/chat", integration(chat), methods=["POST"]),
+            Route("/patients/{patient_id}/summary", integration(summary), methods=["GET"]),
+            Route("/patients/{patient_id}/scans/{scan_id}/similar", integration(similar_scans), methods=["GET"]),
+            Route("/patients/{patient_id}/medications/{medication_id}/taken", integration(dose_taken), methods=["POST"]),
+            Route("/patients/{patient_id}/{collection}", integration(list_items), methods=["GET"]),
+            Route("/patients/{patient_id}/{collection}", integration(add_items), methods=["POST"]),
+            Route("/patients/{patient_id}/{collection}/batch", integration(add_batch), methods=["POST"]),
+            Route("/patients/{patient_id}/{collection}/{index:int}", integration(replace_item), methods=["PUT"]),
+            Route("/patients/{patient_id}/{collection}/{index:int}", integration(remove_item), methods=["DELETE"])
+        ],
+        exception_handlers={HTTPException: http_error}
+    )
+    app.state.service = service
+    app.state.tokens = {
+        "admin": admin_token if admin_token is not None else setting("ADMIN_TOKEN"),
+        "api": api_token if api_token is not None else setting("API_TOKEN")
+    }
+    return app
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Headless HTTP API for the Alzheimer's companion")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--keep-alive", type=int, default=75, help="Seconds to keep idle connections open")
+    args = parser.parse_args(argv)
+    uvicorn.run(
+        "api:create_app", factory=True, host=args.host, port=args.port,
+        workers=args.workers, timeout_keep_alive=args.keep_alive
+    )
+
+
+if __name__ == "__main__":
+    main()
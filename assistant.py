@@ -0,0 +1,154 @@
+import io
+
+import google.generativeai as genai
+from PIL import Image
+
+import classifier
+import intents
+import knowledge
+import llm
+import local_llm
+import prefetch
+import ratelimit
+import scans
+import scanindex
+import usage
+
+MODEL_NAME = "models/gemini-1.5-pro-latest"
+KNOWLEDGE_DIR = "care_docs"
+RATE_LIMIT_DB = "data/ratelimit.sqlite3"
+
+BUSY_REPLY = "Sorry, the assistant is very busy right now. Please try again in about {wait:.0f} seconds."
+
+
+def configure(api_key, endpoint=None):
+    """Point the Gemini client at the real API, or at a compatible endpoint such as the load-test stub."""
+    if endpoint:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+    else:
+        genai.configure(api_key=api_key)
+
+
+def chat_model(backend, setting):
+    """The model behind the chat for LLM_BACKEND.
+
+    "gemini" uses the API only, "local" a GGUF model on this machine (for
+    air-gapped sites), and "auto" Gemini with the local model as fallback.
+    setting(name, default) reads the LOCAL_LLM_* options.
+    """
+    if backend == "gemini":
+        return genai.GenerativeModel(MODEL_NAME)
+    local = local_llm.from_settings(setting)
+    if local is None:
+        raise ValueError(f"LLM_BACKEND={backend} needs LOCAL_LLM_PATH")
+    if backend == "local":
+        return local
+    return llm.FallbackModel(
+        genai.GenerativeModel(MODEL_NAME), local,
+        first_chunk_timeout=float(setting("REMOTE_FIRST_CHUNK_SECONDS", llm.FIRST_CHUNK_SECONDS))
+    )
+
+
+class Assistant:
+    """The prediction and chat engines, shared by the Streamlit UI and the HTTP API.
+
+    Both front ends build one of these per process, so they answer from the same
+    knowledge index, single-flight layer, answer cache and cross-process quota,
+    and classify scans with whichever model version the registry is serving.
+    """
+
+    def __init__(self, model, index, single_flight, limiter, prefetcher, models, ledger, scan_indexes):
+        self.model = model
+        self.ledger = ledger
+        self.scan_indexes = scan_indexes
+        self.index = index
+        self.single_flight = single_flight
+        self.limiter = limiter
+        self.prefetcher = prefetcher
+        self.models = models
+
+    def predict(self, image_bytes):
+        return self.classify(image_bytes)[0]
+
+    def classify(self, image_bytes):
+        """(stage label, model version) for one scan."""
+        # Reject anything that is not an image before it reaches the model
+        Image.open(io.BytesIO(image_bytes)).verify()
+        return self.models.classify(image_bytes)
+
+    def analyse(self, patient_id, scans_list, image_bytes):
+        """Classify a patient's upload, archive it into scans_list and index its embedding.
+
+        Returns (stage label, the scan's archive entry, the index it was added to).
+        """
+        Image.open(io.BytesIO(image_bytes)).verify()
+        prediction, model_version, space, vector = self.models.analyse(image_bytes)
+        entry = scans.archive(scans_list, image_bytes, prediction, model_version)
+        index = self.scan_indexes.get(space)
+        index.add(patient_id, entry["scan_id"], vector)
+        return prediction, entry, index
+
+    def respond(self, question, state, activity_log=None, page="Chatbot"):
+        """Answer one chat message as a stream of (kind, value) events.
+
+        "wait" carries the estimated queueing delay in seconds, "chunk" a piece
+        of streamed model text and "reply" the complete answer, always last.
+        App commands are written into state just as the chat page does. Model
+        calls and cache hits are recorded to the usage ledger under page.
+        """
+        prediction = state.get("last_prediction")
+        patient_id = state.get("patient_id")
+        command = intents.route(question)
+        reply = intents.apply(command, state, activity_log) if command else None
+
+        hits = self.index.search(question, k=3, stage=prediction)
+        if reply is None:
+            reply = knowledge.local_answer(hits)
+            if reply is not None:
+                self.ledger.record(patient_id, page, self.model.model_name, status="local_answer")
+
+        if reply is None:
+            reply = self.prefetcher.cached(question, prediction)
+            if reply is not None:
+                self.ledger.record(patient_id, page, self.model.model_name, status="answer_cache")
+
+        if reply is None:
+            if self.prefetcher.is_follow_up(question, prediction):
+                # Stage-wide questions get stage-wide answers, shared through the prefetch cache
+                context = knowledge.context_prompt(prediction)
+            else:
+                context = knowledge.context_prompt(prediction, knowledge.patient_profile(state.get("medications")))
+            prompt = f"{context}\n{knowledge.question_prompt(question, hits)}"
+            expected_wait = self.limiter.estimate_wait(ratelimit.estimate_tokens(prompt) + llm.OUTPUT_TOKEN_ALLOWANCE)
+            if expected_wait >= 1:
+                yield "wait", expected_wait
+
+            # Identical in-flight prompts from other sessions share one upstream call
+            led = []
+
+            def upstream():
+                led.append(True)
+                return llm.limited_stream(self.model, prompt, self.limiter, patient_id, ledger=self.ledger, page=page)
+
+            chunks = self.single_flight.stream(llm.request_key(self.model.model_name, prompt), upstream)
+            reply = ""
+            for chunk in chunks:
+                reply += chunk
+                yield "chunk", chunk
+            if not led:
+                self.ledger.record(patient_id, page, self.model.model_name, status="coalesced")
+            self.prefetcher.store(question, prediction, reply)
+
+        yield "reply", reply
+
+
+def build(model, rpm=60, tpm=1000000):
+    index = knowledge.build_index(KNOWLEDGE_DIR)
+    single_flight = llm.SingleFlight()
+    limiter = ratelimit.TokenBucket(RATE_LIMIT_DB, rpm=rpm, tpm=tpm)
+    ledger = usage.Ledger(usage.USAGE_DB)
+    prefetcher = prefetch.Prefetcher(index, model, single_flight, limiter, ledger)
+    return Assistant(
+        model, index, single_flight, limiter, prefetcher, classifier.ModelRegistry(), ledger,
+        scanindex.ScanIndexes()
+    )
@@ -0,0 +1,108 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Points sent to the browser per chart, whatever the history length
+CHART_POINTS = 300
+
+# Zoomed windows remembered per series
+MAX_WINDOWS = 32
+
+RANGES = {
+    "1M": 30,
+    "3M": 91,
+    "6M": 182,
+    "1Y": 365,
+    "All": None
+}
+
+
+# ----------------- Downsampling -----------------
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: keep the points that best preserve the line's shape."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    edges = (np.floor(np.arange(threshold - 1) * every) + 1).astype(np.int64)
+    xf = x.astype(np.float64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xf[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((xf[a] - avg_x) * (y[start:end] - y[a]) - (xf[a] - xf[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def minmax(y, threshold):
+    """Keep the minimum and maximum of each bucket; cheap for very long series."""
+    n = len(y)
+    buckets = max(1, threshold // 2)
+    if n <= threshold:
+        return np.arange(n)
+
+    size = int(np.ceil(n / buckets))
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    grid = padded.reshape(buckets, size)
+    valid = ~np.isnan(grid).all(axis=1)
+    offsets = np.arange(buckets)[valid] * size
+    lows = offsets + np.nanargmin(grid[valid], axis=1)
+    highs = offsets + np.nanargmax(grid[valid], axis=1)
+    return np.unique(np.concatenate([[0, n - 1], lows, highs]))
+
+
+# ----------------- Series -----------------
+class DownsampledSeries:
+    """A sorted time series with memoized downsampled windows.
+
+    Build it once per version of the data; each (start, end) window is reduced to
+    at most CHART_POINTS points the first time it is asked for.
+    """
+
+    def __init__(self, dates, values, version=None):
+        x = pd.to_datetime(pd.Series(dates)).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        y = np.asarray(values, dtype=np.float64)
+        order = np.argsort(x, kind="stable")
+        self.x = x[order]
+        self.y = y[order]
+        self.version = version
+        self.windows = {}
+
+    def __len__(self):
+        return len(self.x)
+
+    def bounds(self):
+        first = pd.Timestamp(self.x[0]).date()
+        last = pd.Timestamp(self.x[-1]).date()
+        return first, last
+
+    def window(self, start, end, points=CHART_POINTS):
+        key = (start, end, points)
+        if key not in self.windows:
+            lo = np.searchsorted(self.x, pd.Timestamp(start).value, side="left")
+            hi = np.searchsorted(self.x, pd.Timestamp(end + datetime.timedelta(days=1)).value, side="left")
+            x, y = self.x[lo:hi], self.y[lo:hi]
+            # LTTB keeps the shape best; past ~20 points per output point min-max is much cheaper
+            keep = minmax(y, points) if len(x) > points * 20 else lttb(x, y, points)
+            if len(self.windows) >= MAX_WINDOWS:
+                self.windows.pop(next(iter(self.windows)))
+            self.windows[key] = pd.Series(y[keep], index=pd.to_datetime(x[keep]), name="score")
+        return self.windows[key]
+
+
+def range_start(end, preset, first):
+    days = RANGES[preset]
+    if days is None:
+        return first
+    return max(first, end - datetime.timedelta(days=days - 1))
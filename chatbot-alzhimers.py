@@ -1,8 +1,30 @@
 import streamlit as st
-import google.generativeai as genai
 from PIL import Image
 import datetime
+import heapq
+import os
+import tempfile
+import time
+import zipfile
 import pandas as pd
+import knowledge
+import ratelimit
+import assistant
+import activity
+import adherence
+import exercises
+import sos
+import charts
+import records
+import state
+import chatlog
+import classifier
+import scans
+import templates
+import healthtips
+import handoff
+import usage
+import memprofile
 
 # ----------------- Configuration -----------------
 st.set_page_config(
@@ -11,12 +33,30 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded"
 )
-genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
-model = genai.GenerativeModel('models/gemini-1.5-pro-latest')
+# No API key is needed when only the local model is used (LLM_BACKEND = "local")
+assistant.configure(st.secrets.get("GOOGLE_API_KEY"), st.secrets.get("GEMINI_ENDPOINT"))
+
+# Prediction and chat engines shared by every session in this process; api.py builds the same.
+# All sessions and processes on this node share one Gemini quota through the token bucket.
+@st.cache_resource
+def get_assistant():
+    backend = st.secrets.get("LLM_BACKEND", "gemini")
+    model = assistant.chat_model(backend, st.secrets.get)
+    return assistant.build(
+        model,
+        rpm=int(st.secrets.get("GEMINI_RPM", 60)),
+        tpm=int(st.secrets.get("GEMINI_TPM", 1000000))
+    )
+
+care_assistant = get_assistant()
+prefetcher = care_assistant.prefetcher
 
 # ----------------- Session State Initialization -----------------
-if "chat_history" not in st.session_state or not isinstance(st.session_state.chat_history, list):
-    st.session_state.chat_history = []
+if "patient_id" not in st.session_state:
+    st.session_state.patient_id = "ALZ-24MAI0111"
+
+if not isinstance(st.session_state.get("chat_history"), chatlog.ChatHistory):
+    st.session_state.chat_history = chatlog.ChatHistory.of(st.session_state.get("chat_history"))
 
 if "last_prediction" not in st.session_state:
     st.session_state.last_prediction = None
@@ -33,14 +73,64 @@ if "emergency_contacts" not in st.session_state:
 if "progress" not in st.session_state:
     st.session_state.progress = []
 
-if "daily_summary" not in st.session_state:
-    st.session_state.daily_summary = {
-        "notifications_checked": False,
-        "medications_taken": False,
-        "cognitive_exercises_completed": False,
-        "emergency_contacts_updated": False,
-        "progress_logged": False
-    }
+if "scans" not in st.session_state:
+    st.session_state.scans = []
+
+# Session and patient state live in a shared store so any replica can serve any user
+@st.cache_resource
+def get_shared_state():
+    return state.SharedState(state.open_backend(st.secrets.get("STATE_BACKEND", "sqlite:///data/state.sqlite3")))
+
+shared_state = get_shared_state()
+
+# The session id rides in the URL, so a reconnect to another replica finds the same state
+if "sid" not in st.query_params:
+    st.query_params["sid"] = state.new_session_id()
+
+if st.session_state.get("state_sync") is None or st.session_state.state_sync.session_id != st.query_params["sid"]:
+    st.session_state.state_sync = state.SessionSync(shared_state, st.query_params["sid"])
+
+st.session_state.state_sync.sync(st.session_state)
+# The latest archived scan wins, so re-scored results reach every open session
+st.session_state.last_prediction = scans.latest_prediction(st.session_state.scans) or st.session_state.last_prediction
+
+# Session sizes and (when enabled) allocation traces for the Admin page
+@st.cache_resource
+def get_memory_registry():
+    return memprofile.MemoryRegistry(shared_state)
+
+memory_registry = get_memory_registry()
+memory_registry.begin_run()
+
+# Append-only activity log behind the Daily Summary, kept per patient
+ACTIVITY_DB = "data/activity.sqlite3"
+
+@st.cache_resource
+def get_activity_log(patient_id):
+    return activity.ActivityLog(ACTIVITY_DB, patient_id)
+
+activity_log = get_activity_log(st.session_state.patient_id)
+
+# Chat summaries for clinician handoff, written in the background while chats are idle
+@st.cache_resource
+def get_summarizer():
+    return handoff.Summarizer(shared_state, care_assistant.model, care_assistant.limiter, care_assistant.ledger)
+
+summarizer = get_summarizer()
+
+# Health tips, indexed and pre-rendered once per process
+@st.cache_resource
+def get_tip_catalog():
+    return healthtips.load_catalog(assistant.KNOWLEDGE_DIR)
+
+tip_catalog = get_tip_catalog()
+
+# SOS alerts go out through local stand-ins for the SMS, call and email providers
+@st.cache_resource
+def get_sos_dispatcher():
+    return sos.SOSDispatcher(sos.default_channels("data/outbox"), shared_state)
+
+sos_dispatcher = get_sos_dispatcher()
 
 # ----------------- Custom CSS for Enhanced UI -----------------
 st.markdown("""
@@ -323,8 +413,12 @@ pages = {
     "Emergency Contacts": {"icon": "🆘", "desc": "Important contact information"},
     "Health Tips": {"icon": "💡", "desc": "Personalized wellness advice"},
     "Progress Tracking": {"icon": "📈", "desc": "Monitor cognitive changes"},
-    "Daily Summary": {"icon": "📋", "desc": "Daily checklist and progress"}
+    "Daily Summary": {"icon": "📋", "desc": "Daily checklist and progress"},
+    "Data": {"icon": "🗄️", "desc": "Export and import records"}
 }
+# Operator tools act on every session and replica, so patient-facing deployments leave them off
+if st.secrets.get("ADMIN_ENABLED", False):
+    pages["Admin"] = {"icon": "🛠️", "desc": "Session memory and model versions"}
 
 # Create enhanced navigation
 selected_page = st.sidebar.radio(
@@ -360,7 +454,7 @@ st.sidebar.markdown(f"""
         <div style="display: flex; flex-direction: column; gap: 0.6rem;">
             <div style="display: flex; justify-content: space-between;">
                 <span style="font-size: 0.9rem; color: var(--secondary);"><strong>Patient ID:</strong></span>
-                <span style="font-size: 0.9rem; color: var(--primary); font-weight: 500;">ALZ-24MAI0111</span>
+                <span style="font-size: 0.9rem; color: var(--primary); font-weight: 500;">{st.session_state.patient_id}</span>
             </div>
             <div style="display: flex; justify-content: space-between;">
                 <span style="font-size: 0.9rem; color: var(--secondary);"><strong>Last Activity:</strong></span>
@@ -410,62 +504,16 @@ if selected_page == "Home":
                 import time
                 time.sleep(2)
                 
-                # Dummy model prediction
-                prediction = "VeryMildDemented"
+                image_bytes = uploaded_image.getvalue()
+                prediction, scan, scan_index = care_assistant.analyse(
+                    st.session_state.patient_id, st.session_state.scans, image_bytes
+                )
                 st.session_state.last_prediction = prediction
                 
-                if prediction == "VeryMildDemented":
-                    explanation = """
-                    <div class="card fade-in" style="margin-top: 1.5rem;">
-                        <h4>Analysis Results</h4>
-                        <div class="status-indicator status-pending">
-                            <span>Very Mild Dementia Detected</span>
-                        </div>
-                        <p style="margin-top: 1rem;">This suggests the patient may be in the <strong>early stage of Alzheimer's disease</strong>, 
-                        often associated with <strong>Mild Cognitive Impairment (MCI)</strong>. Individuals at this stage might have slight 
-                        memory issues but generally maintain independence.</p>
-                        <p><strong>Recommendation:</strong> Consult a neurologist for a full diagnosis and consider cognitive exercises 
-                        to maintain brain health.</p>
-                    </div>
-                    """
-                elif prediction == "MildDemented":
-                    explanation = """
-                    <div class="card fade-in" style="margin-top: 1.5rem;">
-                        <h4>Analysis Results</h4>
-                        <div class="status-indicator status-warning">
-                            <span>Mild Dementia Detected</span>
-                        </div>
-                        <p style="margin-top: 1rem;">This indicates an <strong>early stage of dementia</strong>, where memory loss 
-                        and confusion may start to impact daily life.</p>
-                        <p><strong>Recommendation:</strong> Medical evaluation is recommended to confirm and plan further steps. 
-                        Consider setting up medication reminders and cognitive exercises.</p>
-                    </div>
-                    """
-                elif prediction == "ModerateDemented":
-                    explanation = """
-                    <div class="card fade-in" style="margin-top: 1.5rem;">
-                        <h4>Analysis Results</h4>
-                        <div class="status-indicator status-danger">
-                            <span>Moderate Dementia Detected</span>
-                        </div>
-                        <p style="margin-top: 1rem;">This reflects a <strong>moderate stage of Alzheimer's disease</strong>, often 
-                        characterized by noticeable confusion, increased memory loss, and need for assistance with routine tasks.</p>
-                        <p><strong>Recommendation:</strong> A comprehensive care plan may be needed. Ensure emergency contacts 
-                        are up to date and consider professional care options.</p>
-                    </div>
-                    """
-                else:
-                    explanation = """
-                    <div class="card fade-in" style="margin-top: 1.5rem;">
-                        <h4>Analysis Results</h4>
-                        <div class="status-indicator status-completed">
-                            <span>No Dementia Detected</span>
-                        </div>
-                        <p style="margin-top: 1rem;">No signs of dementia are visible in the MRI scan.</p>
-                        <p><strong>Recommendation:</strong> Maintain a healthy lifestyle with regular exercise and cognitive 
-                        activities to support brain health.</p>
-                    </div>
-                    """
+                # Warm answers to the usual follow-up questions while the results are being read
+                prefetcher.schedule(prediction, st.session_state.patient_id)
+                
+                explanation = knowledge.explanation_for(prediction)
                 
                 st.markdown(explanation, unsafe_allow_html=True)
                 
@@ -474,6 +522,29 @@ if selected_page == "Home":
                         "role": "bot",
                         "content": explanation
                     })
+            
+            own_scans, similar_cases = scans.similar_scans(
+                shared_state, scan_index, st.session_state.patient_id, scan["scan_id"]
+            )
+            with st.expander("🔍 Similar Scans", expanded=bool(own_scans or similar_cases)):
+                st.markdown("**This patient's earlier scans**")
+                if own_scans:
+                    st.dataframe(pd.DataFrame([{
+                        "uploaded": hit["uploaded"].strftime("%b %d, %Y %H:%M"),
+                        "result": knowledge.STAGE_LABELS.get(hit["label"], hit["label"]),
+                        "similarity": f"{hit['similarity']:.0%}"
+                    } for hit in own_scans]), use_container_width=True, hide_index=True)
+                else:
+                    st.caption("No earlier scans for this patient.")
+                st.markdown("**Most similar scans of other patients**")
+                if similar_cases:
+                    st.dataframe(pd.DataFrame([{
+                        "result": knowledge.STAGE_LABELS.get(hit["label"], hit["label"]),
+                        "similarity": f"{hit['similarity']:.0%}",
+                        "uploaded": hit["uploaded"].strftime("%b %d, %Y")
+                    } for hit in similar_cases]), use_container_width=True, hide_index=True)
+                else:
+                    st.caption("No similar scans archived yet.")
     
     with col2:
         st.markdown("""
@@ -496,26 +567,23 @@ if selected_page == "Home":
             </div>
         """, unsafe_allow_html=True)
         
-        st.markdown("""
+        today_status = activity.task_status(activity_log.day(), activity.expected_doses(st.session_state.medications))
+        checklist = [
+            ("💊 Medications", today_status["medications_taken"]),
+            ("🧠 Exercises", today_status["cognitive_exercises_completed"]),
+            ("📞 Contacts", today_status["emergency_contacts_updated"]),
+            ("📊 Progress", today_status["progress_logged"])
+        ]
+        checklist_html = "".join(f"""
+                    <div style="display: flex; align-items: center; justify-content: space-between; padding: 0.5rem 0;">
+                        <span>{label}</span>
+                        {'<span style="color: var(--success);">✓</span>' if done else '<span style="color: var(--danger);">✗</span>'}
+                    </div>""" for label, done in checklist)
+        
+        st.markdown(f"""
             <div class="card" style="margin-top: 1.5rem;">
                 <h3>Daily Checklist</h3>
-                <div style="margin-top: 1rem;">
-                    <div style="display: flex; align-items: center; justify-content: space-between; padding: 0.5rem 0;">
-                        <span>💊 Medications</span>
-                        <span style="color: var(--success);">✓</span>
-                    </div>
-                    <div style="display: flex; align-items: center; justify-content: space-between; padding: 0.5rem 0;">
-                        <span>🧠 Exercises</span>
-                        <span style="color: var(--danger);">✗</span>
-                    </div>
-                    <div style="display: flex; align-items: center; justify-content: space-between; padding: 0.5rem 0;">
-                        <span>📞 Contacts</span>
-                        <span style="color: var(--success);">✓</span>
-                    </div>
-                    <div style="display: flex; align-items: center; justify-content: space-between; padding: 0.5rem 0;">
-                        <span>📊 Progress</span>
-                        <span style="color: var(--danger);">✗</span>
-                    </div>
+                <div style="margin-top: 1rem;">{checklist_html}
                 </div>
                 <button class="nav-btn" style="margin-top: 1rem; background-color: var(--primary); color: white;">
                     View Full Summary
@@ -537,6 +605,16 @@ elif selected_page == "Chatbot":
         </div>
     """, unsafe_allow_html=True)
     
+    # Clinician handoff note, kept up to date in the background
+    handoff_summary = summarizer.get(st.session_state.patient_id)
+    if handoff_summary:
+        with st.expander("📋 Clinician Handoff Summary"):
+            st.markdown(handoff_summary["text"])
+            st.caption(
+                f"Covers {handoff_summary['through']} of {len(st.session_state.chat_history)} messages • "
+                f"updated {datetime.datetime.fromtimestamp(handoff_summary['updated']).strftime('%b %d, %I:%M %p')}"
+            )
+    
     # Display chat history
     chat_container = st.container()
     
@@ -557,8 +635,19 @@ elif selected_page == "Chatbot":
                         </div>
                     """, unsafe_allow_html=True)
     
+    # Suggested follow-up questions for the latest MRI result
+    suggested_question = None
+    if st.session_state.last_prediction:
+        questions = prefetcher.questions(st.session_state.last_prediction)
+        if questions:
+            st.markdown("**Suggested questions**")
+            suggestion_cols = st.columns(len(questions))
+            for i, question in enumerate(questions):
+                if suggestion_cols[i].button(question, key=f"suggested_question_{i}"):
+                    suggested_question = question
+    
     # Chat input at the bottom
-    user_input = st.chat_input("Type your question here...", key="chat_input")
+    user_input = st.chat_input("Type your question here...", key="chat_input") or suggested_question
     
     if user_input:
         st.session_state.chat_history.append({
@@ -575,16 +664,27 @@ elif selected_page == "Chatbot":
             """, unsafe_allow_html=True)
         
         # Generate response
+        with chat_container:
+            reply_placeholder = st.empty()
+        
         with st.spinner("Thinking..."):
             try:
-                # Include context if available
-                if "last_prediction" in st.session_state and st.session_state.last_prediction:
-                    context = f"Based on the previous MRI analysis showing {st.session_state.last_prediction}, "
-                else:
-                    context = ""
-                
-                response = model.generate_content(context + user_input)
-                bot_reply = response.text
+                # App commands are handled locally; questions go to the care content, then the model
+                bot_reply = ""
+                for kind, value in care_assistant.respond(user_input, st.session_state, activity_log):
+                    if kind == "wait":
+                        reply_placeholder.info(f"⏳ Many people are asking right now. Estimated wait: about {value:.0f} seconds.")
+                    elif kind == "chunk":
+                        bot_reply += value
+                        reply_placeholder.markdown(f"""
+                            <div class="bot-bubble">
+                                {bot_reply}
+                            </div>
+                        """, unsafe_allow_html=True)
+                    else:
+                        bot_reply = value
+            except ratelimit.RateLimitTimeout as e:
+                bot_reply = assistant.BUSY_REPLY.format(wait=e.wait)
             except Exception as e:
                 bot_reply = f"Sorry, I encountered an error. Please try again later. Error: {str(e)}"
             
@@ -592,14 +692,14 @@ elif selected_page == "Chatbot":
                 "role": "bot",
                 "content": bot_reply
             })
+            summarizer.notify(st.session_state.patient_id)
             
             # Update chat display with bot response
-            with chat_container:
-                st.markdown(f"""
-                    <div class="bot-bubble">
-                        {bot_reply}
-                    </div>
-                """, unsafe_allow_html=True)
+            reply_placeholder.markdown(f"""
+                <div class="bot-bubble">
+                    {bot_reply}
+                </div>
+            """, unsafe_allow_html=True)
 
 # ----------------- Notifications Page -----------------
 elif selected_page == "Notifications":
@@ -636,7 +736,6 @@ elif selected_page == "Notifications":
                     "frequency": frequency,
                     "active": True
                 })
-                st.session_state.daily_summary["notifications_checked"] = True
                 st.success("Reminder added successfully!")
     
     with col2:
@@ -647,16 +746,14 @@ elif selected_page == "Notifications":
         
         if st.session_state.notifications:
             for i, notification in enumerate(st.session_state.notifications):
-                cols = st.columns([3, 1])
+                cols = st.columns([3, 1, 1])
                 with cols[0]:
-                    st.markdown(f"""
-                        <div style="padding: 0.5rem 0;">
-                            <p style="margin: 0; font-weight: 500;">⏰ {notification['time'].strftime('%I:%M %p')}</p>
-                            <p style="margin: 0; font-size: 0.9rem; color: var(--secondary);">{notification['message']}</p>
-                            <p style="margin: 0; font-size: 0.8rem; color: var(--dark); opacity: 0.7;">{notification['frequency']}</p>
-                        </div>
-                    """, unsafe_allow_html=True)
+                    st.markdown(templates.render(templates.REMINDER_ROW, notification), unsafe_allow_html=True)
                 with cols[1]:
+                    if st.button("✓", key=f"ack_notif_{i}", help="Acknowledge reminder"):
+                        activity_log.record("reminder_acknowledged", {"message": notification["message"]})
+                        st.experimental_rerun()
+                with cols[2]:
                     if st.button("×", key=f"del_notif_{i}"):
                         st.session_state.notifications.pop(i)
                         st.experimental_rerun()
@@ -672,14 +769,10 @@ elif selected_page == "Notifications":
 
 # ----------------- Medications Page -----------------
 elif selected_page == "Medications":
-    st.markdown("""
-        <div style="display: flex; align-items: center; gap: 1rem; margin-bottom: 1.5rem;">
-            <h2>💊 Medication Management</h2>
-            <div class="status-indicator status-completed">
-                <span>{len(st.session_state.medications)} Medications</span>
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render(templates.PAGE_HEADER, {
+        "title": "💊 Medication Management",
+        "status": f"{len(st.session_state.medications)} Medications"
+    }), unsafe_allow_html=True)
     
     col1, col2 = st.columns([1, 1])
     
@@ -701,15 +794,17 @@ elif selected_page == "Medications":
             st.markdown("</div>", unsafe_allow_html=True)
             
             if submitted:
-                st.session_state.medications.append({
+                new_med = {
+                    "id": adherence.new_medication_id(),
                     "name": med_name,
                     "dosage": med_dosage,
                     "time": med_time,
                     "frequency": med_frequency,
                     "notes": med_notes,
                     "last_taken": None
-                })
-                st.session_state.daily_summary["medications_taken"] = True
+                }
+                st.session_state.medications.append(new_med)
+                activity_log.record("medication_added", adherence.schedule_payload(new_med))
                 st.success(f"{med_name} added to your medication schedule!")
     
     with col2:
@@ -722,16 +817,11 @@ elif selected_page == "Medications":
             for i, med in enumerate(st.session_state.medications):
                 cols = st.columns([4, 1])
                 with cols[0]:
-                    st.markdown(f"""
-                        <div style="padding: 0.5rem 0; border-bottom: 1px solid #eee;">
-                            <p style="margin: 0; font-weight: 500;">{med['name']} <span style="font-size: 0.9rem; color: var(--secondary);">{med['dosage']}mg</span></p>
-                            <p style="margin: 0; font-size: 0.9rem;">⏰ {med['time'].strftime('%I:%M %p')} • {med['frequency']}</p>
-                            {f"<p style='margin: 0; font-size: 0.8rem; color: var(--secondary);'>📝 {med['notes']}</p>" if med['notes'] else ""}
-                        </div>
-                    """, unsafe_allow_html=True)
+                    st.markdown(templates.render(templates.MEDICATION_ROW, med), unsafe_allow_html=True)
                 with cols[1]:
                     if st.button("✓", key=f"take_med_{i}"):
                         st.session_state.medications[i]["last_taken"] = datetime.datetime.now()
+                        activity_log.record("dose_taken", adherence.dose_payload(med))
                         st.experimental_rerun()
         
         else:
@@ -742,6 +832,38 @@ elif selected_page == "Medications":
             """, unsafe_allow_html=True)
         
         st.markdown("</div>", unsafe_allow_html=True)
+    
+    # Adherence computed from the dose log over the selected range
+    st.markdown("### 📊 Adherence")
+    adherence_days = st.selectbox("Period", [7, 30, 90, 365], format_func=lambda d: f"Last {d} days", key="adherence_days")
+    adherence_end = datetime.date.today()
+    adherence_start = adherence_end - datetime.timedelta(days=adherence_days - 1)
+    
+    med_report = adherence.adherence_report(
+        ACTIVITY_DB, adherence_start, adherence_end, [st.session_state.patient_id], by="medication"
+    )
+    scheduled = med_report[med_report["expected"] > 0]
+    if len(scheduled):
+        totals = scheduled[["expected", "on_time", "late", "missed"]].sum()
+        metric_cols = st.columns(3)
+        metric_cols[0].metric("On time", f"{totals['on_time'] / totals['expected']:.0%}")
+        metric_cols[1].metric("Late", f"{totals['late'] / totals['expected']:.0%}")
+        metric_cols[2].metric("Missed", f"{totals['missed'] / totals['expected']:.0%}")
+        st.dataframe(
+            med_report[["name", "frequency", "expected", "on_time", "late", "missed", "as_needed_taken"]],
+            use_container_width=True, hide_index=True
+        )
+    else:
+        st.info("No scheduled doses were due in this period.")
+    
+    with st.expander("Cohort Adherence Report"):
+        if st.button("Generate report", key="cohort_adherence"):
+            cohort_report = adherence.adherence_report(ACTIVITY_DB, adherence_start, adherence_end)
+            st.dataframe(cohort_report, use_container_width=True, hide_index=True)
+            st.download_button(
+                "Download CSV", cohort_report.to_csv(index=False),
+                file_name=f"adherence_{adherence_start}_{adherence_end}.csv", mime="text/csv"
+            )
 
 # ----------------- Cognitive Exercises Page -----------------
 elif selected_page == "Cognitive Exercises":
@@ -754,70 +876,56 @@ elif selected_page == "Cognitive Exercises":
         </div>
         
         <div class="card">
-            <h3>Memory Game</h3>
-            <p>Try to remember the sequence of numbers shown below. This exercise helps improve short-term memory.</p>
+            <h3>Brain Training Games</h3>
+            <p>Short games for memory, attention and processing speed. Each game adapts its difficulty to your recent results.</p>
         </div>
     """, unsafe_allow_html=True)
     
-    if st.button("Start New Memory Game", type="primary"):
-        import random
-        numbers = [random.randint(1, 9) for _ in range(5)]
-        st.session_state.memory_game_numbers = numbers
-        st.session_state.memory_game_start_time = datetime.datetime.now()
-        st.session_state.daily_summary["cognitive_exercises_completed"] = True
+    exercise = st.selectbox(
+        "Choose an exercise",
+        list(exercises.EXERCISES.keys()),
+        format_func=lambda e: exercises.EXERCISES[e]["title"]
+    )
     
-    if "memory_game_numbers" in st.session_state:
-        st.markdown("""
-            <div class="card">
-                <h4>Remember these numbers:</h4>
-                <div style="display: flex; gap: 1rem; justify-content: center; margin: 1rem 0;">
-        """, unsafe_allow_html=True)
-        
-        for num in st.session_state.memory_game_numbers:
-            st.markdown(f"""
-                <div style="width: 50px; height: 50px; background-color: var(--primary); 
-                            color: white; border-radius: 10px; display: flex; 
-                            align-items: center; justify-content: center; font-size: 1.5rem; font-weight: bold;">
-                    {num}
-                </div>
-            """, unsafe_allow_html=True)
-        
-        st.markdown("</div></div>", unsafe_allow_html=True)
-        
-        user_input = st.text_input("Enter the numbers you remember (separated by spaces):", 
-                                 placeholder="e.g., 1 2 3 4 5")
-        
-        if st.button("Check Answer"):
-            try:
-                user_numbers = list(map(int, user_input.split()))
-                if user_numbers == st.session_state.memory_game_numbers:
-                    time_taken = (datetime.datetime.now() - st.session_state.memory_game_start_time).seconds
-                    st.success(f"""
-                        🎉 Correct! You remembered all numbers in {time_taken} seconds!
-                        <div style="margin-top: 1rem; font-size: 0.9rem;">
-                            Difficulty: {"Easy" if time_taken < 15 else "Moderate" if time_taken < 30 else "Challenging"}
-                        </div>
-                    """)
-                else:
-                    st.error(f"""
-                        ❌ Not quite right. The correct numbers were: {st.session_state.memory_game_numbers}
-                        <div style="margin-top: 1rem;">
-                            Try again or start a new game.
-                        </div>
-                    """)
-            except ValueError:
-                st.error("Please enter numbers separated by spaces (e.g., 1 2 3 4 5)")
+    # Past results set the difficulty of the next game
+    past_results = [
+        event["payload"] for event in activity_log.recent("exercise_finished", 50)
+        if "level" in event["payload"]
+    ]
+    level = exercises.next_level(exercise, past_results)
+    
+    game_key = f"exercise_game_{exercise}"
+    if game_key not in st.session_state:
+        st.session_state[game_key] = exercises.new_game_id()
+    
+    # The game runs in the browser and only posts the final result back
+    result = exercises.exercise_game(exercise, level, st.session_state[game_key], key=f"exercise_component_{exercise}")
+    
+    if result and result.get("game_id") == st.session_state[game_key]:
+        summary = exercises.summarize(result)
+        activity_log.record("exercise_finished", summary)
+        st.session_state.last_exercise_summary = summary
+        st.session_state[game_key] = exercises.new_game_id()
+        st.experimental_rerun()
+    
+    last_summary = st.session_state.get("last_exercise_summary")
+    if last_summary and last_summary["exercise"] == exercise:
+        reaction_text = f" • median reaction {last_summary['median_rt_ms']:.0f} ms" if last_summary["median_rt_ms"] else ""
+        st.success(f"🎉 Last game: {last_summary['correct']}/{last_summary['trials']} correct at level {last_summary['level']}{reaction_text}")
+    
+    history = [r for r in past_results if r["exercise"] == exercise]
+    if history:
+        st.markdown("### Recent Results")
+        history_df = pd.DataFrame(history)[["level", "correct", "trials", "accuracy", "median_rt_ms"]]
+        st.dataframe(history_df.iloc[::-1].head(10), use_container_width=True, hide_index=True)
 
 # ----------------- Emergency Contacts Page -----------------
 elif selected_page == "Emergency Contacts":
+    st.markdown(templates.render(templates.PAGE_HEADER, {
+        "title": "🆘 Emergency Contacts",
+        "status": f"{len(st.session_state.emergency_contacts)} Contacts"
+    }), unsafe_allow_html=True)
     st.markdown("""
-        <div style="display: flex; align-items: center; gap: 1rem; margin-bottom: 1.5rem;">
-            <h2>🆘 Emergency Contacts</h2>
-            <div class="status-indicator status-completed">
-                <span>{len(st.session_state.emergency_contacts)} Contacts</span>
-            </div>
-        </div>
-        
         <div class="card">
             <p>Add emergency contacts who should be notified in case of urgent situations.</p>
         </div>
@@ -849,7 +957,7 @@ elif selected_page == "Emergency Contacts":
                     "relation": contact_relation,
                     "priority": contact_priority
                 })
-                st.session_state.daily_summary["emergency_contacts_updated"] = True
+                activity_log.record("contacts_updated", {"name": contact_name})
                 st.success(f"{contact_name} added to emergency contacts!")
     
     with col2:
@@ -860,24 +968,9 @@ elif selected_page == "Emergency Contacts":
         
         if st.session_state.emergency_contacts:
             for i, contact in enumerate(st.session_state.emergency_contacts):
-                priority_color = {
-                    "High": "var(--danger)",
-                    "Medium": "var(--warning)",
-                    "Low": "var(--success)"
-                }.get(contact["priority"], "var(--secondary)")
-                
                 cols = st.columns([4, 1])
                 with cols[0]:
-                    st.markdown(f"""
-                        <div style="padding: 0.5rem 0; border-bottom: 1px solid #eee;">
-                            <p style="margin: 0; font-weight: 500;">{contact['name']}</p>
-                            <p style="margin: 0; font-size: 0.9rem;">📞 {contact['phone']}</p>
-                            <p style="margin: 0; font-size: 0.8rem; color: var(--secondary);">
-                                {contact['relation']} • 
-                                <span style="color: {priority_color};">{contact['priority']} priority</span>
-                            </p>
-                        </div>
-                    """, unsafe_allow_html=True)
+                    st.markdown(templates.contact_row(contact), unsafe_allow_html=True)
                 with cols[1]:
                     if st.button("✕", key=f"del_contact_{i}"):
                         st.session_state.emergency_contacts.pop(i)
@@ -894,15 +987,50 @@ elif selected_page == "Emergency Contacts":
     
     # Emergency button
     st.markdown("""
-        <div style="position: fixed; bottom: 2rem; right: 2rem;">
-            <button style="background-color: var(--danger); color: white; border: none; 
-                        border-radius: 50%; width: 60px; height: 60px; font-size: 1.2rem;
-                        box-shadow: 0 4px 15px rgba(220, 53, 69, 0.4); cursor: pointer;
-                        transition: all 0.3s ease;">
-                🆘
-            </button>
+        <div class="card" style="border-left-color: var(--danger);">
+            <h3>🆘 Emergency Alert</h3>
+            <p>Notifies every contact at once, starting with High priority. If nobody responds, the next priority group is alerted.</p>
         </div>
     """, unsafe_allow_html=True)
+    
+    if st.button("🆘 Send SOS Alert", type="primary", disabled=not st.session_state.emergency_contacts):
+        alert = sos_dispatcher.trigger(
+            st.session_state.patient_id,
+            st.session_state.emergency_contacts,
+            f"SOS from patient {st.session_state.patient_id}: please check in immediately."
+        )
+        st.session_state.last_sos_alert = alert["id"]
+        activity_log.record("sos_triggered", {"alert_id": alert["id"]})
+    
+    alert = sos_dispatcher.get(st.session_state.get("last_sos_alert"))
+    if alert:
+        sent_at = datetime.datetime.fromtimestamp(alert["created"]).strftime('%I:%M:%S %p')
+        status_class = "status-completed" if alert["status"] == "acknowledged" else "status-pending"
+        st.markdown(f"""
+            <div style="display: flex; align-items: center; gap: 1rem; margin: 1rem 0;">
+                <strong>Alert sent at {sent_at}</strong>
+                <div class="status-indicator {status_class}">
+                    <span>{alert["status"].capitalize()}{f" by {alert['acknowledged_by']}" if alert["acknowledged_by"] else ""}</span>
+                </div>
+            </div>
+        """, unsafe_allow_html=True)
+        
+        if alert["receipts"]:
+            st.dataframe(
+                pd.DataFrame(alert["receipts"])[["tier", "contact", "channel", "status", "latency_ms"]],
+                use_container_width=True, hide_index=True
+            )
+        
+        cols = st.columns([1, 1])
+        with cols[0]:
+            if st.button("↻ Refresh status"):
+                st.experimental_rerun()
+        with cols[1]:
+            if not alert["acknowledged_by"]:
+                responder = st.selectbox("Responded by", [c["name"] for c in st.session_state.emergency_contacts])
+                if st.button("Mark as acknowledged"):
+                    sos_dispatcher.acknowledge(alert["id"], responder)
+                    st.experimental_rerun()
 
 # ----------------- Health Tips Page -----------------
 elif selected_page == "Health Tips":
@@ -916,156 +1044,58 @@ elif selected_page == "Health Tips":
     """, unsafe_allow_html=True)
     
     if st.session_state.last_prediction:
-        if st.session_state.last_prediction == "VeryMildDemented":
-            tips = [
-                {
-                    "title": "Stay Socially Active",
-                    "icon": "👥",
-                    "content": "Regular social interaction can help maintain cognitive function. Consider joining a club or group activity.",
-                    "category": "Lifestyle"
-                },
-                {
-                    "title": "Mediterranean Diet",
-                    "icon": "🥗",
-                    "content": "A diet rich in fruits, vegetables, whole grains, olive oil, and fish may help slow cognitive decline.",
-                    "category": "Nutrition"
-                },
-                {
-                    "title": "Regular Exercise",
-                    "icon": "🏃‍♂️",
-                    "content": "Aim for at least 30 minutes of moderate exercise most days. Walking, swimming, and yoga are excellent choices.",
-                    "category": "Physical Health"
-                },
-                {
-                    "title": "Cognitive Stimulation",
-                    "icon": "🧩",
-                    "content": "Engage in puzzles, reading, or learning new skills to keep your brain active and challenged.",
-                    "category": "Mental Health"
-                },
-                {
-                    "title": "Sleep Hygiene",
-                    "icon": "🛌",
-                    "content": "Maintain a regular sleep schedule and create a restful environment to support memory consolidation.",
-                    "category": "Lifestyle"
-                },
-                {
-                    "title": "Stress Management",
-                    "icon": "🧘‍♀️",
-                    "content": "Practice relaxation techniques like deep breathing or meditation to reduce stress, which can impact cognition.",
-                    "category": "Mental Health"
-                }
-            ]
-        elif st.session_state.last_prediction == "MildDemented":
-            tips = [
-                {
-                    "title": "Routine Establishment",
-                    "icon": "📅",
-                    "content": "Maintain a consistent daily routine to reduce confusion and provide structure.",
-                    "category": "Lifestyle"
-                },
-                {
-                    "title": "Memory Aids",
-                    "icon": "📝",
-                    "content": "Use calendars, notes, and reminder systems to help with daily tasks and appointments.",
-                    "category": "Tools"
-                },
-                {
-                    "title": "Safe Environment",
-                    "icon": "🏠",
-                    "content": "Remove tripping hazards and consider safety modifications like grab bars in bathrooms.",
-                    "category": "Safety"
-                },
-                {
-                    "title": "Simplify Tasks",
-                    "icon": "✂️",
-                    "content": "Break down complex tasks into smaller, manageable steps to reduce frustration.",
-                    "category": "Strategies"
-                },
-                {
-                    "title": "Therapeutic Activities",
-                    "icon": "🎨",
-                    "content": "Engage in art, music, or reminiscence therapy which can be calming and stimulating.",
-                    "category": "Mental Health"
-                },
-                {
-                    "title": "Caregiver Support",
-                    "icon": "🤝",
-                    "content": "Consider joining a support group for caregivers to share experiences and coping strategies.",
-                    "category": "Support"
-                }
-            ]
+        stage = st.session_state.last_prediction
+        search_col, category_col = st.columns([2, 1])
+        tip_query = search_col.text_input("Search tips", placeholder="E.g., sleep, diet, safety at home", key="tip_query")
+        tip_category = category_col.selectbox("Category", ["All"] + tip_catalog.categories(stage), key="tip_category")
+        tip_category = None if tip_category == "All" else tip_category
+        
+        def turn_tip_page(step):
+            st.session_state.tip_page += step
+        
+        # Start from the first page whenever the filter changes
+        tip_filter = (stage, tip_query.strip(), tip_category)
+        if st.session_state.get("tip_filter") != tip_filter:
+            st.session_state.tip_filter = tip_filter
+            st.session_state.tip_page = 0
+        tip_page = st.session_state.tip_page
+        
+        if tip_query.strip():
+            tip_ids, tip_total = tip_catalog.search(tip_query, stage, tip_category, tip_page)
+            if not tip_total:
+                st.info("No tips match your search.")
         else:
-            tips = [
-                {
-                    "title": "Brain-Healthy Nutrition",
-                    "icon": "🍎",
-                    "content": "Focus on antioxidant-rich foods like berries, leafy greens, and nuts to support brain health.",
-                    "category": "Nutrition"
-                },
-                {
-                    "title": "Regular Check-ups",
-                    "icon": "🩺",
-                    "content": "Schedule regular medical check-ups to monitor overall health and cognitive function.",
-                    "category": "Healthcare"
-                },
-                {
-                    "title": "Mental Stimulation",
-                    "icon": "📚",
-                    "content": "Challenge your brain with new learning experiences, puzzles, or memory games.",
-                    "category": "Mental Health"
-                },
-                {
-                    "title": "Physical Activity",
-                    "icon": "🚶‍♂️",
-                    "content": "Regular physical activity improves blood flow to the brain and may help maintain cognitive function.",
-                    "category": "Physical Health"
-                },
-                {
-                    "title": "Social Engagement",
-                    "icon": "👨‍👩‍👧‍👦",
-                    "content": "Stay connected with friends and family to maintain emotional well-being and cognitive stimulation.",
-                    "category": "Social"
-                },
-                {
-                    "title": "Sleep Quality",
-                    "icon": "😴",
-                    "content": "Prioritize good sleep habits as quality sleep helps with memory consolidation and brain health.",
-                    "category": "Lifestyle"
-                }
-            ]
+            # Ranked for this patient from their recent scores and moods
+            needs, reasons = healthtips.patient_needs(st.session_state.progress)
+            tip_ids = tip_catalog.ranked(stage, needs, tip_category, tip_page)
+            tip_total = tip_catalog.count(stage, tip_category)
+            if reasons:
+                st.caption(f"Prioritized for {', '.join(reasons)}.")
+        
+        page_count = tip_catalog.pages(tip_total)
+        if page_count > 1:
+            first = tip_page * tip_catalog.page_size
+            prev_col, info_col, next_col = st.columns([1, 2, 1])
+            info_col.caption(f"Showing {first + 1}–{first + len(tip_ids)} of {tip_total} tips (page {tip_page + 1} of {page_count})")
+            prev_col.button("← Previous", disabled=tip_page == 0, key="tip_prev",
+                            on_click=turn_tip_page, args=(-1,))
+            next_col.button("Next →", disabled=tip_page + 1 >= page_count, key="tip_next",
+                            on_click=turn_tip_page, args=(1,))
         
         # Display tips in a grid
         cols = st.columns(2)
-        for i, tip in enumerate(tips):
+        for i, tip_id in enumerate(tip_ids):
             with cols[i % 2]:
-                st.markdown(f"""
-                    <div class="card" style="margin-bottom: 1rem;">
-                        <div style="display: flex; align-items: center; gap: 1rem; margin-bottom: 0.5rem;">
-                            <div style="font-size: 1.5rem;">{tip['icon']}</div>
-                            <h4 style="margin: 0;">{tip['title']}</h4>
-                        </div>
-                        <p style="margin: 0.5rem 0; font-size: 0.9rem;">{tip['content']}</p>
-                        <div style="display: flex; justify-content: space-between; align-items: center;">
-                            <span style="font-size: 0.8rem; color: var(--secondary);">{tip['category']}</span>
-                            <button style="background: none; border: none; color: var(--primary); cursor: pointer; font-size: 0.8rem;">
-                                More Info
-                            </button>
-                        </div>
-                    </div>
-                """, unsafe_allow_html=True)
+                st.markdown(tip_catalog.cards[tip_id], unsafe_allow_html=True)
     else:
         st.info("Upload an MRI image to get personalized health tips.")
 
 # ----------------- Progress Tracking Page -----------------
 elif selected_page == "Progress Tracking":
-    st.markdown("""
-        <div style="display: flex; align-items: center; gap: 1rem; margin-bottom: 1.5rem;">
-            <h2>📈 Cognitive Progress Tracking</h2>
-            <div class="status-indicator status-completed">
-                <span>{len(st.session_state.progress)} Records</span>
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render(templates.PAGE_HEADER, {
+        "title": "📈 Cognitive Progress Tracking",
+        "status": f"{len(st.session_state.progress)} Records"
+    }), unsafe_allow_html=True)
     
     col1, col2 = st.columns([1, 2])
     
@@ -1092,7 +1122,7 @@ elif selected_page == "Progress Tracking":
                     "mood": mood,
                     "notes": notes
                 })
-                st.session_state.daily_summary["progress_logged"] = True
+                activity_log.record("progress_logged", {"score": progress_score})
                 st.success("Progress logged successfully!")
     
     with col2:
@@ -1102,28 +1132,33 @@ elif selected_page == "Progress Tracking":
         """, unsafe_allow_html=True)
         
         if st.session_state.progress:
-            # Create DataFrame for visualization
-            progress_df = pd.DataFrame(st.session_state.progress)
-            progress_df['date'] = pd.to_datetime(progress_df['date'])
+            # Build the sorted series once per version of the data
+            progress_version = (id(st.session_state.progress), len(st.session_state.progress))
+            progress_series = st.session_state.get("progress_series")
+            if progress_series is None or progress_series.version != progress_version:
+                progress_series = charts.DownsampledSeries(
+                    [entry["date"] for entry in st.session_state.progress],
+                    [entry["score"] for entry in st.session_state.progress],
+                    progress_version
+                )
+                st.session_state.progress_series = progress_series
             
-            # Line chart for cognitive score
-            st.line_chart(progress_df.set_index('date')['score'], use_container_width=True)
+            # Line chart for cognitive score, downsampled to the visible range
+            first_day, last_day = progress_series.bounds()
+            chart_range = st.radio("Range", list(charts.RANGES.keys()), index=len(charts.RANGES) - 1,
+                                   horizontal=True, key="progress_range")
+            range_start = charts.range_start(last_day, chart_range, first_day)
+            if range_start < last_day:
+                zoom = st.slider("Zoom", min_value=range_start, max_value=last_day,
+                                 value=(range_start, last_day), key=f"progress_zoom_{chart_range}")
+            else:
+                zoom = (range_start, last_day)
+            st.line_chart(progress_series.window(*zoom), use_container_width=True)
             
             # Display recent entries
             st.markdown("### Recent Entries")
-            for entry in sorted(st.session_state.progress, key=lambda x: x['date'], reverse=True)[:3]:
-                st.markdown(f"""
-                    <div style="padding: 0.8rem; margin: 0.5rem 0; background-color: #f8f9fa; border-radius: 8px;">
-                        <div style="display: flex; justify-content: space-between; align-items: center;">
-                            <strong>{entry['date'].strftime('%b %d, %Y')}</strong>
-                            <span style="font-size: 1.2rem;">{entry['mood']}</span>
-                        </div>
-                        <div style="display: flex; align-items: center; gap: 1rem; margin: 0.5rem 0;">
-                            <div style="font-size: 0.9rem;">Score: <strong>{entry['score']}/100</strong></div>
-                        </div>
-                        {f"<div style='font-size: 0.9rem; color: var(--secondary);'>{entry['notes']}</div>" if entry['notes'] else ""}
-                    </div>
-                """, unsafe_allow_html=True)
+            for entry in heapq.nlargest(3, st.session_state.progress, key=lambda x: x['date']):
+                st.markdown(templates.render(templates.PROGRESS_ENTRY, entry), unsafe_allow_html=True)
         else:
             st.markdown("""
                 <div style="text-align: center; padding: 2rem 0; color: var(--secondary); opacity: 0.7;">
@@ -1144,9 +1179,12 @@ elif selected_page == "Daily Summary":
         </div>
     """, unsafe_allow_html=True)
     
+    # Today's view comes straight from the precomputed daily rollup
+    daily_summary = activity.task_status(activity_log.day(), activity.expected_doses(st.session_state.medications))
+    
     # Progress bar
-    total_tasks = len(st.session_state.daily_summary)
-    completed_tasks = sum(st.session_state.daily_summary.values())
+    total_tasks = len(daily_summary)
+    completed_tasks = sum(daily_summary.values())
     progress_percent = int((completed_tasks / total_tasks) * 100)
     
     st.markdown(f"""
@@ -1196,48 +1234,42 @@ elif selected_page == "Daily Summary":
     ]
     
     for task in tasks:
-        is_completed = st.session_state.daily_summary[task["key"]]
+        is_completed = daily_summary[task["key"]]
         
-        if is_completed:
-            task_html = f"""
-            <div class="card" style="margin-bottom: 1rem;">
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <div style="display: flex; align-items: center; gap: 1rem;">
-                        <div style="font-size: 1.5rem;">{task['icon']}</div>
-                        <div>
-                            <h4 style="margin: 0;">{task['title']}</h4>
-                            <p style="margin: 0; font-size: 0.9rem; color: var(--secondary);">{task['description']}</p>
-                        </div>
-                    </div>
+        task_html = f"""
+        <div class="card" style="margin-bottom: 1rem;">
+            <div style="display: flex; justify-content: space-between; align-items: center;">
+                <div style="display: flex; align-items: center; gap: 1rem;">
+                    <div style="font-size: 1.5rem;">{task['icon']}</div>
                     <div>
-                        <span style="color: var(--success); font-size: 1.2rem;">✓</span>
+                        <h4 style="margin: 0;">{task['title']}</h4>
+                        <p style="margin: 0; font-size: 0.9rem; color: var(--secondary);">{task['description']}</p>
                     </div>
                 </div>
-            </div>
-            """
-        else:
-            task_html = f"""
-            <div class="card" style="margin-bottom: 1rem;">
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <div style="display: flex; align-items: center; gap: 1rem;">
-                        <div style="font-size: 1.5rem;">{task['icon']}</div>
-                        <div>
-                            <h4 style="margin: 0;">{task['title']}</h4>
-                            <p style="margin: 0; font-size: 0.9rem; color: var(--secondary);">{task['description']}</p>
-                        </div>
-                    </div>
-                    <div>
-                        <button onclick="window.location.href='#{task['key']}'" 
-                                style="background-color: var(--primary); color: white; border: none; 
-                                       border-radius: 5px; padding: 0.5rem 1rem; cursor: pointer;">
-                            Mark Complete
-                        </button>
-                    </div>
+                <div>
+                    {'<span style="color: var(--success); font-size: 1.2rem;">✓</span>' if is_completed else ''}
                 </div>
             </div>
-            """
+        </div>
+        """
         
-        st.markdown(task_html, unsafe_allow_html=True)
+        cols = st.columns([5, 1])
+        with cols[0]:
+            st.markdown(task_html, unsafe_allow_html=True)
+        with cols[1]:
+            if not is_completed and st.button("Mark Complete", key=f"complete_{task['key']}"):
+                activity_log.record(activity.confirmed_kind(task["key"]))
+                st.experimental_rerun()
+    
+    # Completion history from the per-day rollups
+    st.markdown("### Last 30 Days")
+    today = datetime.date.today()
+    history = activity_log.history(today - datetime.timedelta(days=29), today)
+    history_df = pd.DataFrame({
+        "date": pd.to_datetime([day["day"] for day in history]),
+        "tasks completed": [sum(activity.task_status(day).values()) for day in history]
+    })
+    st.bar_chart(history_df.set_index("date")["tasks completed"], use_container_width=True)
     
     # Daily reflection
     st.markdown("""
@@ -1252,6 +1284,189 @@ elif selected_page == "Daily Summary":
         </div>
     """, unsafe_allow_html=True)
 
+# ----------------- Data Page -----------------
+elif selected_page == "Data":
+    st.markdown("""
+        <div class="card">
+            <h2>🗄️ Records Export & Import</h2>
+            <p>Download this patient's records as Parquet or CSV, or load records exported from another system.</p>
+        </div>
+    """, unsafe_allow_html=True)
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("### Export")
+        export_format = st.radio("Format", ["parquet", "csv"], horizontal=True, key="export_format")
+        patient_record = {table: st.session_state.get(table, []) for table in records.RECORD_TABLES}
+        if st.button("Prepare export", key="prepare_export"):
+            st.session_state.export_archive = records.export_zip([(st.session_state.patient_id, patient_record)], export_format)
+        if st.session_state.get("export_archive"):
+            st.download_button(
+                "Download records", st.session_state.export_archive,
+                file_name=f"{st.session_state.patient_id}_records_{export_format}.zip", mime="application/zip"
+            )
+    
+    with col2:
+        st.markdown("### Import")
+        uploads = st.file_uploader(
+            "Table files (progress, medications, emergency_contacts, notifications, chat_history) or a zip of them",
+            type=["parquet", "csv", "zip"], accept_multiple_files=True
+        )
+        if uploads and st.button("Import records", type="primary", key="import_records"):
+            with tempfile.TemporaryDirectory() as folder:
+                for upload in uploads:
+                    if upload.name.endswith(".zip"):
+                        zipfile.ZipFile(upload).extractall(folder)
+                    else:
+                        with open(os.path.join(folder, os.path.basename(upload.name)), "wb") as f:
+                            f.write(upload.getvalue())
+                loaded, import_report = records.load_patient(folder, st.session_state.patient_id)
+            for table, items in loaded.items():
+                st.session_state.setdefault(table, []).extend(items)
+                records.record_added(activity_log, table, items)
+            st.success(f"Imported {sum(len(items) for items in loaded.values())} records for {st.session_state.patient_id}.")
+            st.dataframe(pd.DataFrame(import_report).T, use_container_width=True)
+    
+    with st.expander("Cohort Export"):
+        st.markdown("Every patient's records from the shared state store, and all activity events from the activity log.")
+        cohort_format = st.radio("Format", ["parquet", "csv"], horizontal=True, key="cohort_format")
+        if st.button("Export patient records", key="cohort_records"):
+            st.session_state.cohort_archive = records.export_zip(shared_state.patients(), cohort_format)
+        if st.session_state.get("cohort_archive"):
+            st.download_button(
+                "Download records", st.session_state.cohort_archive,
+                file_name=f"cohort_records_{cohort_format}.zip", mime="application/zip", key="cohort_records_download"
+            )
+        if st.button("Export activity log", key="cohort_export"):
+            with tempfile.TemporaryDirectory() as folder:
+                event_count = records.export_events(ACTIVITY_DB, folder, cohort_format)
+                with open(os.path.join(folder, f"events.{cohort_format}"), "rb") as f:
+                    st.session_state.cohort_events = f.read()
+            st.caption(f"{event_count} events exported.")
+        if st.session_state.get("cohort_events"):
+            st.download_button(
+                "Download events", st.session_state.cohort_events,
+                file_name=f"activity_events.{cohort_format}", mime="application/octet-stream"
+            )
+
+# ----------------- Admin Page -----------------
+elif selected_page == "Admin":
+    st.markdown("""
+        <div class="card">
+            <h2>🛠️ Session Memory</h2>
+            <p>How much memory each session holds, what it is made of, and where page reruns allocate.</p>
+        </div>
+    """, unsafe_allow_html=True)
+    
+    current_sizes = memprofile.state_sizes(st.session_state, ignore=[shared_state])
+    current_total = memprofile.session_total(st.session_state, ignore=[shared_state])
+    st.markdown("### This Session")
+    st.metric("Session state", f"{current_total / 1024:.1f} KB")
+    st.dataframe(pd.DataFrame(
+        [{"key": key, "type": kind, "KB": round(size / 1024, 1)} for key, (kind, size) in current_sizes.items()]
+    ), use_container_width=True, hide_index=True)
+    
+    st.markdown("### All Sessions")
+    st.caption(f"Published by every replica at most every {memprofile.PUBLISH_INTERVAL_SECONDS} seconds per session.")
+    sessions = memprofile.published_sessions(shared_state)
+    if sessions:
+        st.dataframe(pd.DataFrame([{
+            "session": snapshot["session"],
+            "patient": snapshot["patient_id"],
+            "page": snapshot["page"],
+            "KB": round(snapshot["total_bytes"] / 1024, 1),
+            "largest key": next(iter(snapshot["keys"]), ""),
+            "reruns": snapshot["reruns"],
+            "updated": datetime.datetime.fromtimestamp(snapshot["updated"]).strftime("%H:%M:%S"),
+            "alerts": "; ".join(snapshot["alerts"])
+        } for snapshot in sessions]), use_container_width=True, hide_index=True)
+        for snapshot in sessions:
+            for alert in snapshot["alerts"]:
+                st.warning(f"Session {snapshot['session']}: {alert}")
+    else:
+        st.info("No session sizes published yet.")
+    
+    st.markdown("### Allocations per Page Rerun")
+    tracing = st.checkbox("Trace allocations (slows every rerun on this node)", value=memory_registry.tracing())
+    memory_registry.set_tracing(tracing)
+    for page, allocations in memory_registry.allocations().items():
+        with st.expander(f"{pages.get(page, {}).get('icon', '')} {page}"):
+            st.dataframe(pd.DataFrame(allocations), use_container_width=True, hide_index=True)
+    
+    st.markdown("### Model Versions")
+    models = care_assistant.models
+    model_status = models.status()
+    model_cols = st.columns(3)
+    model_cols[0].metric("Serving", model_status["current"])
+    model_cols[1].metric("Shadow", model_status["shadow"] or "—")
+    model_cols[2].metric("Shadow sample", f"{model_status['shadow_rate']:.0%}")
+    for version in model_status["loading"]:
+        st.info(f"Loading {version} in the background...")
+    for version, error in model_status["errors"].items():
+        st.error(f"{version} failed to load: {error}")
+    
+    versions = classifier.available_versions(models.models_dir)
+    version_col, rate_col = st.columns([2, 1])
+    chosen_version = version_col.selectbox("Version", versions, key="model_version")
+    shadow_rate = rate_col.number_input("Shadow sample rate", min_value=0.0, max_value=1.0, value=0.1, step=0.05, key="shadow_rate")
+    action_cols = st.columns(3)
+    if action_cols[0].button("Promote", key="promote_model"):
+        classifier.write_pointer(models.models_dir, current=chosen_version)
+        st.success(f"{chosen_version} will serve on every replica within {models.poll_seconds} seconds.")
+    if action_cols[1].button("Run in shadow", key="shadow_model"):
+        classifier.write_pointer(models.models_dir, shadow=chosen_version, shadow_rate=shadow_rate)
+        st.success(f"Comparing {chosen_version} on {shadow_rate:.0%} of uploads.")
+    if action_cols[2].button("Stop shadow", key="stop_shadow"):
+        classifier.write_pointer(models.models_dir, shadow=None, shadow_rate=0.0)
+    
+    shadow_report = models.shadow_log.report(time.time() - 24 * 3600)
+    if shadow_report:
+        st.caption("Shadow comparisons over the last 24 hours")
+        st.dataframe(pd.DataFrame(shadow_report), use_container_width=True, hide_index=True)
+    
+    st.markdown("### LLM Usage")
+    ledger = care_assistant.ledger
+    # Include this node's latest calls without waiting for the writer thread
+    ledger.flush()
+    usage_cols = st.columns([1, 2])
+    usage_days = usage_cols[0].number_input("Days", min_value=1, max_value=365, value=7, key="usage_days")
+    usage_by = usage_cols[1].multiselect("Group by", usage.GROUPS, default=["day"], key="usage_by")
+    usage_end = datetime.date.today()
+    usage_start = usage_end - datetime.timedelta(days=int(usage_days) - 1)
+    usage_totals = ledger.rollup(usage_start, usage_end, by=())
+    if usage_totals.empty:
+        st.info("No model calls recorded yet.")
+    else:
+        usage_total = usage_totals.iloc[0]
+        first_token = usage_total["avg_first_token_ms"]
+        usage_metrics = st.columns(5)
+        usage_metrics[0].metric("Model calls", int(usage_total["model_calls"]))
+        usage_metrics[1].metric("Tokens in / out", f"{int(usage_total['input_tokens']):,} / {int(usage_total['output_tokens']):,}")
+        usage_metrics[2].metric("Cost", f"${usage_total['cost_usd']:.2f}")
+        usage_metrics[3].metric("Avg first token", f"{first_token:.0f} ms" if pd.notna(first_token) else "—")
+        usage_metrics[4].metric("Answered from cache", f"{usage_total['cache_hit_rate']:.0%}")
+        st.dataframe(ledger.rollup(usage_start, usage_end, by=usage_by), use_container_width=True, hide_index=True)
+        st.caption("Latency of successful model calls per page")
+        st.dataframe(pd.DataFrame(ledger.latency(usage_start, usage_end)), use_container_width=True, hide_index=True)
+        
+        usage_format = st.radio("Format", ["csv", "parquet"], horizontal=True, key="usage_format")
+        if st.button("Export calls", key="usage_export"):
+            st.session_state.usage_calls = ledger.export(usage_start, usage_end, usage_format)
+        if st.session_state.get("usage_calls"):
+            st.download_button(
+                "Download calls", st.session_state.usage_calls,
+                file_name=f"llm_calls_{usage_start}_{usage_end}.{usage_format}",
+                mime="application/octet-stream", key="usage_download"
+            )
+
+# Write back this run's changes; runs cut short by a rerun are flushed by the next sync
+st.session_state.state_sync.flush(st.session_state)
+memory_registry.record(
+    st.query_params["sid"], selected_page, st.session_state,
+    st.session_state.patient_id, ignore=[shared_state]
+)
+
 # ----------------- Footer -----------------
 st.markdown("""
     <footer style="margin-top: 5rem; padding: 2rem 0; text-align: center; color: var(--secondary); border-top: 1px solid #eee;">
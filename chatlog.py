@@ -0,0 +1,163 @@
+import array
+import base64
+import itertools
+import json
+import zlib
+
+import knowledge
+
+ROLES = ("user", "bot")
+
+# Canned content is kept as a reference, never as a copy per message.
+# Old messages show the current wording if the content is edited.
+CANNED = {f"stage:{stage}": text for stage, text in knowledge.STAGE_EXPLANATIONS.items()}
+CANNED_NAMES = list(CANNED)
+CANNED_TEXTS = [CANNED[name] for name in CANNED_NAMES]
+CANNED_INDEX = {text: i for i, text in enumerate(CANNED_TEXTS)}
+
+# The newest messages stay as plain strings; older ones are compressed this many at a time
+RECENT_MESSAGES = 20
+BLOCK_MESSAGES = 20
+COMPRESSION_LEVEL = 6
+
+
+class Message:
+    """One chat message; reads like the {"role", "content"} dict it replaces."""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self.__slots__ else default
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+
+class ChatHistory:
+    """Append-only chat transcript with a small memory and storage footprint.
+
+    Roles are one byte each, canned explanations are stored as an index into
+    CANNED_TEXTS, and everything but the last RECENT_MESSAGES messages is kept
+    as zlib-compressed blocks. Iterating and indexing give Message objects, and
+    append() takes the same dicts the pages always used.
+    """
+
+    __slots__ = ("blocks", "roles", "texts")
+
+    def __init__(self, messages=()):
+        self.blocks = []
+        self.roles = array.array("B")
+        # str, or int for canned content
+        self.texts = []
+        self.extend(messages)
+
+    @classmethod
+    def of(cls, value):
+        """A ChatHistory from a stored value; plain lists are converted, anything else starts empty."""
+        if isinstance(value, cls):
+            return value
+        return cls(value if isinstance(value, list) else ())
+
+    # ----- Writing -----
+    def append(self, message):
+        self.roles.append(ROLES.index(message["role"]))
+        content = message["content"]
+        self.texts.append(CANNED_INDEX.get(content, content))
+        if len(self.texts) >= RECENT_MESSAGES + BLOCK_MESSAGES:
+            self._compress_oldest()
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def _compress_oldest(self):
+        packed = [[role, _pack(text)] for role, text in zip(self.roles[:BLOCK_MESSAGES], self.texts[:BLOCK_MESSAGES])]
+        raw = json.dumps(packed, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.blocks.append(zlib.compress(raw, COMPRESSION_LEVEL))
+        del self.roles[:BLOCK_MESSAGES]
+        del self.texts[:BLOCK_MESSAGES]
+
+    # ----- Reading -----
+    def __len__(self):
+        return len(self.blocks) * BLOCK_MESSAGES + len(self.texts)
+
+    def __iter__(self):
+        return self.messages()
+
+    def messages(self, start=0):
+        """Messages from position start on, only decompressing the blocks that are needed."""
+        first_block = start // BLOCK_MESSAGES
+        for i, block in enumerate(self.blocks[first_block:], first_block):
+            for role, text in _unpack_block(block)[max(start - i * BLOCK_MESSAGES, 0):]:
+                yield Message(ROLES[role], _unpack(text))
+        recent = zip(self.roles, self.texts)
+        for role, text in itertools.islice(recent, max(start - len(self.blocks) * BLOCK_MESSAGES, 0), None):
+            yield Message(ROLES[role], _text(text))
+
+    def __getitem__(self, index):
+        if not isinstance(index, int):
+            raise TypeError("ChatHistory indices must be integers")
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("chat history index out of range")
+        offset = index - len(self.blocks) * BLOCK_MESSAGES
+        if offset >= 0:
+            return Message(ROLES[self.roles[offset]], _text(self.texts[offset]))
+        role, text = _unpack_block(self.blocks[index // BLOCK_MESSAGES])[index % BLOCK_MESSAGES]
+        return Message(ROLES[role], _unpack(text))
+
+    # ----- Storage -----
+    def dump(self):
+        return {
+            "blocks": [base64.b64encode(block).decode("ascii") for block in self.blocks],
+            "recent": [[role, _pack(text)] for role, text in zip(self.roles, self.texts)]
+        }
+
+    @classmethod
+    def load(cls, data):
+        history = cls()
+        history.blocks = [base64.b64decode(block) for block in data["blocks"]]
+        history.roles = array.array("B", (role for role, _ in data["recent"]))
+        history.texts = [_intern(text) for _, text in data["recent"]]
+        return history
+
+
+def _text(text):
+    return CANNED_TEXTS[text] if isinstance(text, int) else text
+
+
+def _pack(text):
+    # Canned content is persisted by name, which stays stable when the list changes
+    return {"ref": CANNED_NAMES[text]} if isinstance(text, int) else text
+
+
+def _unpack(text):
+    return CANNED.get(text["ref"], "") if isinstance(text, dict) else text
+
+
+def _intern(text):
+    if isinstance(text, dict):
+        return CANNED_INDEX.get(_unpack(text), "")
+    return text
+
+
+def _unpack_block(block):
+    return json.loads(zlib.decompress(block))
+
+
+def merge(base, local, remote):
+    """Chat is append-only: the newest stored history plus the messages this session added since base."""
+    merged = ChatHistory.of(remote)
+    merged.extend(local.messages(len(base)))
+    return merged
@@ -0,0 +1,357 @@
+import argparse
+import importlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import db
+
+MODELS_DIR = "models"
+# {"current": version, "shadow": version or null, "shadow_rate": 0..1}, rewritten atomically
+REGISTRY_FILE = "registry.json"
+SHADOW_DB = "data/shadow.sqlite3"
+
+# Built in, needs no files: the placeholder used until a trained model ships
+BASELINE = "baseline"
+
+POLL_SECONDS = 5
+# A version that failed to load is tried again after this long, even if the registry is unchanged
+LOAD_RETRY_SECONDS = 60
+# Shadow comparisons waiting beyond this are dropped rather than queued
+SHADOW_BACKLOG = 8
+WARMUP_SIZE = (224, 224)
+
+# Embedding for versions without one of their own: a small normalized
+# grayscale thumbnail, enough to find near-identical and similar-looking slices
+THUMBNAIL_EMBEDDING = "thumbnail16"
+THUMBNAIL_SIZE = (16, 16)
+
+
+def baseline(path):
+    # Dummy model prediction
+    return lambda image: "VeryMildDemented"
+
+
+def thumbnail_embedding(image):
+    pixels = np.asarray(image.convert("L").resize(THUMBNAIL_SIZE, Image.BILINEAR), dtype=np.float32).ravel()
+    pixels -= pixels.mean()
+    return pixels / max(float(np.linalg.norm(pixels)), 1e-6)
+
+
+# ----------------- Versions -----------------
+class ModelVersion:
+    def __init__(self, name, predict, load_seconds):
+        self.name = name
+        self.predict = predict
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        # Vectors are only comparable within one embedding space
+        self.embed = getattr(predict, "embed", thumbnail_embedding)
+        self.embedding = name if hasattr(predict, "embed") else THUMBNAIL_EMBEDDING
+
+    def timed_predict(self, image):
+        started = time.perf_counter()
+        label = self.predict(image)
+        return label, (time.perf_counter() - started) * 1000
+
+    def predict_batch(self, images):
+        batched = getattr(self.predict, "predict_batch", None)
+        return list(batched(images)) if batched else [self.predict(image) for image in images]
+
+
+def load_version(name, models_dir=MODELS_DIR):
+    """Load and warm up one version.
+
+    A version is a folder under models_dir whose manifest.json names a loader as
+    "module:function". The loader gets the folder path and returns a callable
+    from an RGB PIL image to a stage label. The callable may also have a
+    predict_batch attribute taking a list of images, used by batch re-scoring,
+    and an embed attribute returning a feature vector for an image, used to
+    find similar scans.
+    """
+    if name == BASELINE:
+        entry, path = "classifier:baseline", None
+    else:
+        path = os.path.join(models_dir, name)
+        with open(os.path.join(path, "manifest.json")) as f:
+            entry = json.load(f)["entry"]
+    module, function = entry.split(":")
+    started = time.perf_counter()
+    predict = getattr(importlib.import_module(module), function)(path)
+    # The first call is often much slower (lazy init, kernel compilation); pay it before serving
+    predict(Image.new("RGB", WARMUP_SIZE))
+    return ModelVersion(name, predict, time.perf_counter() - started)
+
+
+def available_versions(models_dir=MODELS_DIR):
+    found = []
+    if os.path.isdir(models_dir):
+        found = sorted(
+            name for name in os.listdir(models_dir)
+            if os.path.exists(os.path.join(models_dir, name, "manifest.json"))
+        )
+    return [BASELINE] + found
+
+
+def read_pointer(models_dir=MODELS_DIR):
+    path = os.path.join(models_dir, REGISTRY_FILE)
+    pointer = {"current": BASELINE, "shadow": None, "shadow_rate": 0.0}
+    if os.path.exists(path):
+        with open(path) as f:
+            pointer.update(json.load(f))
+    return pointer
+
+
+def write_pointer(models_dir=MODELS_DIR, **changes):
+    """Change which versions serve; every process picks it up within POLL_SECONDS."""
+    pointer = read_pointer(models_dir)
+    pointer.update(changes)
+    os.makedirs(models_dir, exist_ok=True)
+    path = os.path.join(models_dir, REGISTRY_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(pointer, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return pointer
+
+
+# ----------------- Registry -----------------
+class ModelRegistry:
+    """The serving classifier of this process, hot-swapped from the registry file.
+
+    A watcher thread polls the registry file. New versions are loaded and warmed
+    up in the background while the old one keeps serving, then swapped in with a
+    single reference assignment, so a request always runs on one whole version.
+    A version that fails to load is reported, the previous one stays, and the
+    load is retried every LOAD_RETRY_SECONDS while the registry still asks for it.
+
+    With a shadow version set, a sample of live predictions is repeated on it by
+    one background worker, and both labels and latencies go to SQLite.
+    """
+
+    def __init__(self, models_dir=MODELS_DIR, shadow_db=SHADOW_DB, poll_seconds=POLL_SECONDS):
+        self.models_dir = models_dir
+        self.shadow_log = ShadowLog(shadow_db)
+        self.poll_seconds = poll_seconds
+        self.lock = threading.Lock()
+        self.pointer = read_pointer(models_dir)
+        self.errors = {}
+        self.failed_at = {}
+        self.loading = set()
+        try:
+            self.current = load_version(self.pointer["current"], models_dir)
+        except Exception as e:
+            self.errors[self.pointer["current"]] = str(e)
+            self.failed_at[self.pointer["current"]] = time.time()
+            self.current = load_version(BASELINE)
+        self.shadow = None
+        self.shadow_rate = 0.0
+        self.shadow_pending = 0
+        self.shadow_dropped = 0
+        self.shadow_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow-model")
+        self._apply_shadow(self.pointer)
+        threading.Thread(target=self._watch, daemon=True, name="model-registry").start()
+
+    # ----- Swapping -----
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.refresh()
+            except Exception:
+                # A half-written or unreadable registry file is retried next poll
+                pass
+
+    def refresh(self):
+        # Compared with what actually serves, not the last pointer read, so a
+        # version that failed to load is picked up again
+        pointer = read_pointer(self.models_dir)
+        with self.lock:
+            self.pointer = pointer
+        if pointer["current"] != self.current.name:
+            self._load_in_background(pointer["current"], self._promote)
+        self._apply_shadow(pointer)
+
+    def _apply_shadow(self, pointer):
+        name = pointer.get("shadow")
+        self.shadow_rate = float(pointer.get("shadow_rate") or 0.0)
+        if not name:
+            self.shadow = None
+        elif self.shadow is None or self.shadow.name != name:
+            self._load_in_background(name, self._set_shadow)
+
+    def _load_in_background(self, name, on_loaded):
+        with self.lock:
+            if name in self.loading or time.time() - self.failed_at.get(name, 0) < LOAD_RETRY_SECONDS:
+                return
+            self.loading.add(name)
+
+        def load():
+            try:
+                version = load_version(name, self.models_dir)
+                self.errors.pop(name, None)
+                self.failed_at.pop(name, None)
+                on_loaded(version)
+            except Exception as e:
+                self.errors[name] = str(e)
+                self.failed_at[name] = time.time()
+            finally:
+                with self.lock:
+                    self.loading.discard(name)
+
+        threading.Thread(target=load, daemon=True, name=f"load-model-{name}").start()
+
+    def _promote(self, version):
+        # Only swap if the registry still asks for this version
+        if self.pointer["current"] == version.name:
+            self.current = version
+
+    def _set_shadow(self, version):
+        if self.pointer.get("shadow") == version.name:
+            self.shadow = version
+
+    # ----- Serving -----
+    def predict(self, image_bytes):
+        return self.classify(image_bytes)[0]
+
+    def classify(self, image_bytes):
+        """(label, name of the version that produced it)."""
+        return self.analyse(image_bytes, embed=False)[:2]
+
+    def analyse(self, image_bytes, embed=True):
+        """(label, version name, embedding space, embedding), the embedding None when not asked for."""
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        # Read each reference once so a swap mid-request cannot mix versions
+        current = self.current
+        label, latency_ms = current.timed_predict(image)
+        shadow = self.shadow
+        if shadow is not None and shadow.name != current.name and random.random() < self.shadow_rate:
+            self._compare_in_background(shadow, image, current.name, label, latency_ms)
+        return label, current.name, current.embedding, current.embed(image) if embed else None
+
+    def _compare_in_background(self, shadow, image, current_name, label, latency_ms):
+        with self.lock:
+            if self.shadow_pending >= SHADOW_BACKLOG:
+                self.shadow_dropped += 1
+                return
+            self.shadow_pending += 1
+
+        def compare():
+            try:
+                shadow_label, shadow_ms = shadow.timed_predict(image)
+                self.shadow_log.record(current_name, label, latency_ms, shadow.name, shadow_label, shadow_ms)
+            except Exception as e:
+                self.shadow_log.record(current_name, label, latency_ms, shadow.name, None, None, error=str(e))
+            finally:
+                with self.lock:
+                    self.shadow_pending -= 1
+
+        self.shadow_worker.submit(compare)
+
+    def status(self):
+        return {
+            "current": self.current.name,
+            "current_loaded_at": self.current.loaded_at,
+            "shadow": self.shadow.name if self.shadow else None,
+            "shadow_rate": self.shadow_rate,
+            "requested": dict(self.pointer),
+            "loading": sorted(self.loading),
+            "errors": dict(self.errors),
+            "shadow_pending": self.shadow_pending,
+            "shadow_dropped": self.shadow_dropped
+        }
+
+
+# ----------------- Shadow Results -----------------
+class ShadowLog:
+    """Paired current/shadow predictions, shared by every process on the node."""
+
+    def __init__(self, path):
+        self.path = path
+        db.prepare(path)
+        with db.connect(path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS comparisons (
+                    ts REAL, current TEXT, current_label TEXT, current_ms REAL,
+                    shadow TEXT, shadow_label TEXT, shadow_ms REAL, error TEXT
+                )
+            """)
+
+    def record(self, current, current_label, current_ms, shadow, shadow_label, shadow_ms, error=None):
+        with db.connect(self.path) as conn:
+            conn.execute(
+                "INSERT INTO comparisons VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), current, current_label, current_ms, shadow, shadow_label, shadow_ms, error)
+            )
+
+    def report(self, since=0):
+        """Agreement and latency per (current, shadow) pair."""
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT current, shadow, current_label, shadow_label, current_ms, shadow_ms, error "
+                "FROM comparisons WHERE ts >= ?", (since,)
+            ).fetchall()
+        pairs = {}
+        for row in rows:
+            pairs.setdefault((row[0], row[1]), []).append(row[2:])
+        report = []
+        for (current, shadow), results in sorted(pairs.items()):
+            ok = [r for r in results if r[4] is None]
+            current_ms = np.array([r[2] for r in ok], dtype=float)
+            shadow_ms = np.array([r[3] for r in ok], dtype=float)
+            report.append({
+                "current": current,
+                "shadow": shadow,
+                "samples": len(results),
+                "errors": len(results) - len(ok),
+                "agreement": round(sum(r[0] == r[1] for r in ok) / len(ok), 4) if ok else None,
+                "current_p50_ms": _percentile(current_ms, 50),
+                "current_p95_ms": _percentile(current_ms, 95),
+                "shadow_p50_ms": _percentile(shadow_ms, 50),
+                "shadow_p95_ms": _percentile(shadow_ms, 95)
+            })
+        return report
+
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)), 2) if len(values) else None
+
+
+# ----------------- Command Line -----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classifier versions served by the app and the API")
+    parser.add_argument("--models-dir", default=MODELS_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Show available and requested versions")
+    promote = commands.add_parser("promote", help="Serve this version everywhere")
+    promote.add_argument("version")
+    shadow = commands.add_parser("shadow", help="Compare a candidate on a sample of live uploads")
+    shadow.add_argument("version", nargs="?", help="Omit to stop shadowing")
+    shadow.add_argument("--rate", type=float, default=0.1)
+    report = commands.add_parser("report", help="Agreement and latency of shadow runs")
+    report.add_argument("--db", default=SHADOW_DB)
+    report.add_argument("--hours", type=float, default=24)
+    args = parser.parse_args(argv)
+
+    if args.command in ("promote", "shadow") and args.version:
+        # Fail here rather than in every serving process
+        load_version(args.version, args.models_dir)
+    if args.command == "status":
+        result = {"available": available_versions(args.models_dir), "requested": read_pointer(args.models_dir)}
+    elif args.command == "promote":
+        result = write_pointer(args.models_dir, current=args.version)
+    elif args.command == "shadow":
+        result = write_pointer(args.models_dir, shadow=args.version, shadow_rate=args.rate if args.version else 0.0)
+    else:
+        result = ShadowLog(args.db).report(time.time() - args.hours * 3600)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+
+def prepare(path):
+    """Create the database's folder and switch it to WAL, so readers never wait on the writer.
+
+    WAL is a property of the file, so once is enough for every later connection.
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with connect(path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+
+
+@contextmanager
+def connect(path):
+    """A connection in autocommit mode; writers open their own BEGIN IMMEDIATE transactions."""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        yield conn
+    finally:
+        conn.close()
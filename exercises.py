@@ -0,0 +1,85 @@
+import os
+import statistics
+import uuid
+
+import streamlit.components.v1 as components
+
+# ----------------- Exercise Catalog -----------------
+EXERCISES = {
+    "digit_span": {
+        "title": "🔢 Memory Game",
+        "description": "Remember the digits shown one at a time, then type them in order. Each correct answer adds a digit.",
+        "min_level": 3,
+        "max_level": 9
+    },
+    "reaction": {
+        "title": "⚡ Reaction Time",
+        "description": "Tap the circle as soon as it turns green. At higher levels, hold back when it turns red.",
+        "min_level": 1,
+        "max_level": 5
+    },
+    "color_match": {
+        "title": "🎨 Color Match",
+        "description": "Pick the color of the ink, not the word you read. Higher levels give less time.",
+        "min_level": 1,
+        "max_level": 5
+    }
+}
+
+# The game loop runs in the browser and posts back one result per game
+_component = components.declare_component(
+    "cognitive_exercises",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "cognitive_exercises")
+)
+
+
+def new_game_id():
+    return uuid.uuid4().hex
+
+
+def exercise_game(exercise, level, game_id, key=None):
+    info = EXERCISES[exercise]
+    return _component(
+        exercise=exercise,
+        level=level,
+        game_id=game_id,
+        title=info["title"],
+        description=info["description"],
+        key=key,
+        default=None
+    )
+
+
+# ----------------- Scoring -----------------
+def summarize(result):
+    trials = result.get("trials") or []
+    reaction_times = [t["rt_ms"] for t in trials if t.get("correct") and t.get("rt_ms") is not None]
+    correct = sum(1 for t in trials if t.get("correct"))
+    return {
+        "exercise": result["exercise"],
+        "level": result["level"],
+        "trials": len(trials),
+        "correct": correct,
+        "accuracy": correct / len(trials) if trials else 0.0,
+        "median_rt_ms": statistics.median(reaction_times) if reaction_times else None,
+        "mean_rt_ms": round(statistics.mean(reaction_times)) if reaction_times else None,
+        "duration_ms": result.get("duration_ms"),
+        "max_span": result.get("max_span")
+    }
+
+
+def next_level(exercise, summaries):
+    """Staircase difficulty from the latest result of this exercise."""
+    info = EXERCISES[exercise]
+    latest = next((s for s in reversed(summaries) if s["exercise"] == exercise), None)
+    if latest is None:
+        return info["min_level"]
+    level = latest["level"]
+    if exercise == "digit_span" and latest.get("max_span"):
+        # Start one below the longest span recalled so the first round is a warm-up
+        level = latest["max_span"] - 1
+    elif latest["accuracy"] >= 0.8:
+        level += 1
+    elif latest["accuracy"] < 0.5:
+        level -= 1
+    return max(info["min_level"], min(info["max_level"], level))
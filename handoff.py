@@ -0,0 +1,186 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+
+import chatlog
+import knowledge
+import llm
+import ratelimit
+import scans
+import state
+import usage
+
+# A conversation is summarized once it has been quiet this long
+IDLE_SECONDS = 60
+# New messages folded into the summary per model call
+DELTA_MESSAGES = 40
+MESSAGE_CHARS = 800
+# Patients summarized per pass of the worker before it checks the queue again
+BATCH_PATIENTS = 8
+
+
+def summary_key(patient_id):
+    return f"summary:{patient_id}"
+
+
+def summary_prompt(previous, messages, prediction=None):
+    lines = ["You keep a running handoff note for the clinician of a patient using a dementia care assistant."]
+    if prediction:
+        lines.append(f"The patient's most recent MRI analysis showed {knowledge.STAGE_LABELS.get(prediction, prediction)}.")
+    lines.append("Current note:")
+    lines.append(previous or "(none yet)")
+    lines.append("New messages since the note was written:")
+    for message in messages:
+        speaker = "Patient/caregiver" if message.role == "user" else "Assistant"
+        lines.append(f"{speaker}: {knowledge.strip_html(message.content)[:MESSAGE_CHARS]}")
+    lines.append(
+        "Rewrite the note to include anything clinically relevant from the new messages: symptoms, "
+        "concerns, medication questions, mood, safety issues and open questions. Keep what still matters "
+        "from the current note. Use short bullet points, under 200 words."
+    )
+    return "\n".join(lines)
+
+
+class Summarizer:
+    """Background, incremental chat summaries for clinician handoff.
+
+    notify() queues a patient after a chat turn. Once the conversation has been
+    idle for idle_seconds, a worker folds only the messages added since the last
+    summary into it, at background priority on the shared Gemini quota. Summaries
+    live in the shared store under summary:{patient_id} with the number of
+    messages they cover, so any replica can serve or extend them.
+    """
+
+    def __init__(self, store, model, limiter, ledger=None, idle_seconds=IDLE_SECONDS):
+        self.store = store
+        self.model = model
+        self.limiter = limiter
+        self.ledger = ledger
+        self.idle_seconds = idle_seconds
+        self.cond = threading.Condition()
+        # patient_id -> monotonic time of the latest chat turn
+        self.pending = {}
+        self.stats = {"summaries": 0, "model_calls": 0, "errors": 0}
+        threading.Thread(target=self._run, daemon=True, name="handoff-summaries").start()
+
+    def notify(self, patient_id):
+        with self.cond:
+            self.pending[patient_id] = time.monotonic()
+            self.cond.notify()
+
+    def get(self, patient_id):
+        """The stored summary, or None; never calls the model."""
+        return self.store.get(summary_key(patient_id))[1]
+
+    def _due(self):
+        now = time.monotonic()
+        due = [pid for pid, last in self.pending.items() if now - last >= self.idle_seconds][:BATCH_PATIENTS]
+        for patient_id in due:
+            del self.pending[patient_id]
+        wait = min((self.idle_seconds - (now - last) for last in self.pending.values()), default=None)
+        return due, wait
+
+    def _run(self):
+        while True:
+            with self.cond:
+                due, wait = self._due()
+                while not due:
+                    self.cond.wait(wait)
+                    due, wait = self._due()
+            for patient_id in due:
+                try:
+                    self.summarize(patient_id)
+                except Exception:
+                    # Retried with the patient's next chat turn or catch-up run
+                    self.stats["errors"] += 1
+
+    def summarize(self, patient_id):
+        """Bring the patient's summary up to date with their chat history and return it."""
+        key = summary_key(patient_id)
+        version, summary = self.store.get(key)
+        _, history = self.store.get(f"patient:{patient_id}:chat_history")
+        history = chatlog.ChatHistory.of(history)
+        through = summary["through"] if summary else 0
+        if len(history) <= through:
+            return summary
+
+        _, patient_scans = self.store.get(f"patient:{patient_id}:scans")
+        prediction = scans.latest_prediction(patient_scans or [])
+        text = summary["text"] if summary else ""
+        # Only the delta is read, from the compressed history, a batch of messages at a time
+        delta = history.messages(through)
+        while True:
+            batch = list(itertools.islice(delta, DELTA_MESSAGES))
+            if not batch:
+                break
+            prompt = summary_prompt(text, batch, prediction)
+            text = "".join(llm.limited_stream(
+                self.model, prompt, self.limiter, patient_id, ratelimit.PRIORITY_BACKGROUND,
+                ledger=self.ledger, page="Handoff"
+            )).strip()
+            through += len(batch)
+            self.stats["model_calls"] += 1
+
+        updated = {
+            "text": text,
+            "through": through,
+            "revision": (summary["revision"] if summary else 0) + 1,
+            "model": self.model.model_name,
+            "updated": time.time()
+        }
+        try:
+            self.store.set(key, updated, version)
+        except state.VersionConflict:
+            # Another replica summarized the same turns meanwhile; keep theirs
+            return self.get(patient_id)
+        self.stats["summaries"] += 1
+        return updated
+
+
+def stale_patients(store):
+    """Patients whose chat history has grown past their summary."""
+    for key in store.backend.keys("patient:*:chat_history"):
+        patient_id = key.split(":")[1]
+        _, history = store.get(key)
+        summary = store.get(summary_key(patient_id))[1]
+        if len(chatlog.ChatHistory.of(history)) > (summary["through"] if summary else 0):
+            yield patient_id
+
+
+# ----------------- Command Line -----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clinician handoff summaries")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("catch-up", help="Summarize every patient with unsummarized chat turns")
+    show = commands.add_parser("show", help="Print a patient's stored summary")
+    show.add_argument("patient_id")
+    args = parser.parse_args(argv)
+
+    # Same settings and model choice as the HTTP API
+    import api
+    import assistant
+    store = state.SharedState(state.open_backend(api.setting("STATE_BACKEND", "sqlite:///data/state.sqlite3")), cache_ttl=0)
+    if args.command == "show":
+        print(json.dumps(store.get(summary_key(args.patient_id))[1], indent=2))
+        return
+
+    assistant.configure(api.setting("GOOGLE_API_KEY"), api.setting("GEMINI_ENDPOINT"))
+    model = assistant.chat_model(api.setting("LLM_BACKEND", "gemini"), api.setting)
+    limiter = ratelimit.TokenBucket(
+        assistant.RATE_LIMIT_DB,
+        rpm=int(api.setting("GEMINI_RPM", 60)),
+        tpm=int(api.setting("GEMINI_TPM", 1000000))
+    )
+    summarizer = Summarizer(store, model, limiter, usage.Ledger(usage.USAGE_DB))
+    done = 0
+    for patient_id in stale_patients(store):
+        summary = summarizer.summarize(patient_id)
+        done += 1
+        print(f"{patient_id}: {summary['through']} messages, revision {summary['revision']}")
+    print(f"{done} summaries updated, {summarizer.stats['model_calls']} model calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import heapq
+import json
+import os
+
+import numpy as np
+
+import knowledge
+import records
+import templates
+
+# Extra tips, one JSON object per line: title, icon, content, category, and
+# optionally stages (omit for every stage) and priority
+TIPS_FILE = "tips.jsonl"
+
+PAGE_SIZE = 10
+
+# Tips written for the patient's stage rank above general ones
+STAGE_MATCH_BOOST = 1.5
+
+# ----------------- Personalization -----------------
+RECENT_ENTRIES = 14
+LOW_MOOD = 1.5
+LOW_SCORE = 50
+# Score points per day
+DECLINE_SLOPE = -0.3
+
+NEED_BOOST = 1.6
+NEED_CATEGORIES = {
+    "low_mood": ["Mental Health", "Social", "Support", "Lifestyle"],
+    "declining": ["Mental Health", "Healthcare", "Tools", "Strategies"],
+    "low_score": ["Safety", "Tools", "Strategies", "Support"],
+    "steady": ["Physical Health", "Nutrition", "Social"]
+}
+NEED_REASONS = {
+    "low_mood": "recent low mood",
+    "declining": "declining cognitive scores",
+    "low_score": "low recent scores",
+    "steady": "steady scores, so prevention"
+}
+
+
+def patient_needs(progress):
+    """Category weights from the patient's latest progress entries, plus the reasons behind them."""
+    recent = heapq.nlargest(RECENT_ENTRIES, progress, key=lambda entry: entry["date"])
+    if not recent:
+        return {}, []
+    needs = []
+    moods = [records.MOODS.index(entry["mood"]) for entry in recent if entry.get("mood") in records.MOODS]
+    if moods and sum(moods) / len(moods) <= LOW_MOOD:
+        needs.append("low_mood")
+    scores = np.array([entry["score"] for entry in recent], dtype=float)
+    if scores.mean() < LOW_SCORE:
+        needs.append("low_score")
+    if len(recent) >= 3:
+        days = np.array([(entry["date"] - recent[-1]["date"]).days for entry in recent], dtype=float)
+        if np.ptp(days) > 0 and np.polyfit(days, scores, 1)[0] <= DECLINE_SLOPE:
+            needs.append("declining")
+    if not needs:
+        needs.append("steady")
+
+    weights = {}
+    for need in needs:
+        for category in NEED_CATEGORIES[need]:
+            weights[category] = weights.get(category, 1.0) * NEED_BOOST
+    return weights, [NEED_REASONS[need] for need in needs]
+
+
+# ----------------- Catalog -----------------
+class TipCatalog:
+    """Every health tip, indexed by stage and category, with full-text search.
+
+    Cards are rendered once when the catalog is built, and each (stage, category)
+    list is sorted by base rank up front. Ranking a page therefore only looks at
+    the head of each category list, however many tips the catalog holds.
+    """
+
+    def __init__(self, tips, page_size=PAGE_SIZE):
+        self.tips = tips
+        self.page_size = page_size
+        self.cards = [templates.TIP_CARD.render(tip) for tip in tips]
+        self.stages = list(knowledge.STAGE_LABELS)
+
+        # stage -> category -> [(base score, tip id)], best first
+        self.by_stage = {}
+        for stage in self.stages:
+            categories = {}
+            for tip_id, tip in enumerate(tips):
+                if tip["stages"] and stage not in tip["stages"]:
+                    continue
+                base = tip["priority"] * (STAGE_MATCH_BOOST if stage in tip["stages"] else 1.0)
+                categories.setdefault(tip["category"], []).append((base, tip_id))
+            for entries in categories.values():
+                entries.sort(key=lambda entry: (-entry[0], entry[1]))
+            self.by_stage[stage] = categories
+        self.default_order = {stage: self._rank(stage, {}, None, page_size) for stage in self.stages}
+
+        self.index = knowledge.KnowledgeIndex([
+            {
+                "title": tip["title"],
+                "text": f"{tip['content']} {tip['category']}",
+                "source": f"Health Tips • {tip['category']}",
+                "stage": None,
+                "tip_id": tip_id
+            }
+            for tip_id, tip in enumerate(tips)
+        ])
+
+    def categories(self, stage):
+        return sorted(self.by_stage.get(stage, {}))
+
+    def count(self, stage, category=None):
+        categories = self.by_stage.get(stage, {})
+        if category:
+            return len(categories.get(category, []))
+        return sum(len(entries) for entries in categories.values())
+
+    def _rank(self, stage, weights, category, k):
+        categories = self.by_stage.get(stage, {})
+        names = [category] if category else list(categories)
+        candidates = [
+            (base * weights.get(name, 1.0), -tip_id, tip_id)
+            for name in names
+            for base, tip_id in categories.get(name, [])[:k]
+        ]
+        return [tip_id for _, _, tip_id in heapq.nlargest(k, candidates)]
+
+    def pages(self, total):
+        return max(1, -(-total // self.page_size))
+
+    def ranked(self, stage, weights=None, category=None, page=0):
+        """Tip ids for one page, best first."""
+        if not page and not weights and category is None and stage in self.default_order:
+            return self.default_order[stage]
+        start = page * self.page_size
+        return self._rank(stage, weights or {}, category, start + self.page_size)[start:]
+
+    def search(self, query, stage, category=None, page=0):
+        """Tip ids for one page of search results, and how many tips matched."""
+        hits = self.index.search(query, k=len(self.tips))
+        results = []
+        for hit in hits:
+            tip = self.tips[hit["tip_id"]]
+            if tip["stages"] and stage not in tip["stages"]:
+                continue
+            if category and tip["category"] != category:
+                continue
+            results.append(hit["tip_id"])
+        start = page * self.page_size
+        return results[start:start + self.page_size], len(results)
+
+
+def builtin_tips():
+    tips = []
+    for stage, stage_tips in knowledge.STAGE_TIPS.items():
+        tips += [{**tip, "stages": [stage], "priority": 1.0} for tip in stage_tips]
+    tips += [{**tip, "stages": [], "priority": 1.0} for tip in knowledge.DEFAULT_TIPS]
+    return tips
+
+
+def file_tips(path):
+    tips = []
+    if not os.path.exists(path):
+        return tips
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            tip = json.loads(line)
+            tips.append({
+                "title": tip["title"],
+                "icon": tip.get("icon", "💡"),
+                "content": tip["content"],
+                "category": tip.get("category", "General"),
+                "stages": tip.get("stages") or [],
+                "priority": float(tip.get("priority", 1.0))
+            })
+    return tips
+
+
+def load_catalog(folder=None):
+    return TipCatalog(builtin_tips() + (file_tips(os.path.join(folder, TIPS_FILE)) if folder else []))
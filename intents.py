@@ -0,0 +1,263 @@
+import datetime
+import re
+
+import adherence
+
+# ----------------- Slot Patterns -----------------
+TIME_RE = re.compile(r"\b(?:at\s+)?(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?(?=\W|$)", re.I)
+NAMED_TIMES = {"noon": datetime.time(12, 0), "midday": datetime.time(12, 0), "midnight": datetime.time(0, 0),
+               "morning": datetime.time(8, 0), "evening": datetime.time(18, 0), "bedtime": datetime.time(21, 0)}
+DOSAGE_RE = re.compile(r"\b(\d{1,4})\s*(?:mg|milligrams?)\b", re.I)
+PHONE_RE = re.compile(r"(\+?\d[\d\s().-]{6,}\d)")
+SCORE_RE = re.compile(r"\b(\d{1,3})(?:\s*(?:/|out of)\s*(\d{1,3}))?\b", re.I)
+DATE_RE = re.compile(r"\b(?:on\s+)?(?:(\d{4}-\d{1,2}-\d{1,2})|([A-Za-z]{3,9}\.?\s+\d{1,2}(?:st|nd|rd|th)?(?:,?\s+\d{4})?))\b", re.I)
+DATE_FORMATS = ["%B %d %Y", "%b %d %Y", "%B %d", "%b %d"]
+
+REMINDER_FREQUENCIES = [
+    ("weekday", "Weekdays"), ("weekend", "Weekends"), ("weekly", "Weekly"),
+    ("every week", "Weekly"), ("daily", "Daily"), ("every day", "Daily")
+]
+MEDICATION_FREQUENCIES = [
+    ("three times", "Three times daily"), ("3 times", "Three times daily"), ("thrice", "Three times daily"),
+    ("twice", "Twice daily"), ("two times", "Twice daily"), ("2 times", "Twice daily"),
+    ("as needed", "As needed"), ("when needed", "As needed"), ("once", "Once daily"), ("daily", "Once daily")
+]
+RELATIONS = [
+    (("dr.", "dr ", "doctor", "neurologist", "physician"), "Doctor"),
+    (("caregiver", "nurse", "carer"), "Caregiver"),
+    (("neighbor", "neighbour"), "Neighbor"),
+    (("friend",), "Friend"),
+    (("son", "daughter", "wife", "husband", "mother", "father", "brother", "sister", "family", "grand"), "Family Member")
+]
+MOODS = [
+    (("great", "happy", "excellent", "😊"), "😊"),
+    (("good", "fine", "okay", "ok", "🙂"), "🙂"),
+    (("sad", "bad", "low", "😞"), "😞"),
+    (("down", "tired", "worse", "🙁"), "🙁"),
+    (("neutral", "so-so", "😐"), "😐")
+]
+
+# ----------------- Intent Patterns -----------------
+INTENTS = [
+    ("add_reminder", re.compile(r"^\s*(?:please\s+)?(?:remind me|set (?:a |an )?(?:reminder|alarm)|add (?:a )?reminder)\b", re.I)),
+    ("add_contact", re.compile(r"\b(?:add|save|set)\b.*\bas (?:an |my )?(?:emergency )?contact\b|\badd (?:an )?emergency contact\b", re.I)),
+    ("add_medication", re.compile(r"^\s*(?:please\s+)?(?:add|start|prescribed)\b.*\b(?:medication|medicine|pill|tablet|\d+\s*mg)\b", re.I)),
+    ("dose_taken", re.compile(r"^\s*(?:i\s+)?(?:just\s+)?(?:took|have taken|taken)\b|\bmark\b.*\b(?:taken|as taken)\b", re.I)),
+    ("log_progress", re.compile(r"\b(?:log|record|save)\b.*\b(?:score|progress)\b|\bmy score (?:is|was|today is)\b", re.I))
+]
+
+
+def find_time(text):
+    """The time a message names and the span of text it was read from.
+
+    The span is None for named times such as "bedtime", and both are None
+    when the message names no time.
+    """
+    for candidate in TIME_RE.finditer(text):
+        hour, minute, meridiem = candidate.groups()
+        # Bare numbers are only times when introduced by "at" or followed by am/pm
+        if not (meridiem or minute or candidate.group(0).lower().startswith("at")):
+            continue
+        hour, minute, meridiem = int(hour), int(minute or 0), (meridiem or "").lower().replace(".", "")
+        if meridiem == "pm" and hour < 12:
+            hour += 12
+        elif meridiem == "am" and hour == 12:
+            hour = 0
+        if 0 <= hour < 24 and 0 <= minute < 60:
+            return datetime.time(hour, minute), candidate.span()
+        break
+    lowered = text.lower()
+    for word, value in NAMED_TIMES.items():
+        if word in lowered:
+            return value, None
+    return None, None
+
+
+def parse_time(text):
+    return find_time(text)[0]
+
+
+def find_date(text):
+    """An explicit date such as 2024-03-05 or "March 5, 2024" and its span, else (None, None)."""
+    for candidate in DATE_RE.finditer(text):
+        iso, named = candidate.groups()
+        try:
+            if iso:
+                return datetime.date.fromisoformat("-".join(part.zfill(2) for part in iso.split("-"))), candidate.span()
+            words = re.sub(r"(?<=\d)(?:st|nd|rd|th)\b|[.,]", "", named).split()
+            for fmt in DATE_FORMATS:
+                try:
+                    parsed = datetime.datetime.strptime(" ".join(words), fmt).date()
+                except ValueError:
+                    continue
+                if len(words) == 2:
+                    parsed = parsed.replace(year=datetime.date.today().year)
+                return parsed, candidate.span()
+        except ValueError:
+            continue
+    return None, None
+
+
+def pick(text, options, default=None):
+    lowered = text.lower()
+    for keys, value in options:
+        if isinstance(keys, str):
+            keys = (keys,)
+        if any(key in lowered for key in keys):
+            return value
+    return default
+
+
+def strip_slots(text, *patterns):
+    for pattern in patterns:
+        text = pattern.sub(" ", text)
+    return re.sub(r"\s+", " ", text).strip(" ,.")
+
+
+# ----------------- Slot Extractors -----------------
+def reminder_slots(text):
+    message = re.sub(r"^\s*(?:please\s+)?(?:remind me( to)?|set (?:a |an )?(?:reminder|alarm)( to| for)?|add (?:a )?reminder( to| for)?)\s*", "", text, flags=re.I)
+    _, span = find_time(message)
+    if span:
+        message = message[:span[0]] + " " + message[span[1]:]
+    message = strip_slots(message, re.compile(r"\b(every day|every weekday|every weekend|every week|daily|weekly|weekdays?|weekends?)\b", re.I))
+    message = re.sub(r"\b(in the |at )?(morning|evening|noon|midday|midnight|bedtime)\b", "", message, flags=re.I).strip(" ,.")
+    return {
+        "time": parse_time(text) or datetime.time(8, 0),
+        "message": message[:1].upper() + message[1:] if message else "Reminder",
+        "frequency": pick(text, REMINDER_FREQUENCIES, "Daily")
+    }
+
+
+def medication_slots(text):
+    dosage = DOSAGE_RE.search(text)
+    rest = re.sub(r"^\s*(?:please\s+)?(?:add|start|prescribed)\s+(?:the\s+)?(?:medication|medicine)?\s*", "", text, flags=re.I)
+    name = re.match(r"([A-Za-z][A-Za-z-]+)", rest)
+    return {
+        "name": name.group(1).capitalize() if name else "",
+        "dosage": int(dosage.group(1)) if dosage else 1,
+        "time": parse_time(text) or datetime.time(8, 0),
+        "frequency": pick(text, MEDICATION_FREQUENCIES, "Once daily"),
+        "notes": "Take with food" if "with food" in text.lower() else ""
+    }
+
+
+def contact_slots(text):
+    name = re.search(r"\b(?:add|save|set)\s+(.+?)\s+as (?:an |my )?(?:emergency )?contact", text, re.I)
+    if not name:
+        name = re.search(r"emergency contact[:,]?\s+(.+?)(?:,|\s+\+?\d|\s+(?:phone|number|at)\b|$)", text, re.I)
+    phone = PHONE_RE.search(text)
+    name_text = re.sub(r"^(?:my|our)\s+", "", name.group(1).strip(), flags=re.I) if name else ""
+    if phone:
+        name_text = name_text.replace(phone.group(1), "").strip(" ,")
+    return {
+        "name": name_text,
+        "phone": phone.group(1).strip() if phone else "",
+        "relation": pick(name_text + " " + text, RELATIONS, "Other"),
+        "priority": pick(text, [(("high priority", "urgent"), "High"), (("low priority",), "Low")], "Medium")
+    }
+
+
+def progress_slots(text):
+    lowered = text.lower()
+    date, span = find_date(text)
+    if span:
+        # Keep the date's digits out of the score
+        text = text[:span[0]] + " " + text[span[1]:]
+    elif "yesterday" in lowered:
+        date = datetime.date.today() - datetime.timedelta(days=1)
+    score = None
+    anchor = re.search(r"\bscored?\b", text, re.I)
+    tail = text[anchor.end():] if anchor else text
+    for candidate in SCORE_RE.finditer(tail):
+        value, total = candidate.groups()
+        value = int(value)
+        if total is not None:
+            # "2 out of 3" is a fraction of the test, logged as a percentage
+            total = int(total)
+            if not 0 < total or value > total:
+                break
+            value = round(value * 100 / total)
+        if 0 <= value <= 100:
+            score = value
+            break
+    return {
+        "date": date or datetime.date.today(),
+        "score": score,
+        "mood": pick(text, MOODS, "😐"),
+        "notes": ""
+    }
+
+
+def dose_slots(text):
+    return {"name": re.sub(r"^\s*(?:i\s+)?(?:just\s+)?(?:took|have taken|taken)\s+(?:my\s+)?", "", text, flags=re.I).strip(" .")}
+
+
+EXTRACTORS = {
+    "add_reminder": reminder_slots,
+    "add_medication": medication_slots,
+    "add_contact": contact_slots,
+    "log_progress": progress_slots,
+    "dose_taken": dose_slots
+}
+
+
+# ----------------- Router -----------------
+def route(text):
+    """Classify a chat message as an app command, or return None for open questions."""
+    if not text or len(text) > 300 or text.rstrip().endswith("?"):
+        return None
+    for intent, pattern in INTENTS:
+        if pattern.search(text):
+            slots = EXTRACTORS[intent](text)
+            if intent == "add_contact" and not slots["name"]:
+                return None
+            if intent == "add_medication" and not slots["name"]:
+                return None
+            if intent == "log_progress" and slots["score"] is None:
+                return None
+            return {"intent": intent, "slots": slots}
+    return None
+
+
+def apply(command, state, activity_log=None):
+    """Write a routed command into the same session structures the forms use and describe it."""
+    intent = command["intent"]
+    slots = command["slots"]
+
+    if intent == "add_reminder":
+        state["notifications"].append({**slots, "active": True})
+        return f"⏰ Reminder added: <strong>{slots['message']}</strong> at {slots['time'].strftime('%I:%M %p')} ({slots['frequency']})."
+
+    if intent == "add_medication":
+        med = {"id": adherence.new_medication_id(), **slots, "last_taken": None}
+        state["medications"].append(med)
+        if activity_log:
+            activity_log.record("medication_added", adherence.schedule_payload(med))
+        return (f"💊 <strong>{slots['name']}</strong> {slots['dosage']}mg added to your medication schedule "
+                f"at {slots['time'].strftime('%I:%M %p')} ({slots['frequency']}).")
+
+    if intent == "add_contact":
+        state["emergency_contacts"].append(slots)
+        if activity_log:
+            activity_log.record("contacts_updated", {"name": slots["name"]})
+        phone = f" ({slots['phone']})" if slots["phone"] else " — add a phone number on the Emergency Contacts page"
+        return f"🆘 <strong>{slots['name']}</strong> added to emergency contacts as {slots['relation']}{phone}."
+
+    if intent == "log_progress":
+        state["progress"].append(slots)
+        if activity_log:
+            activity_log.record("progress_logged", {"score": slots["score"]})
+        return f"📈 Progress logged for {slots['date'].strftime('%b %d, %Y')}: score <strong>{slots['score']}/100</strong> {slots['mood']}."
+
+    if intent == "dose_taken":
+        wanted = slots["name"].lower()
+        for med in state["medications"]:
+            if med["name"] and med["name"].lower() in wanted:
+                med["last_taken"] = datetime.datetime.now()
+                if activity_log:
+                    activity_log.record("dose_taken", adherence.dose_payload(med))
+                return f"✓ Marked <strong>{med['name']}</strong> as taken at {med['last_taken'].strftime('%I:%M %p')}."
+        return None
+
+    return None
@@ -0,0 +1,383 @@
+import math
+import os
+import re
+from collections import Counter
+
+# ----------------- Built-in Care Content -----------------
+STAGE_LABELS = {
+    "NonDemented": "No Dementia",
+    "VeryMildDemented": "Very Mild Dementia",
+    "MildDemented": "Mild Dementia",
+    "ModerateDemented": "Moderate Dementia"
+}
+
+STAGE_EXPLANATIONS = {
+    "VeryMildDemented": """
+                    <div class="card fade-in" style="margin-top: 1.5rem;">
+                        <h4>Analysis Results</h4>
+                        <div class="status-indicator status-pending">
+                            <span>Very Mild Dementia Detected</span>
+                        </div>
+                        <p style="margin-top: 1rem;">This suggests the patient may be in the <strong>early stage of Alzheimer's disease</strong>,
+                        often associated with <strong>Mild Cognitive Impairment (MCI)</strong>. Individuals at this stage might have slight
+                        memory issues but generally maintain independence.</p>
+                        <p><strong>Recommendation:</strong> Consult a neurologist for a full diagnosis and consider cognitive exercises
+                        to maintain brain health.</p>
+                    </div>
+                    """,
+    "MildDemented": """
+                    <div class="card fade-in" style="margin-top: 1.5rem;">
+                        <h4>Analysis Results</h4>
+                        <div class="status-indicator status-warning">
+                            <span>Mild Dementia Detected</span>
+                        </div>
+                        <p style="margin-top: 1rem;">This indicates an <strong>early stage of dementia</strong>, where memory loss
+                        and confusion may start to impact daily life.</p>
+                        <p><strong>Recommendation:</strong> Medical evaluation is recommended to confirm and plan further steps.
+                        Consider setting up medication reminders and cognitive exercises.</p>
+                    </div>
+                    """,
+    "ModerateDemented": """
+                    <div class="card fade-in" style="margin-top: 1.5rem;">
+                        <h4>Analysis Results</h4>
+                        <div class="status-indicator status-danger">
+                            <span>Moderate Dementia Detected</span>
+                        </div>
+                        <p style="margin-top: 1rem;">This reflects a <strong>moderate stage of Alzheimer's disease</strong>, often
+                        characterized by noticeable confusion, increased memory loss, and need for assistance with routine tasks.</p>
+                        <p><strong>Recommendation:</strong> A comprehensive care plan may be needed. Ensure emergency contacts
+                        are up to date and consider professional care options.</p>
+                    </div>
+                    """,
+    "NonDemented": """
+                    <div class="card fade-in" style="margin-top: 1.5rem;">
+                        <h4>Analysis Results</h4>
+                        <div class="status-indicator status-completed">
+                            <span>No Dementia Detected</span>
+                        </div>
+                        <p style="margin-top: 1rem;">No signs of dementia are visible in the MRI scan.</p>
+                        <p><strong>Recommendation:</strong> Maintain a healthy lifestyle with regular exercise and cognitive
+                        activities to support brain health.</p>
+                    </div>
+                    """
+}
+
+STAGE_TIPS = {
+    "VeryMildDemented": [
+        {
+            "title": "Stay Socially Active",
+            "icon": "👥",
+            "content": "Regular social interaction can help maintain cognitive function. Consider joining a club or group activity.",
+            "category": "Lifestyle"
+        },
+        {
+            "title": "Mediterranean Diet",
+            "icon": "🥗",
+            "content": "A diet rich in fruits, vegetables, whole grains, olive oil, and fish may help slow cognitive decline.",
+            "category": "Nutrition"
+        },
+        {
+            "title": "Regular Exercise",
+            "icon": "🏃‍♂️",
+            "content": "Aim for at least 30 minutes of moderate exercise most days. Walking, swimming, and yoga are excellent choices.",
+            "category": "Physical Health"
+        },
+        {
+            "title": "Cognitive Stimulation",
+            "icon": "🧩",
+            "content": "Engage in puzzles, reading, or learning new skills to keep your brain active and challenged.",
+            "category": "Mental Health"
+        },
+        {
+            "title": "Sleep Hygiene",
+            "icon": "🛌",
+            "content": "Maintain a regular sleep schedule and create a restful environment to support memory consolidation.",
+            "category": "Lifestyle"
+        },
+        {
+            "title": "Stress Management",
+            "icon": "🧘‍♀️",
+            "content": "Practice relaxation techniques like deep breathing or meditation to reduce stress, which can impact cognition.",
+            "category": "Mental Health"
+        }
+    ],
+    "MildDemented": [
+        {
+            "title": "Routine Establishment",
+            "icon": "📅",
+            "content": "Maintain a consistent daily routine to reduce confusion and provide structure.",
+            "category": "Lifestyle"
+        },
+        {
+            "title": "Memory Aids",
+            "icon": "📝",
+            "content": "Use calendars, notes, and reminder systems to help with daily tasks and appointments.",
+            "category": "Tools"
+        },
+        {
+            "title": "Safe Environment",
+            "icon": "🏠",
+            "content": "Remove tripping hazards and consider safety modifications like grab bars in bathrooms.",
+            "category": "Safety"
+        },
+        {
+            "title": "Simplify Tasks",
+            "icon": "✂️",
+            "content": "Break down complex tasks into smaller, manageable steps to reduce frustration.",
+            "category": "Strategies"
+        },
+        {
+            "title": "Therapeutic Activities",
+            "icon": "🎨",
+            "content": "Engage in art, music, or reminiscence therapy which can be calming and stimulating.",
+            "category": "Mental Health"
+        },
+        {
+            "title": "Caregiver Support",
+            "icon": "🤝",
+            "content": "Consider joining a support group for caregivers to share experiences and coping strategies.",
+            "category": "Support"
+        }
+    ]
+}
+
+DEFAULT_TIPS = [
+    {
+        "title": "Brain-Healthy Nutrition",
+        "icon": "🍎",
+        "content": "Focus on antioxidant-rich foods like berries, leafy greens, and nuts to support brain health.",
+        "category": "Nutrition"
+    },
+    {
+        "title": "Regular Check-ups",
+        "icon": "🩺",
+        "content": "Schedule regular medical check-ups to monitor overall health and cognitive function.",
+        "category": "Healthcare"
+    },
+    {
+        "title": "Mental Stimulation",
+        "icon": "📚",
+        "content": "Challenge your brain with new learning experiences, puzzles, or memory games.",
+        "category": "Mental Health"
+    },
+    {
+        "title": "Physical Activity",
+        "icon": "🚶‍♂️",
+        "content": "Regular physical activity improves blood flow to the brain and may help maintain cognitive function.",
+        "category": "Physical Health"
+    },
+    {
+        "title": "Social Engagement",
+        "icon": "👨‍👩‍👧‍👦",
+        "content": "Stay connected with friends and family to maintain emotional well-being and cognitive stimulation.",
+        "category": "Social"
+    },
+    {
+        "title": "Sleep Quality",
+        "icon": "😴",
+        "content": "Prioritize good sleep habits as quality sleep helps with memory consolidation and brain health.",
+        "category": "Lifestyle"
+    }
+]
+
+
+def explanation_for(prediction):
+    return STAGE_EXPLANATIONS.get(prediction, STAGE_EXPLANATIONS["NonDemented"])
+
+
+def tips_for(prediction):
+    return STAGE_TIPS.get(prediction, DEFAULT_TIPS)
+
+
+# ----------------- Text Helpers -----------------
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "could", "do", "does", "for", "from",
+    "how", "i", "if", "in", "is", "it", "its", "me", "my", "of", "on", "or", "our", "should",
+    "so", "that", "the", "their", "this", "to", "was", "we", "what", "when", "which", "who",
+    "why", "will", "with", "would", "you", "your", "about", "any", "some", "there", "have", "has",
+    "much", "many", "more", "get", "make", "need", "know", "tell", "tip", "tips", "please"
+}
+
+TAG_RE = re.compile(r"<[^>]+>")
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def strip_html(html):
+    return re.sub(r"\s+", " ", TAG_RE.sub(" ", html)).strip()
+
+
+def tokenize(text):
+    tokens = []
+    for word in WORD_RE.findall(text.lower()):
+        word = word.strip("'")
+        if not word or word in STOPWORDS:
+            continue
+        # Light stemming so "exercises"/"exercise" and "reminders"/"reminder" meet
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+# ----------------- Passages -----------------
+def builtin_passages():
+    passages = []
+    for stage, html in STAGE_EXPLANATIONS.items():
+        label = STAGE_LABELS[stage]
+        for paragraph in re.findall(r"<p[^>]*>(.*?)</p>", html, flags=re.S):
+            passages.append({
+                "title": f"{label} — MRI result",
+                "text": strip_html(paragraph),
+                "source": "MRI analysis",
+                "stage": stage
+            })
+
+    tip_sets = list(STAGE_TIPS.items()) + [(None, DEFAULT_TIPS)]
+    for stage, tips in tip_sets:
+        for tip in tips:
+            passages.append({
+                "title": f"{tip['icon']} {tip['title']}",
+                "text": tip["content"],
+                "source": f"Health Tips • {tip['category']}",
+                "stage": stage
+            })
+    return passages
+
+
+def folder_passages(folder):
+    """Load .txt/.md files from a local folder, one passage per blank-line separated block."""
+    passages = []
+    if not folder or not os.path.isdir(folder):
+        return passages
+
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if not name.lower().endswith((".txt", ".md")):
+                continue
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                blocks = re.split(r"\n\s*\n", f.read())
+            title = os.path.splitext(name)[0].replace("_", " ").replace("-", " ").title()
+            for block in blocks:
+                text = strip_html(block.strip().lstrip("#").strip())
+                if len(text) >= 20:
+                    passages.append({
+                        "title": title,
+                        "text": text,
+                        "source": os.path.relpath(path, folder),
+                        "stage": None
+                    })
+    return passages
+
+
+# ----------------- BM25 Index -----------------
+class KnowledgeIndex:
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.doc_terms = []
+        self.doc_lengths = []
+        self.postings = {}
+
+        for doc_id, passage in enumerate(passages):
+            terms = Counter(tokenize(passage["title"] + " " + passage["text"]))
+            self.doc_terms.append(terms)
+            self.doc_lengths.append(sum(terms.values()))
+            for term in terms:
+                self.postings.setdefault(term, []).append(doc_id)
+
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if passages else 0.0
+        n = len(passages)
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query, k=3, stage=None, stage_boost=1.3):
+        query_terms = set(tokenize(query))
+        scores = {}
+        for term in query_terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id in self.postings[term]:
+                tf = self.doc_terms[doc_id][term]
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        results = []
+        for doc_id, score in scores.items():
+            passage = self.passages[doc_id]
+            if stage and passage["stage"] == stage:
+                score *= stage_boost
+            matched = sum(1 for term in query_terms if term in self.doc_terms[doc_id])
+            results.append({
+                **passage,
+                "score": score,
+                "coverage": matched / len(query_terms) if query_terms else 0.0
+            })
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results[:k]
+
+
+def build_index(folder=None):
+    return KnowledgeIndex(builtin_passages() + folder_passages(folder))
+
+
+# ----------------- Chat Helpers -----------------
+def local_answer(hits, min_score=4.0, min_coverage=0.75):
+    """Return an answer built from the index alone when the best hit covers the question well."""
+    if not hits:
+        return None
+    best = hits[0]
+    if best["score"] < min_score or best["coverage"] < min_coverage:
+        return None
+    return f"""
+        <p style="margin: 0 0 0.5rem 0;"><strong>{best['title']}</strong></p>
+        <p style="margin: 0;">{best['text']}</p>
+        <p style="margin: 0.5rem 0 0 0; font-size: 0.8rem; color: var(--secondary);">Source: {best['source']}</p>
+    """
+
+
+CARE_INSTRUCTIONS = (
+    "You are a care assistant for people living with Alzheimer's disease and for their caregivers. "
+    "Answer warmly, in plain language and briefly. For new symptoms or any change to medication, "
+    "suggest speaking to their doctor."
+)
+
+PROFILE_MEDICATIONS = 10
+
+
+def patient_profile(medications):
+    """What the chat should know about the patient's own records, as one prompt line."""
+    if not medications:
+        return ""
+    listed = ", ".join(
+        f"{med['name']} {med['dosage']}mg {med['frequency'].lower()}" for med in medications[:PROFILE_MEDICATIONS]
+    )
+    return f"Current medications: {listed}."
+
+
+def context_prompt(prediction=None, profile=""):
+    """The start of every chat prompt, unchanged between turns until the scan result or profile changes."""
+    lines = [CARE_INSTRUCTIONS]
+    if prediction:
+        lines.append(f"The patient's most recent MRI analysis showed {STAGE_LABELS.get(prediction, prediction)}.")
+    if profile:
+        lines.append(profile)
+    return "\n".join(lines)
+
+
+def question_prompt(question, hits):
+    """The part of the prompt that changes every turn."""
+    lines = []
+    if hits:
+        lines.append("Relevant care notes:")
+        for hit in hits:
+            lines.append(f"- {hit['title']}: {hit['text']}")
+    lines.append("Using the notes where relevant, answer the question below concisely for a patient or caregiver.")
+    lines.append(f"Question: {question}")
+    return "\n".join(lines)
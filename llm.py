@@ -0,0 +1,262 @@
+import hashlib
+import queue
+import threading
+import time
+
+import ratelimit
+import usage
+
+# Output tokens reserved per call before the real usage is known
+OUTPUT_TOKEN_ALLOWANCE = 512
+
+# Local fallback: how long Gemini gets to start answering, and how long it is
+# skipped after FAILURES_TO_SKIP slow or failed calls in a row
+FIRST_CHUNK_SECONDS = 8
+FAILURES_TO_SKIP = 2
+SKIP_SECONDS = 60
+
+# ----------------- Model Calls -----------------
+def request_key(model_name, prompt):
+    return hashlib.sha256(f"{model_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def metered(model):
+    """Whether a call to model now would spend the shared Gemini quota; models without a say are."""
+    return getattr(model, "metered", True)
+
+
+def limited_stream(model, prompt, limiter, patient_id, priority=ratelimit.PRIORITY_INTERACTIVE, retries=3,
+                   ledger=None, page=None):
+    """Stream a Gemini reply after taking quota from the shared token bucket.
+
+    A 429 that arrives before any text has been streamed blocks the bucket for
+    every session and the call is retried; later errors are raised as usual.
+    Calls the local model answers take no quota. Tokens, timings, retries and
+    the outcome are recorded to the ledger.
+    """
+    estimated = ratelimit.estimate_tokens(prompt) + OUTPUT_TOKEN_ALLOWANCE
+    timer = usage.CallTimer(ledger, patient_id, page, model.model_name, priority)
+    for attempt in range(retries + 1):
+        acquired = metered(model)
+        if acquired:
+            try:
+                limiter.acquire(patient_id, estimated, priority)
+            except ratelimit.RateLimitTimeout:
+                timer.finish("busy", "RateLimitTimeout")
+                raise
+        timer.acquired()
+        started = False
+        reply = []
+        try:
+            response = model.generate_content(prompt, stream=True)
+            for chunk in response:
+                if chunk.text:
+                    started = True
+                    timer.chunk()
+                    reply.append(chunk.text)
+                    yield chunk.text
+            metadata = getattr(response, "usage_metadata", None)
+            # The fallback wrapper reports which model actually answered
+            local = getattr(response, "source", None) == "local"
+            if acquired:
+                # Gemini was sent the prompt before the local model took over, but wrote no answer
+                limiter.settle(estimated, ratelimit.estimate_tokens(prompt) if local
+                               else getattr(metadata, "total_token_count", None))
+            answered_by = response.model.local.model_name if local else None
+            timer.finish(usage=metadata, model=answered_by, prompt=prompt, reply="".join(reply))
+            return
+        except GeneratorExit:
+            # The caller stopped reading, e.g. a Streamlit rerun
+            timer.finish("abandoned", prompt=prompt, reply="".join(reply))
+            raise
+        except Exception as e:
+            rate_limited = ratelimit.is_rate_limit_error(e)
+            if started or attempt == retries or not rate_limited or not acquired:
+                timer.finish("rate_limited" if rate_limited else "error", type(e).__name__)
+                raise
+            limiter.penalize(2 ** attempt * 5)
+            timer.retry()
+
+
+# ----------------- Local Fallback -----------------
+class FallbackResponse:
+    def __init__(self, model, prompt):
+        self.model = model
+        self.prompt = prompt
+        self.usage_metadata = None
+        self.source = None
+
+    def _local(self):
+        self.source = "local"
+        response = self.model.local.generate_content(self.prompt, stream=True)
+        yield from response
+        self.usage_metadata = response.usage_metadata
+
+    def __iter__(self):
+        if not self.model.remote_available():
+            yield from self._local()
+            return
+
+        # The remote stream runs on its own thread so a stalled connection cannot hold the reply
+        events = queue.Queue()
+
+        def pump():
+            try:
+                response = self.model.remote.generate_content(self.prompt, stream=True)
+                for chunk in response:
+                    if chunk.text:
+                        events.put(("chunk", chunk))
+                events.put(("done", getattr(response, "usage_metadata", None)))
+            except Exception as e:
+                events.put(("error", e))
+
+        threading.Thread(target=pump, daemon=True, name="remote-llm").start()
+        try:
+            kind, value = events.get(timeout=self.model.first_chunk_timeout)
+        except queue.Empty:
+            kind, value = "error", TimeoutError("Gemini did not start answering in time")
+        if kind == "error":
+            self.model.record_failure()
+            yield from self._local()
+            return
+
+        self.model.record_success()
+        self.source = "remote"
+        while kind != "done":
+            if kind == "error":
+                raise value
+            yield value
+            try:
+                kind, value = events.get(timeout=self.model.stream_timeout)
+            except queue.Empty:
+                raise TimeoutError("Gemini stopped streaming")
+        self.usage_metadata = value
+
+
+class FallbackModel:
+    """Gemini, with a local model answering when Gemini is slow to start or failing.
+
+    Only the first chunk is raced against first_chunk_timeout; once Gemini is
+    streaming the reply stays with it. After FAILURES_TO_SKIP misses in a row
+    Gemini is skipped for SKIP_SECONDS, so an outage does not cost every turn
+    the timeout.
+    """
+
+    def __init__(self, remote, local, first_chunk_timeout=FIRST_CHUNK_SECONDS, stream_timeout=120):
+        self.remote = remote
+        self.local = local
+        self.model_name = remote.model_name
+        self.first_chunk_timeout = first_chunk_timeout
+        self.stream_timeout = stream_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.skip_until = 0.0
+
+    def remote_available(self):
+        return time.monotonic() >= self.skip_until
+
+    @property
+    def metered(self):
+        # While Gemini is skipped the local model answers without touching the quota
+        return self.remote_available()
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= FAILURES_TO_SKIP:
+                self.skip_until = time.monotonic() + SKIP_SECONDS
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.skip_until = 0.0
+
+    def generate_content(self, prompt, stream=True):
+        return FallbackResponse(self, prompt)
+
+
+# ----------------- Single-Flight Coalescing -----------------
+class Flight:
+    """One upstream call whose streamed chunks are replayed to every waiter."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.waiters = 1
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+    def iter_chunks(self, timeout=120):
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.chunks) and not self.done:
+                    if not self.cond.wait(timeout):
+                        raise TimeoutError("Timed out waiting for the model response")
+                pending = self.chunks[i:]
+                finished = self.done
+                error = self.error
+            for chunk in pending:
+                yield chunk
+            i += len(pending)
+            if finished and i >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """Collapse concurrent identical requests into a single upstream call.
+
+    The upstream iterator runs on its own thread so that a caller leaving early
+    (e.g. a Streamlit rerun) never starves the other waiters.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = {"upstream_calls": 0, "coalesced": 0}
+
+    def stream(self, key, fn):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = Flight()
+                self.flights[key] = flight
+                self.stats["upstream_calls"] += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self.stats["coalesced"] += 1
+                leader = False
+
+        if leader:
+            threading.Thread(target=self._run, args=(key, flight, fn), daemon=True).start()
+        return flight.iter_chunks()
+
+    def do(self, key, fn):
+        return "".join(self.stream(key, fn))
+
+    def _run(self, key, flight, fn):
+        error = None
+        try:
+            for chunk in fn():
+                flight.publish(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            # Drop the flight before finishing so later requests start a fresh call
+            with self.lock:
+                self.flights.pop(key, None)
+            flight.finish(error)
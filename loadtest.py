@@ -0,0 +1,462 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import websockets
+from PIL import Image
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.Common_pb2 import FileUploaderState
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatbot-alzhimers.py")
+
+QUESTIONS = [
+    "What does very mild dementia mean for daily life?",
+    "How can I help my father sleep better at night?",
+    "What should I ask the neurologist at our next visit?",
+    "Are there foods that support brain health?",
+    "How do I handle repeated questions calmly?"
+]
+
+# Throughput must grow by at least this much per level to count as unsaturated
+SATURATION_GAIN = 0.10
+
+
+# ----------------- Gemini Stub -----------------
+class GeminiStub(ThreadingHTTPServer):
+    """Answers generateContent and streamGenerateContent like the Gemini REST API.
+
+    Replies are streamed in `chunks` pieces `chunk_delay` seconds apart, so model
+    latency is realistic without spending quota.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, chunks=8, chunk_delay=0.15):
+        super().__init__(address, _GeminiHandler)
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+
+def _candidate(text, prompt_tokens, output_tokens, done):
+    response = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}]}
+    if done:
+        response["candidates"][0]["finishReason"] = "STOP"
+        response["usageMetadata"] = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens
+        }
+    return response
+
+
+class _GeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.calls += 1
+        prompt_tokens = max(1, len(body) // 4)
+        words = [f"word{i}" for i in range(self.server.chunks * 6)]
+        pieces = [" ".join(words[i:i + 6]) + " " for i in range(0, len(words), 6)]
+
+        if ":streamGenerateContent" not in self.path:
+            time.sleep(self.server.chunk_delay * len(pieces))
+            self._send(json.dumps(_candidate("".join(pieces), prompt_tokens, len(words), True)).encode())
+            return
+
+        # The REST transport reads a JSON array of responses as it arrives
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            time.sleep(self.server.chunk_delay)
+            item = json.dumps(_candidate(piece, prompt_tokens, len(words), i == len(pieces) - 1))
+            self._chunk((("[" if i == 0 else ",\r\n") + item).encode())
+        self._chunk(b"]")
+        self._chunk(b"")
+
+    def _send(self, data):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+# ----------------- App Under Test -----------------
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(workdir, port, gemini_endpoint, rpm, tpm):
+    """Run the app from a scratch directory so its data/ files start empty."""
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w") as f:
+        f.write(f'GOOGLE_API_KEY = "stub"\nGEMINI_ENDPOINT = "{gemini_endpoint}"\n'
+                f"GEMINI_RPM = {rpm}\nGEMINI_TPM = {tpm}\n")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_SCRIPT,
+         "--server.port", str(port), "--server.headless", "true",
+         "--server.enableXsrfProtection", "false", "--browser.gatherUsageStats", "false"],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.3)
+    process.kill()
+    raise RuntimeError("Streamlit did not start")
+
+
+class ProcessStats:
+    """CPU seconds and resident memory of one process, read from /proc."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+
+# ----------------- Simulated Session -----------------
+# Sessions talk to the app over Streamlit's websocket protocol, as browsers do
+def scan_image():
+    buffer = io.BytesIO()
+    Image.effect_noise((256, 256), 40).convert("RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class SimulatedSession:
+    """One browser tab: keeps widget state between reruns the way the frontend does."""
+
+    def __init__(self, base_url, number, think_time):
+        self.base_url = base_url
+        self.number = number
+        self.think_time = think_time
+        self.query_string = ""
+        self.session_id = None
+        self.elements = []
+        self.widgets = {}
+        self.latencies = []
+        self.errors = []
+        self.ws = None
+
+    async def connect(self):
+        url = self.base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.ws = await websockets.connect(url, subprotocols=["streamlit"], max_size=None)
+        await self.rerun("open")
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def _receive(self):
+        msg = ForwardMsg()
+        msg.ParseFromString(await self.ws.recv())
+        return msg
+
+    async def rerun(self, step, triggers=()):
+        back = BackMsg()
+        back.rerun_script.query_string = self.query_string
+        back.rerun_script.widget_states.widgets.extend([*self.widgets.values(), *triggers])
+        started = time.perf_counter()
+        await self.ws.send(back.SerializeToString())
+        elements = []
+        while True:
+            msg = await self._receive()
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                self.session_id = msg.new_session.initialize.session_id or self.session_id
+            elif kind == "page_info_changed":
+                self.query_string = msg.page_info_changed.query_string
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element = msg.delta.new_element
+                elements.append((element.WhichOneof("type"), getattr(element, element.WhichOneof("type"))))
+            elif kind == "script_finished":
+                break
+        self.latencies.append((step, time.perf_counter() - started))
+        self.elements = elements
+        self.errors += [f"{step}: {proto.type}: {proto.message}" for kind, proto in elements if kind == "exception"]
+
+    def find(self, kind, label):
+        for element_kind, proto in self.elements:
+            if element_kind == kind and proto.label == label:
+                return proto
+        raise LookupError(f"No {kind} labelled {label!r} on this page")
+
+    def set_option(self, kind, label, option):
+        proto = self.find(kind, label)
+        state = WidgetState(id=proto.id)
+        # Newer Streamlit sends option widgets by value, older ones by index
+        if "raw_value" in proto.DESCRIPTOR.fields_by_name:
+            state.string_value = next(o for o in proto.options if o.endswith(option))
+        else:
+            state.int_value = next(i for i, o in enumerate(proto.options) if o.endswith(option))
+        self.widgets[proto.id] = state
+
+    def set_value(self, kind, label, **value):
+        proto = self.find(kind, label)
+        self.widgets[proto.id] = WidgetState(id=proto.id, **value)
+
+    def trigger(self, kind, label):
+        return WidgetState(id=self.find(kind, label).id, trigger_value=True)
+
+    async def navigate(self, page):
+        self.set_option("radio", "Navigate to:", page)
+        await self.rerun(f"open {page}")
+
+    async def think(self):
+        if self.think_time:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.think_time)
+
+    # ----- Flows -----
+    async def upload_scan(self, image):
+        await self.navigate("Home")
+        uploader = self.find("file_uploader", "Choose an MRI image...")
+        back = BackMsg()
+        request_id = uuid.uuid4().hex
+        back.file_urls_request.request_id = request_id
+        back.file_urls_request.session_id = self.session_id
+        back.file_urls_request.file_names.append("scan.png")
+        await self.ws.send(back.SerializeToString())
+        while True:
+            msg = await self._receive()
+            if msg.WhichOneof("type") == "file_urls_response" and msg.file_urls_response.response_id == request_id:
+                urls = msg.file_urls_response.file_urls[0]
+                break
+        upload_url = urls.upload_url if urls.upload_url.startswith("http") else self.base_url + urls.upload_url
+        response = await asyncio.to_thread(
+            requests.put, upload_url, files={"file": ("scan.png", image, "image/png")}, timeout=30
+        )
+        response.raise_for_status()
+        state = FileUploaderState()
+        info = state.uploaded_file_info.add()
+        info.file_id = urls.file_id
+        info.name = "scan.png"
+        info.size = len(image)
+        info.file_urls.CopyFrom(urls)
+        self.widgets[uploader.id] = WidgetState(id=uploader.id, file_uploader_state_value=state)
+        await self.rerun("upload scan")
+        # The uploader keeps its file; drop it so later visits to Home do not re-analyse
+        del self.widgets[uploader.id]
+
+    async def chat(self, message):
+        await self.navigate("Chatbot")
+        proto = next(p for kind, p in self.elements if kind == "chat_input")
+        state = WidgetState(id=proto.id)
+        if "chat_input_value" in WidgetState.DESCRIPTOR.fields_by_name:
+            state.chat_input_value.data = message
+        else:
+            state.string_trigger_value.data = message
+        await self.rerun("chat", [state])
+
+    async def add_medication(self):
+        await self.navigate("Medications")
+        self.set_value("text_input", "Medication Name", string_value=f"Donepezil {self.number}")
+        self.set_value("number_input", "Dosage (mg)", int_value=10)
+        self.set_value("time_input", "Time to Take", string_value="08:00")
+        self.set_option("selectbox", "Frequency", "Twice daily")
+        await self.rerun("add medication", [self.trigger("button", "Add Medication")])
+
+    async def log_progress(self):
+        await self.navigate("Progress Tracking")
+        self.set_value("slider", "Cognitive Score", double_array_value={"data": [random.randint(40, 95)]})
+        await self.rerun("log progress", [self.trigger("button", "Save Entry")])
+
+    async def flow(self, image):
+        await self.upload_scan(image)
+        await self.think()
+        # Half the questions are shared across sessions, as the usual follow-ups are
+        await self.chat(random.choice(QUESTIONS) + ("" if random.random() < 0.5 else f" (#{self.number})"))
+        await self.think()
+        await self.add_medication()
+        await self.think()
+        await self.log_progress()
+        await self.think()
+
+    async def run(self, image, stop_at):
+        try:
+            await self.connect()
+            while time.time() < stop_at:
+                await self.flow(image)
+        except (websockets.ConnectionClosed, LookupError, requests.RequestException, OSError) as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+        finally:
+            await self.close()
+
+
+# ----------------- Levels -----------------
+def percentiles(values):
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return {"p50": value, "p90": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p90": cuts[89], "p95": cuts[94], "p99": cuts[98]}
+
+
+async def run_level(base_url, sessions, duration, think_time, stats, image):
+    rss_before = stats.rss_mb()
+    cpu_before = stats.cpu_seconds()
+    started = time.time()
+    clients = [SimulatedSession(base_url, i, think_time) for i in range(sessions)]
+    peak_rss = rss_before
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, stats.rss_mb())
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample_rss())
+    await asyncio.gather(*(client.run(image, started + duration) for client in clients))
+    sampler.cancel()
+    elapsed = time.time() - started
+
+    by_step = {}
+    for client in clients:
+        for step, latency in client.latencies:
+            by_step.setdefault(step, []).append(latency * 1000)
+    actions = sum(len(client.latencies) for client in clients)
+    return {
+        "sessions": sessions,
+        "seconds": round(elapsed, 1),
+        "actions": actions,
+        "throughput": actions / elapsed,
+        "errors": [error for client in clients for error in client.errors],
+        "cpu_cores": (stats.cpu_seconds() - cpu_before) / elapsed,
+        "rss_mb": peak_rss,
+        "rss_per_session_mb": max(0.0, peak_rss - rss_before) / sessions,
+        "latency_ms": {step: percentiles(values) for step, values in sorted(by_step.items())}
+    }
+
+
+async def warm_up(base_url, image):
+    """One untimed pass so imports and cached resources are loaded before measuring."""
+    session = SimulatedSession(base_url, -1, 0)
+    try:
+        await session.connect()
+        await session.flow(image)
+    finally:
+        await session.close()
+
+
+def saturation_point(levels):
+    """The last level whose throughput still grew by SATURATION_GAIN over the one before."""
+    best = levels[0]
+    for previous, current in zip(levels, levels[1:]):
+        if current["throughput"] < previous["throughput"] * (1 + SATURATION_GAIN):
+            return best["sessions"]
+        best = current
+    return None
+
+
+def print_level(level):
+    print(f"\n{level['sessions']} sessions: {level['throughput']:.2f} actions/s, "
+          f"{level['cpu_cores']:.2f} CPU cores, {level['rss_mb']:.0f} MB RSS "
+          f"({level['rss_per_session_mb']:.1f} MB/session), {len(level['errors'])} errors")
+    for error in sorted(set(level["errors"]))[:5]:
+        print(f"  ! {error}")
+    print(f"  {'step':<28}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}  ms")
+    for step, cuts in level["latency_ms"].items():
+        print(f"  {step:<28}" + "".join(f"{cuts[p]:>9.0f}" for p in ("p50", "p90", "p95", "p99")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Drive simulated caregiver sessions against one Streamlit node, stepping up the "
+                    "number of concurrent sessions until throughput stops growing."
+    )
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="Comma-separated session counts")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per level")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean pause between steps; 0 for closed-loop stress")
+    parser.add_argument("--chunk-delay", type=float, default=0.15, help="Stub seconds between streamed chunks")
+    parser.add_argument("--url", help="Test an already running app instead of starting one")
+    parser.add_argument("--pid", type=int, help="Process id of the app given with --url, for CPU and RSS")
+    parser.add_argument("--rpm", type=int, default=100000)
+    parser.add_argument("--tpm", type=int, default=100000000)
+    parser.add_argument("--report", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    stub = GeminiStub(("127.0.0.1", free_port()), chunk_delay=args.chunk_delay)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    workdir = None
+    process = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+        pid = args.pid
+    else:
+        workdir = tempfile.mkdtemp(prefix="loadtest-")
+        port = free_port()
+        process = start_app(workdir, port, f"http://127.0.0.1:{stub.server_address[1]}", args.rpm, args.tpm)
+        base_url = f"http://127.0.0.1:{port}"
+        pid = process.pid
+
+    image = scan_image()
+    levels = []
+    try:
+        stats = ProcessStats(pid or os.getpid())
+        asyncio.run(warm_up(base_url, image))
+        for sessions in [int(n) for n in args.levels.split(",")]:
+            level = asyncio.run(run_level(base_url, sessions, args.duration, args.think_time, stats, image))
+            levels.append(level)
+            print_level(level)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+        stub.shutdown()
+
+    saturated = saturation_point(levels) if levels else None
+    print(f"\nGemini stub calls: {stub.calls}")
+    print("Saturation point: " + (f"about {saturated} concurrent sessions" if saturated else "not reached; try more sessions"))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"levels": levels, "saturation_sessions": saturated, "stub_calls": stub.calls}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+import threading
+
+# Tokens of context; llama.cpp allocates the KV cache for exactly this many
+CONTEXT_TOKENS = 4096
+MAX_OUTPUT_TOKENS = 512
+# Saved prompt states reused across turns that share a prefix (the care-content preamble)
+PROMPT_CACHE_MB = 256
+TEMPERATURE = 0.3
+
+
+class Chunk:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Usage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class LocalResponse:
+    """Streamed like a Gemini response: iterate for chunks, then read usage_metadata."""
+
+    def __init__(self, model, prompt):
+        self.model = model
+        self.prompt = prompt
+        self.usage_metadata = None
+
+    def __iter__(self):
+        prompt, prompt_tokens = self.model.fit(self.prompt)
+        output_tokens = 0
+        # One generation at a time: a llama.cpp context is not thread safe, and
+        # parallel generations would only split the same CPU cores
+        with self.model.lock:
+            for part in self.model.llama.create_chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=self.model.max_tokens,
+                temperature=TEMPERATURE,
+                stream=True
+            ):
+                text = part["choices"][0]["delta"].get("content")
+                if text:
+                    output_tokens += 1
+                    yield Chunk(text)
+        self.usage_metadata = Usage(prompt_tokens, output_tokens)
+
+
+class LocalModel:
+    """A quantized GGUF chat model run on the CPU through llama.cpp.
+
+    Stands in for genai.GenerativeModel wherever the chat, prefetcher and
+    single-flight layer take a model: it has a model_name and a streaming
+    generate_content(). The KV cache is bounded by the context size, and the
+    prompt-state cache by cache_mb. Its calls are not metered against the
+    Gemini quota.
+    """
+
+    metered = False
+
+    def __init__(self, path, threads=None, context=CONTEXT_TOKENS, max_tokens=MAX_OUTPUT_TOKENS, cache_mb=PROMPT_CACHE_MB):
+        try:
+            from llama_cpp import Llama, LlamaRAMCache
+        except ImportError:
+            raise RuntimeError("The local model needs llama-cpp-python: pip install llama-cpp-python")
+        self.model_name = f"local/{os.path.basename(path)}"
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        self.llama = Llama(model_path=path, n_ctx=context, n_threads=threads or os.cpu_count(), verbose=False)
+        if cache_mb:
+            self.llama.set_cache(LlamaRAMCache(capacity_bytes=cache_mb * 1024 * 1024))
+
+    def fit(self, prompt):
+        """Trim the middle of an over-long prompt (retrieved passages) so the answer still fits.
+
+        Returns (prompt, token count).
+        """
+        tokens = self.llama.tokenize(prompt.encode("utf-8"), add_bos=False)
+        # Room for the answer and the chat template around the prompt
+        budget = self.llama.n_ctx() - self.max_tokens - 64
+        if len(tokens) <= budget:
+            return prompt, len(tokens)
+        head, tail = tokens[:budget // 2], tokens[-(budget - budget // 2):]
+        text = self.llama.detokenize(head).decode("utf-8", "ignore") + "\n...\n" + self.llama.detokenize(tail).decode("utf-8", "ignore")
+        return text, budget
+
+    def generate_content(self, prompt, stream=True):
+        return LocalResponse(self, prompt)
+
+
+def from_settings(setting):
+    """The local model configured by LOCAL_LLM_* settings, or None when no model file is set."""
+    path = setting("LOCAL_LLM_PATH", None)
+    if not path:
+        return None
+    threads = setting("LOCAL_LLM_THREADS", None)
+    return LocalModel(
+        path,
+        threads=int(threads) if threads else None,
+        context=int(setting("LOCAL_LLM_CONTEXT", CONTEXT_TOKENS)),
+        max_tokens=int(setting("LOCAL_LLM_MAX_TOKENS", MAX_OUTPUT_TOKENS)),
+        cache_mb=int(setting("LOCAL_LLM_CACHE_MB", PROMPT_CACHE_MB))
+    )
@@ -0,0 +1,211 @@
+import collections
+import hashlib
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+# Sizes of one session are published to the shared store at most this often
+PUBLISH_INTERVAL_SECONDS = 10
+SNAPSHOT_TTL_SECONDS = 3600
+
+# Growth alerts
+SESSION_SIZE_LIMIT = 5 * 1024 * 1024
+GROWTH_WINDOW = 20
+GROWTH_RATIO = 0.5
+GROWTH_MIN_BYTES = 256 * 1024
+
+HISTORY_LENGTH = 50
+MAX_SESSIONS = 1000
+TOP_ALLOCATIONS = 15
+TRACE_FRAMES = 5
+
+# Never walked into: code, and handles to process-wide resources
+OPAQUE_TYPES = (
+    types.ModuleType, type, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    types.CodeType, types.FrameType, types.GeneratorType, threading.Thread
+)
+
+
+# ----------------- Sizing -----------------
+def deep_size(obj, ignore=(), seen=None):
+    """Bytes reachable from obj, counting every object once.
+
+    Objects whose id is in ignore (shared caches, stores) are not counted or walked.
+    """
+    seen = set(ignore) if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, OPAQUE_TYPES):
+            continue
+        seen.add(id(current))
+        try:
+            total += sys.getsizeof(current)
+        except TypeError:
+            continue
+        if isinstance(current, (str, bytes, bytearray, int, float, bool, type(None))):
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(current)
+        else:
+            if hasattr(current, "__dict__"):
+                stack.append(current.__dict__)
+            for slot in getattr(type(current), "__slots__", ()):
+                if hasattr(current, slot):
+                    stack.append(getattr(current, slot))
+    return total
+
+
+def state_sizes(state, ignore=()):
+    """{key: (type name, bytes)} for every session_state key, largest first.
+
+    An object reachable from several keys is counted under each of them;
+    session_total() counts it once.
+    """
+    seen = {id(obj) for obj in ignore}
+    sizes = {key: deep_size(value, seen=set(seen)) for key, value in state.items()}
+    return {
+        key: (type(state[key]).__name__, sizes[key])
+        for key in sorted(sizes, key=sizes.get, reverse=True)
+    }
+
+
+def session_total(state, ignore=()):
+    return deep_size(list(state.values()), ignore={id(obj) for obj in ignore})
+
+
+def session_tag(session_id):
+    """A stable, non-reversible label for a session.
+
+    The raw id is the ?sid= value that restores a session, so it never
+    leaves the session itself: snapshots, alerts and store keys use this tag.
+    """
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:12]
+
+
+# ----------------- Registry -----------------
+class MemoryRegistry:
+    """Per-session size history, growth alerts and per-page allocation traces.
+
+    One registry lives per Streamlit process. Each session's latest sizes are
+    also written to the shared store, so the admin page and the HTTP API see
+    sessions on every replica.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.lock = threading.Lock()
+        self.history = collections.OrderedDict()
+        self.published = {}
+        self.page_allocations = {}
+        self.run_snapshots = threading.local()
+
+    # ----- Allocation tracing -----
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def set_tracing(self, enabled):
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            with self.lock:
+                self.page_allocations.clear()
+
+    def begin_run(self):
+        # Script runs execute on their own thread, so the start snapshot is kept per thread
+        self.run_snapshots.start = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+    def _allocations(self):
+        start = getattr(self.run_snapshots, "start", None)
+        self.run_snapshots.start = None
+        if start is None or not tracemalloc.is_tracing():
+            return None
+        skip = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        end = tracemalloc.take_snapshot().filter_traces(skip)
+        stats = end.compare_to(start.filter_traces(skip), "lineno")
+        return [
+            {
+                "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "count_diff": stat.count_diff,
+                "size_kb": round(stat.size / 1024, 1)
+            }
+            for stat in stats[:TOP_ALLOCATIONS]
+        ]
+
+    # ----- Per-run recording -----
+    def record(self, session_id, page, state, patient_id=None, ignore=()):
+        """Size the session after a rerun, check for growth and publish the result."""
+        session = session_tag(session_id)
+        allocations = self._allocations()
+        sizes = state_sizes(state, ignore)
+        total = session_total(state, ignore)
+        now = time.time()
+        with self.lock:
+            history = self.history.setdefault(session, collections.deque(maxlen=HISTORY_LENGTH))
+            history.append((now, total))
+            # Sessions that went away simply age out
+            self.history.move_to_end(session)
+            while len(self.history) > MAX_SESSIONS:
+                gone, _ = self.history.popitem(last=False)
+                self.published.pop(gone, None)
+            if allocations is not None:
+                self.page_allocations[page] = allocations
+            points = list(history)
+        snapshot = {
+            "session": session,
+            "patient_id": patient_id,
+            "page": page,
+            "updated": now,
+            "total_bytes": total,
+            "reruns": len(points),
+            "keys": {key: {"type": kind, "bytes": size} for key, (kind, size) in sizes.items()},
+            "alerts": growth_alerts(points, sizes)
+        }
+        self._publish(session, snapshot, now)
+        return snapshot
+
+    def _publish(self, session, snapshot, now):
+        if self.store is None:
+            return
+        with self.lock:
+            if now - self.published.get(session, 0) < PUBLISH_INTERVAL_SECONDS:
+                return
+            self.published[session] = now
+        try:
+            self.store.update(f"memory:{session}", lambda _: snapshot, ttl=SNAPSHOT_TTL_SECONDS)
+        except Exception:
+            # Diagnostics must never break a page
+            pass
+
+    def allocations(self):
+        with self.lock:
+            return dict(self.page_allocations)
+
+
+def growth_alerts(points, sizes):
+    alerts = []
+    total = points[-1][1]
+    if total > SESSION_SIZE_LIMIT:
+        largest = next(iter(sizes), None)
+        alerts.append(f"Session holds {total / 1024 / 1024:.1f} MB (largest key: {largest})")
+    if len(points) >= GROWTH_WINDOW:
+        before = points[-GROWTH_WINDOW][1]
+        if total - before > GROWTH_MIN_BYTES and total > before * (1 + GROWTH_RATIO):
+            alerts.append(f"Grew {(total - before) / 1024:.0f} KB over the last {GROWTH_WINDOW} reruns")
+    return alerts
+
+
+def published_sessions(store):
+    """Latest snapshot of every session on every replica, largest first."""
+    keys = store.backend.keys("memory:*")
+    # Snapshots published under raw session ids before they were tagged are skipped
+    snapshots = [value for _, value in (store.get(key) for key in keys) if value and "session" in value]
+    return sorted(snapshots, key=lambda s: s["total_bytes"], reverse=True)
@@ -0,0 +1,138 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import knowledge
+import llm
+import ratelimit
+
+# ----------------- Follow-up Questions -----------------
+FOLLOW_UP_QUESTIONS = {
+    "NonDemented": [
+        "What does a normal MRI result mean for me?",
+        "How can I keep my brain healthy as I age?",
+        "How often should I get checked again?"
+    ],
+    "VeryMildDemented": [
+        "What does very mild dementia mean?",
+        "Can very mild dementia be slowed down?",
+        "What should I ask the neurologist?",
+        "How fast does it usually progress?"
+    ],
+    "MildDemented": [
+        "What does mild dementia mean for daily life?",
+        "Which treatments are available for mild dementia?",
+        "How can family members help?",
+        "Is it safe to keep driving?"
+    ],
+    "ModerateDemented": [
+        "What does moderate dementia mean?",
+        "What kind of care is needed at this stage?",
+        "How can I keep the home safe?",
+        "How do caregivers avoid burnout?"
+    ]
+}
+
+
+def normalize_question(question):
+    return re.sub(r"[^a-z0-9 ]+", "", question.lower()).strip()
+
+
+# ----------------- Answer Cache -----------------
+class AnswerCache:
+    def __init__(self, ttl=3600, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            answer, expires = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return answer
+
+    def put(self, key, answer):
+        with self.lock:
+            self.entries[key] = (answer, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+# ----------------- Prefetcher -----------------
+class Prefetcher:
+    """Answer the usual follow-up questions for a stage before anyone asks them.
+
+    Jobs go through the same single-flight layer and token bucket as live chat,
+    at background priority, so a user asking mid-prefetch joins the running call
+    and interactive requests are always served first.
+    """
+
+    def __init__(self, index, model, single_flight, limiter, ledger, ttl=3600, max_workers=2):
+        self.index = index
+        self.model = model
+        self.ledger = ledger
+        self.single_flight = single_flight
+        self.limiter = limiter
+        self.cache = AnswerCache(ttl)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        self.pending = set()
+
+    def key(self, question, prediction):
+        return (self.model.model_name, prediction, normalize_question(question))
+
+    def questions(self, prediction):
+        return FOLLOW_UP_QUESTIONS.get(prediction, [])
+
+    def is_follow_up(self, question, prediction):
+        wanted = normalize_question(question)
+        return any(normalize_question(q) == wanted for q in self.questions(prediction))
+
+    def cached(self, question, prediction):
+        return self.cache.get(self.key(question, prediction))
+
+    def store(self, question, prediction, answer):
+        if self.is_follow_up(question, prediction):
+            self.cache.put(self.key(question, prediction), answer)
+
+    def schedule(self, prediction, patient_id):
+        for question in self.questions(prediction):
+            key = self.key(question, prediction)
+            with self.lock:
+                if key in self.pending or self.cache.get(key) is not None:
+                    continue
+                self.pending.add(key)
+            self.executor.submit(self._generate, key, question, prediction, patient_id)
+
+    def _generate(self, key, question, prediction, patient_id):
+        try:
+            hits = self.index.search(question, k=3, stage=prediction)
+            if knowledge.local_answer(hits) is not None:
+                return
+            # Same stage-wide context as a live follow-up, so a user asking mid-prefetch joins this call
+            prompt = f"{knowledge.context_prompt(prediction)}\n{knowledge.question_prompt(question, hits)}"
+            answer = self.single_flight.do(
+                llm.request_key(self.model.model_name, prompt),
+                lambda: llm.limited_stream(
+                    self.model, prompt, self.limiter, patient_id, ratelimit.PRIORITY_BACKGROUND,
+                    ledger=self.ledger, page="Prefetch"
+                )
+            )
+            if answer:
+                self.cache.put(key, answer)
+        except Exception:
+            # Prefetching is best effort; the question is answered live instead
+            pass
+        finally:
+            with self.lock:
+                self.pending.discard(key)
@@ -0,0 +1,167 @@
+import time
+
+import db
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Tickets whose owner stopped polling (closed tab, killed process) are dropped after this
+STALE_TICKET_SECONDS = 30
+
+
+class RateLimitTimeout(Exception):
+    def __init__(self, wait):
+        super().__init__(f"Gemini quota exhausted, estimated wait {wait:.0f}s")
+        self.wait = wait
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(error):
+    return getattr(error, "code", None) == 429 or "429" in str(error) or "quota" in str(error).lower()
+
+
+class TokenBucket:
+    """Requests-per-minute and tokens-per-minute buckets shared through SQLite.
+
+    Every process on the node opens the same database file, so all sessions using
+    the one API key draw from the same quota. Waiting callers queue as tickets
+    and are served by priority, then by the patient's usage over the last minute
+    (least served first), then first come first served.
+    """
+
+    def __init__(self, path, rpm=60, tpm=1000000, name="gemini"):
+        self.path = path
+        self.rpm = rpm
+        self.tpm = tpm
+        self.name = name
+        db.prepare(path)
+        with db.connect(path) as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS bucket (
+                    name TEXT PRIMARY KEY,
+                    requests REAL, tokens REAL, updated REAL, blocked_until REAL
+                );
+                CREATE TABLE IF NOT EXISTS queue (
+                    ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT, patient_id TEXT, priority INTEGER, tokens INTEGER,
+                    enqueued REAL, heartbeat REAL
+                );
+                CREATE TABLE IF NOT EXISTS usage (
+                    name TEXT, patient_id TEXT, ts REAL, tokens INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS usage_ts ON usage (name, ts);
+            """)
+            conn.execute(
+                "INSERT OR IGNORE INTO bucket VALUES (?, ?, ?, ?, 0)",
+                (name, float(rpm), float(tpm), time.time())
+            )
+
+    def _refill(self, conn, now):
+        requests, tokens, updated, blocked_until = conn.execute(
+            "SELECT requests, tokens, updated, blocked_until FROM bucket WHERE name = ?", (self.name,)
+        ).fetchone()
+        elapsed = max(0.0, now - updated)
+        requests = min(float(self.rpm), requests + elapsed * self.rpm / 60.0)
+        tokens = min(float(self.tpm), tokens + elapsed * self.tpm / 60.0)
+        return requests, tokens, blocked_until
+
+    def _save(self, conn, requests, tokens, now, blocked_until):
+        conn.execute(
+            "UPDATE bucket SET requests = ?, tokens = ?, updated = ?, blocked_until = ? WHERE name = ?",
+            (requests, tokens, now, blocked_until, self.name)
+        )
+
+    def _ordered_queue(self, conn, now):
+        conn.execute("DELETE FROM queue WHERE name = ? AND heartbeat < ?", (self.name, now - STALE_TICKET_SECONDS))
+        conn.execute("DELETE FROM usage WHERE name = ? AND ts < ?", (self.name, now - 60))
+        return conn.execute("""
+            SELECT q.ticket, q.tokens FROM queue q
+            LEFT JOIN (
+                SELECT patient_id, SUM(tokens) AS used FROM usage WHERE name = ? GROUP BY patient_id
+            ) u ON u.patient_id = q.patient_id
+            WHERE q.name = ?
+            ORDER BY q.priority, COALESCE(u.used, 0), q.ticket
+        """, (self.name, self.name)).fetchall()
+
+    def _wait_for(self, requests, tokens, blocked_until, need_requests, need_tokens, now):
+        wait = max(
+            (need_requests - requests) * 60.0 / self.rpm,
+            (need_tokens - tokens) * 60.0 / self.tpm,
+            0.0
+        )
+        return max(wait, blocked_until - now)
+
+    def estimate_wait(self, tokens):
+        """Seconds a new request of this size would wait behind the current queue."""
+        now = time.time()
+        with db.connect(self.path) as conn:
+            requests, available, blocked_until = self._refill(conn, now)
+            queued = self._ordered_queue(conn, now)
+        need_tokens = min(tokens, self.tpm) + sum(t for _, t in queued)
+        return self._wait_for(requests, available, blocked_until, len(queued) + 1, need_tokens, now)
+
+    def acquire(self, patient_id, tokens, priority=PRIORITY_INTERACTIVE, timeout=60):
+        tokens = min(int(tokens), self.tpm)
+        now = time.time()
+        with db.connect(self.path) as conn:
+            ticket = conn.execute(
+                "INSERT INTO queue (name, patient_id, priority, tokens, enqueued, heartbeat) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.name, patient_id, priority, tokens, now, now)
+            ).lastrowid
+
+        deadline = now + timeout
+        try:
+            while True:
+                now = time.time()
+                with db.connect(self.path) as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    requests, available, blocked_until = self._refill(conn, now)
+                    queued = self._ordered_queue(conn, now)
+                    tickets = [t for t, _ in queued]
+                    position = tickets.index(ticket) if ticket in tickets else len(tickets)
+                    ahead_tokens = sum(t for _, t in queued[:position + 1])
+
+                    if position == 0 and now >= blocked_until and requests >= 1 and available >= tokens:
+                        self._save(conn, requests - 1, available - tokens, now, blocked_until)
+                        conn.execute("DELETE FROM queue WHERE ticket = ?", (ticket,))
+                        conn.execute("INSERT INTO usage VALUES (?, ?, ?, ?)", (self.name, patient_id, now, tokens))
+                        conn.execute("COMMIT")
+                        ticket = None
+                        return
+
+                    self._save(conn, requests, available, now, blocked_until)
+                    conn.execute("UPDATE queue SET heartbeat = ? WHERE ticket = ?", (now, ticket))
+                    conn.execute("COMMIT")
+
+                wait = self._wait_for(requests, available, blocked_until, position + 1, ahead_tokens, now)
+                if now + wait > deadline:
+                    raise RateLimitTimeout(wait)
+                time.sleep(min(max(wait, 0.05), 1.0))
+        finally:
+            if ticket is not None:
+                with db.connect(self.path) as conn:
+                    conn.execute("DELETE FROM queue WHERE ticket = ?", (ticket,))
+
+    def settle(self, estimated, actual):
+        """Correct the token bucket once the real token count of a call is known."""
+        if actual is None or actual == estimated:
+            return
+        now = time.time()
+        with db.connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            requests, available, blocked_until = self._refill(conn, now)
+            self._save(conn, requests, min(float(self.tpm), available + estimated - actual), now, blocked_until)
+            conn.execute("COMMIT")
+
+    def penalize(self, retry_after=10):
+        """Block everyone sharing the key after the provider answered 429."""
+        now = time.time()
+        with db.connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            requests, available, blocked_until = self._refill(conn, now)
+            self._save(conn, 0.0, available, now, max(blocked_until, now + retry_after))
+            conn.execute("COMMIT")
@@ -0,0 +1,391 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+import activity
+import adherence
+import db
+import state
+
+# ----------------- Schemas -----------------
+MOODS = ["😞", "🙁", "😐", "🙂", "😊"]
+MEDICATION_FREQUENCIES = ["Once daily", "Twice daily", "Three times daily", "As needed"]
+REMINDER_FREQUENCIES = ["Daily", "Weekly", "Weekdays", "Weekends", "Custom"]
+RELATIONS = ["Doctor", "Family Member", "Caregiver", "Friend", "Neighbor", "Other"]
+PRIORITIES = ["Low", "Medium", "High"]
+
+SCHEMAS = {
+    "progress": pa.schema([
+        ("patient_id", pa.string()), ("date", pa.date32()), ("score", pa.int16()),
+        ("mood", pa.string()), ("notes", pa.string())
+    ]),
+    "medications": pa.schema([
+        ("patient_id", pa.string()), ("id", pa.string()), ("name", pa.string()), ("dosage", pa.int32()),
+        ("time", pa.time32("s")), ("frequency", pa.string()), ("notes", pa.string()),
+        ("last_taken", pa.timestamp("us"))
+    ]),
+    "emergency_contacts": pa.schema([
+        ("patient_id", pa.string()), ("name", pa.string()), ("phone", pa.string()),
+        ("relation", pa.string()), ("priority", pa.string()), ("email", pa.string())
+    ]),
+    "notifications": pa.schema([
+        ("patient_id", pa.string()), ("time", pa.time32("s")), ("message", pa.string()),
+        ("frequency", pa.string()), ("active", pa.bool_())
+    ]),
+    "chat_history": pa.schema([
+        ("patient_id", pa.string()), ("seq", pa.int32()), ("role", pa.string()), ("content", pa.string())
+    ]),
+    "events": pa.schema([
+        ("patient_id", pa.string()), ("seq", pa.int64()), ("ts", pa.timestamp("us")),
+        ("kind", pa.string()), ("payload", pa.string())
+    ])
+}
+
+# Session lists exported per patient (events come from the activity log)
+RECORD_TABLES = ["progress", "medications", "emergency_contacts", "notifications", "chat_history"]
+
+BATCH_ROWS = 50000
+
+# Activity events recorded when an item is added to a session list, however it was added
+ADDED_EVENTS = {
+    "medications": lambda item: ("medication_added", adherence.schedule_payload(item)),
+    "emergency_contacts": lambda item: ("contacts_updated", {"name": item["name"]}),
+    "progress": lambda item: ("progress_logged", {"score": item["score"]})
+}
+
+
+def flatten(patient_id, table, items):
+    """Session list -> rows for one table."""
+    rows = []
+    for seq, item in enumerate(items):
+        row = {"patient_id": patient_id}
+        if table == "chat_history":
+            row.update(seq=seq, role=item["role"], content=item["content"])
+        else:
+            row.update({name: item.get(name) for name in SCHEMAS[table].names if name != "patient_id"})
+        rows.append(row)
+    return rows
+
+
+def unflatten(table, rows):
+    """Rows for one patient -> the dicts the pages keep in st.session_state."""
+    items = []
+    for row in rows:
+        item = {k: v for k, v in row.items() if k != "patient_id"}
+        if table == "chat_history":
+            item = {"role": item["role"], "content": item["content"]}
+        elif table in ("medications", "progress"):
+            item["notes"] = item.get("notes") or ""
+        elif table == "emergency_contacts" and not item.get("email"):
+            item.pop("email", None)
+        items.append(item)
+    return items
+
+
+# ----------------- Export -----------------
+class TableWriter:
+    """Buffer rows and write them as record batches to one Parquet or CSV file."""
+
+    def __init__(self, path, schema, fmt, batch_rows=BATCH_ROWS):
+        self.path = path
+        self.schema = schema
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.buffer = []
+        self.rows = 0
+        self.writer = None
+
+    def write_rows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_rows:
+            self.flush()
+
+    def write_batch(self, batch):
+        if self.writer is None:
+            if self.fmt == "parquet":
+                self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+            else:
+                self.writer = pacsv.CSVWriter(self.path, self.schema)
+        self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def flush(self):
+        if self.buffer:
+            self.write_batch(pa.RecordBatch.from_pylist(self.buffer, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.writer is None:
+            # Always leave a file behind so every table exists in the export
+            self.write_batch(pa.RecordBatch.from_pylist([], schema=self.schema))
+        self.writer.close()
+        return self.rows
+
+
+def export_records(patients, out_dir, fmt="parquet", batch_rows=BATCH_ROWS):
+    """Stream (patient_id, record) pairs into one file per table.
+
+    A record is any mapping with the session lists (progress, medications, ...).
+    Rows are written in batches, so memory stays flat however many patients there are.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    writers = {
+        table: TableWriter(os.path.join(out_dir, f"{table}.{fmt}"), SCHEMAS[table], fmt, batch_rows)
+        for table in RECORD_TABLES
+    }
+    patients_written = 0
+    for patient_id, record in patients:
+        for table, writer in writers.items():
+            writer.write_rows(flatten(patient_id, table, record.get(table) or []))
+        patients_written += 1
+    counts = {table: writer.close() for table, writer in writers.items()}
+    return {"patients": patients_written, "rows": counts}
+
+
+def export_events(db_path, out_dir, fmt="parquet", patient_ids=None, batch_rows=BATCH_ROWS):
+    """Stream the activity log straight from SQLite in batches."""
+    os.makedirs(out_dir, exist_ok=True)
+    writer = TableWriter(os.path.join(out_dir, f"events.{fmt}"), SCHEMAS["events"], fmt, batch_rows)
+    query = "SELECT patient_id, seq, ts, kind, payload FROM events"
+    params = []
+    if patient_ids:
+        query += f" WHERE patient_id IN ({','.join('?' * len(patient_ids))})"
+        params = list(patient_ids)
+    with db.connect(db_path) as conn:
+        cursor = conn.execute(query + " ORDER BY seq", params)
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            patient, seq, ts, kind, payload = zip(*rows)
+            writer.write_batch(pa.RecordBatch.from_arrays([
+                pa.array(patient, pa.string()),
+                pa.array(seq, pa.int64()),
+                pc.cast(pc.round(pc.multiply(pa.array(ts, pa.float64()), 1e6)), pa.int64()).cast(pa.timestamp("us")),
+                pa.array(kind, pa.string()),
+                pa.array(payload, pa.string())
+            ], schema=SCHEMAS["events"]))
+    return writer.close()
+
+
+# ----------------- Validation -----------------
+def _not_blank(column):
+    return pc.and_(pc.is_valid(column), pc.greater(pc.utf8_length(pc.utf8_trim_whitespace(column)), 0))
+
+
+def _one_of(column, values):
+    return pc.is_in(column, value_set=pa.array(values))
+
+
+def validate(table, batch):
+    """Vectorized row checks; returns (valid rows, rejected rows)."""
+    checks = [_not_blank(batch.column("patient_id"))]
+    if table == "progress":
+        score = batch.column("score")
+        checks += [pc.is_valid(batch.column("date")), pc.is_valid(score),
+                   pc.greater_equal(score, 0), pc.less_equal(score, 100), _one_of(batch.column("mood"), MOODS)]
+    elif table == "medications":
+        dosage = batch.column("dosage")
+        checks += [_not_blank(batch.column("name")), pc.is_valid(batch.column("time")),
+                   pc.greater_equal(dosage, 1), pc.less_equal(dosage, 1000),
+                   _one_of(batch.column("frequency"), MEDICATION_FREQUENCIES)]
+    elif table == "emergency_contacts":
+        checks += [_not_blank(batch.column("name")), _one_of(batch.column("relation"), RELATIONS),
+                   _one_of(batch.column("priority"), PRIORITIES)]
+    elif table == "notifications":
+        checks += [pc.is_valid(batch.column("time")), pc.is_valid(batch.column("message")),
+                   _one_of(batch.column("frequency"), REMINDER_FREQUENCIES)]
+    elif table == "chat_history":
+        checks += [_one_of(batch.column("role"), ["user", "bot"]), pc.is_valid(batch.column("content"))]
+
+    mask = checks[0]
+    for check in checks[1:]:
+        mask = pc.and_kleene(mask, check)
+    mask = pc.fill_null(mask, False)
+    return batch.filter(mask), batch.filter(pc.invert(mask))
+
+
+# ----------------- Import -----------------
+def find_table_file(folder, table):
+    for fmt in ("parquet", "csv"):
+        path = os.path.join(folder, f"{table}.{fmt}")
+        if os.path.exists(path):
+            return path, fmt
+    return None, None
+
+
+def iter_batches(path, fmt, schema, batch_rows=BATCH_ROWS):
+    if fmt == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+            yield pa.Table.from_batches([batch]).select(schema.names).cast(schema).combine_chunks().to_batches()[0]
+        return
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=1 << 22),
+        convert_options=pacsv.ConvertOptions(column_types=schema, include_columns=schema.names)
+    )
+    for batch in reader:
+        yield batch
+
+
+def import_records(folder, sink, checkpoint_path=None, tables=None, batch_rows=BATCH_ROWS, rejects_dir=None):
+    """Validate and load every table file found in folder, one batch at a time.
+
+    sink(table, index, batch) receives only valid rows. Progress is checkpointed
+    after every batch, so an interrupted import resumes at the next batch; a sink
+    that keys its output on index stays idempotent across retries.
+    """
+    checkpoint = {}
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+
+    report = {}
+    for table in tables or RECORD_TABLES:
+        path, fmt = find_table_file(folder, table)
+        if path is None:
+            continue
+        done = checkpoint.get(table, 0)
+        stats = {"batches": 0, "imported": 0, "rejected": 0, "skipped_batches": done}
+        started = time.time()
+        for i, batch in enumerate(iter_batches(path, fmt, SCHEMAS[table], batch_rows)):
+            if i < done:
+                continue
+            valid, rejected = validate(table, batch)
+            if valid.num_rows:
+                sink(table, i, valid)
+            if rejected.num_rows and rejects_dir:
+                os.makedirs(rejects_dir, exist_ok=True)
+                pacsv.write_csv(rejected, os.path.join(rejects_dir, f"{table}.{i:05d}.csv"))
+            stats["batches"] += 1
+            stats["imported"] += valid.num_rows
+            stats["rejected"] += rejected.num_rows
+            if checkpoint_path:
+                checkpoint[table] = i + 1
+                with open(checkpoint_path + ".tmp", "w") as f:
+                    json.dump(checkpoint, f)
+                os.replace(checkpoint_path + ".tmp", checkpoint_path)
+        stats["seconds"] = round(time.time() - started, 3)
+        report[table] = stats
+    return report
+
+
+def record_added(activity_log, table, items):
+    """Log the events the pages record for items added to a session list."""
+    if table in ADDED_EVENTS:
+        for item in items:
+            activity_log.record(*ADDED_EVENTS[table](item))
+
+
+def rows_by_patient(batch):
+    grouped = {}
+    for row in batch.to_pylist():
+        grouped.setdefault(row["patient_id"], []).append(row)
+    return grouped
+
+
+def store_sink(store, activity_db=None):
+    """An import_records sink that appends each batch to its patients' records in the shared store.
+
+    Items added this way log the same activity events as the pages when
+    activity_db is given.
+    """
+    def append(table, items):
+        def apply(current):
+            current = state.empty(table) if current is None else current
+            current.extend(items)
+            return current
+        return apply
+
+    def sink(table, index, batch):
+        for patient_id, rows in rows_by_patient(batch).items():
+            items = unflatten(table, rows)
+            if table == "medications":
+                for item in items:
+                    item["id"] = item.get("id") or adherence.new_medication_id()
+            store.update(f"patient:{patient_id}:{table}", append(table, items))
+            if activity_db:
+                record_added(activity.ActivityLog(activity_db, patient_id), table, items)
+
+    return sink
+
+
+def export_zip(patients, fmt="parquet"):
+    """Export to a temporary folder and return the table files zipped, for downloads."""
+    with tempfile.TemporaryDirectory() as folder:
+        export_records(patients, folder, fmt)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name in sorted(os.listdir(folder)):
+                archive.write(os.path.join(folder, name), name)
+        return buffer.getvalue()
+
+
+def load_patient(folder, patient_id):
+    """Validated session lists for one patient from a folder of table files."""
+    loaded = {table: [] for table in RECORD_TABLES}
+
+    def sink(table, index, batch):
+        mine = batch.filter(pc.equal(batch.column("patient_id"), patient_id))
+        loaded[table].extend(unflatten(table, mine.to_pylist()))
+
+    report = import_records(folder, sink)
+    return loaded, report
+
+
+# ----------------- Command Line -----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export and import of patient records")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    events = commands.add_parser("export-events", help="Export the activity log of the whole cohort")
+    events.add_argument("--db", default="data/activity.sqlite3")
+    events.add_argument("--out", required=True)
+    events.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    events.add_argument("--patient", action="append", help="Limit to these patient ids")
+
+    load = commands.add_parser("import", help="Validate a folder of table files and merge them into every patient's record")
+    load.add_argument("folder")
+    load.add_argument("--state", default="sqlite:///data/state.sqlite3", help="Shared state store to load into")
+    load.add_argument("--activity-db", default="data/activity.sqlite3")
+    load.add_argument("--out", help="Also keep the validated rows as Parquet, and the rejected ones as CSV, here")
+    load.add_argument("--checkpoint", help="JSON file used to resume an interrupted import")
+    load.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+
+    args = parser.parse_args(argv)
+    if args.command == "export-events":
+        rows = export_events(args.db, args.out, args.format, args.patient)
+        print(json.dumps({"events": rows}))
+        return
+
+    load_into_store = store_sink(state.SharedState(state.open_backend(args.state)), args.activity_db)
+
+    def sink(table, index, batch):
+        load_into_store(table, index, batch)
+        if args.out:
+            # One file per batch keeps every finished batch durable for resumes
+            folder = os.path.join(args.out, table)
+            os.makedirs(folder, exist_ok=True)
+            pq.write_table(pa.Table.from_batches([batch]), os.path.join(folder, f"part-{index:05d}.parquet"), compression="zstd")
+
+    report = import_records(
+        args.folder, sink,
+        checkpoint_path=args.checkpoint,
+        batch_rows=args.batch_rows,
+        rejects_dir=os.path.join(args.out, "rejects") if args.out else None
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
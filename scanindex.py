@@ -0,0 +1,406 @@
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+import db
+
+INDEX_DIR = "data/scan_index"
+
+# Below this many scans every query is exact; from here on scans are
+# partitioned into clusters and a query only reads the closest ones
+PARTITION_MIN = 4096
+MAX_LISTS = 1024
+# Clusters read per query; more finds more of the true neighbours but reads more rows
+PROBES = 8
+# Scans sampled to fit the clusters, and clustering passes over them
+TRAIN_SAMPLE = 20000
+TRAIN_ITERATIONS = 8
+# The clusters are refit once the index has grown this much since they were fit
+RETRAIN_GROWTH = 2.0
+# Scans added after the last partitioning are searched exactly until there are this many
+TAIL_ROWS = 2048
+ASSIGN_CHUNK = 8192
+# How long a process may hold the partitioning job before another may take it over
+LEASE_SECONDS = 600
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(sample, lists, iterations=TRAIN_ITERATIONS, seed=0):
+    """Spherical k-means: unit-length centroids that maximize cosine similarity."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(iterations):
+        nearest = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, nearest, sample)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty clusters from random scans so every list stays useful
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class ScanIndex:
+    """Approximate nearest-neighbour search over scan embeddings in one embedding space.
+
+    Vectors are unit length and stored as float16 rows of a memory-mapped file
+    that only ever grows; SQLite holds which (patient, scan) each row is and
+    serializes writers across processes. Once the index is large enough, rows
+    are grouped by their nearest k-means centroid and a query reads only the
+    PROBES closest groups, plus any rows added since the grouping was last
+    brought up to date. Regrouping runs in a background thread and swaps in
+    new files, so adding a scan never waits for it.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.db = os.path.join(folder, "rows.sqlite3")
+        self.vectors_path = os.path.join(folder, "vectors.f16")
+        db.prepare(self.db)
+        with db.connect(self.db) as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS rows (
+                    row INTEGER PRIMARY KEY, patient_id TEXT, scan_id TEXT, added REAL,
+                    UNIQUE (patient_id, scan_id)
+                );
+                CREATE INDEX IF NOT EXISTS rows_scan ON rows (scan_id);
+                CREATE TABLE IF NOT EXISTS meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    dim INTEGER, count INTEGER, generation INTEGER, lists INTEGER,
+                    partitioned INTEGER, trained INTEGER, lease_until REAL
+                );
+                INSERT OR IGNORE INTO meta VALUES (0, NULL, 0, 0, 0, 0, 0, 0);
+            """)
+        self.lock = threading.Lock()
+        self.maintaining = False
+        self.mapped = None
+        self.loaded_generation = None
+        self.partitions = None
+        self.stats = {"queries": 0, "rows_scanned": 0, "partitionings": 0}
+
+    def _meta(self, conn):
+        dim, count, generation, lists, partitioned, trained = conn.execute(
+            "SELECT dim, count, generation, lists, partitioned, trained FROM meta"
+        ).fetchone()
+        return {"dim": dim, "count": count, "generation": generation, "lists": lists,
+                "partitioned": partitioned, "trained": trained}
+
+    def _path(self, name, generation):
+        return os.path.join(self.folder, f"{name}-{generation}.npy")
+
+    # ----------------- Adding -----------------
+    def add(self, patient_id, scan_id, vector):
+        return self.add_many([(patient_id, scan_id, vector)])
+
+    def add_many(self, items):
+        """Add (patient_id, scan_id, vector) items; scans already in the index are skipped.
+
+        Returns how many were added.
+        """
+        with db.connect(self.db) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            meta = self._meta(conn)
+            row = meta["count"]
+            added = []
+            now = time.time()
+            for patient_id, scan_id, vector in items:
+                vector = np.asarray(vector, dtype=np.float32).ravel()
+                dim = meta["dim"] or len(vector)
+                if len(vector) != dim:
+                    raise ValueError(f"Expected a {dim}-dimensional embedding, got {len(vector)}")
+                meta["dim"] = dim
+                inserted = conn.execute(
+                    "INSERT OR IGNORE INTO rows VALUES (?, ?, ?, ?)", (row, patient_id, scan_id, now)
+                ).rowcount
+                if inserted:
+                    added.append(vector)
+                    row += 1
+            if added:
+                # Written where the rows belong rather than appended, so the rows
+                # of a transaction that never committed are simply overwritten
+                with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as f:
+                    f.seek(meta["count"] * meta["dim"] * 2)
+                    f.write(normalize(np.stack(added)).astype(np.float16).tobytes())
+                conn.execute("UPDATE meta SET dim = ?, count = ?", (meta["dim"], row))
+            conn.execute("COMMIT")
+        meta["count"] = row
+        if self.needs_partitioning(meta):
+            self._maintain_in_background()
+        return len(added)
+
+    # ----------------- Partitioning -----------------
+    def needs_partitioning(self, meta):
+        if meta["count"] < PARTITION_MIN:
+            return False
+        if not meta["trained"] or meta["count"] >= meta["trained"] * RETRAIN_GROWTH:
+            return True
+        return meta["count"] - meta["partitioned"] >= TAIL_ROWS
+
+    def _maintain_in_background(self):
+        with self.lock:
+            if self.maintaining:
+                return
+            self.maintaining = True
+
+        def run():
+            try:
+                self.maintain()
+            except Exception:
+                # Rows stay searchable exactly; the next add tries again
+                pass
+            finally:
+                with self.lock:
+                    self.maintaining = False
+
+        threading.Thread(target=run, daemon=True, name="scan-index").start()
+
+    def maintain(self):
+        """Refit the clusters or file new rows into them, if due. Returns True when partitions changed."""
+        with db.connect(self.db) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            meta = self._meta(conn)
+            taken = conn.execute(
+                "UPDATE meta SET lease_until = ? WHERE lease_until < ?", (time.time() + LEASE_SECONDS, time.time())
+            ).rowcount
+            conn.execute("COMMIT")
+        if not taken:
+            return False
+        try:
+            if not self.needs_partitioning(meta):
+                return False
+            count, dim = meta["count"], meta["dim"]
+            vectors = self._vectors(count, dim)
+            if not meta["trained"] or count >= meta["trained"] * RETRAIN_GROWTH:
+                lists = int(min(MAX_LISTS, max(16, 4 * np.sqrt(count))))
+                rng = np.random.default_rng(count)
+                sample = np.sort(rng.choice(count, min(count, TRAIN_SAMPLE), replace=False))
+                centroids = kmeans(np.asarray(vectors[sample], dtype=np.float32), lists)
+                assigned = np.empty(0, dtype=np.int32)
+                start, trained = 0, count
+            else:
+                centroids = np.load(self._path("centroids", meta["generation"]))
+                assigned = np.load(self._path("lists", meta["generation"]))
+                start, trained = meta["partitioned"], meta["trained"]
+            new = [
+                np.argmax(np.asarray(vectors[i:min(i + ASSIGN_CHUNK, count)], dtype=np.float32) @ centroids.T, axis=1)
+                for i in range(start, count, ASSIGN_CHUNK)
+            ]
+            assigned = np.concatenate([assigned] + new).astype(np.int32)
+            order = np.argsort(assigned, kind="stable").astype(np.int32)
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assigned, minlength=len(centroids)))]).astype(np.int64)
+
+            generation = meta["generation"] + 1
+            for name, array in (("centroids", centroids), ("lists", assigned), ("order", order), ("offsets", offsets)):
+                np.save(self._path(name, generation), array)
+            with db.connect(self.db) as conn:
+                conn.execute(
+                    "UPDATE meta SET generation = ?, lists = ?, partitioned = ?, trained = ?",
+                    (generation, len(centroids), count, trained)
+                )
+            self.stats["partitionings"] += 1
+            # The generation just replaced stays for queries that read the old state a moment ago
+            for name in ("centroids", "lists", "order", "offsets"):
+                try:
+                    os.remove(self._path(name, generation - 2))
+                except OSError:
+                    pass
+            return True
+        finally:
+            with db.connect(self.db) as conn:
+                conn.execute("UPDATE meta SET lease_until = 0")
+
+    # ----------------- Searching -----------------
+    def _vectors(self, count, dim):
+        # Remapped only when the file has grown past the current view
+        mapped = self.mapped
+        if mapped is None or len(mapped) < count or mapped.shape[1] != dim:
+            mapped = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(count, dim))
+            self.mapped = mapped
+        return mapped
+
+    def _partitions(self, generation):
+        partitions = self.partitions
+        if self.loaded_generation != generation:
+            partitions = tuple(
+                np.load(self._path(name, generation), mmap_mode="r") for name in ("centroids", "order", "offsets")
+            )
+            self.partitions, self.loaded_generation = partitions, generation
+        return partitions
+
+    def state(self):
+        with db.connect(self.db) as conn:
+            return self._meta(conn)
+
+    def candidates(self, query, meta, probes=PROBES):
+        """Rows worth scoring for a query: the closest clusters plus the rows added since partitioning."""
+        count = meta["count"]
+        if not meta["generation"]:
+            return np.arange(count)
+        centroids, order, offsets = self._partitions(meta["generation"])
+        closest = np.argsort(-(centroids @ query))[:probes]
+        rows = [order[offsets[cluster]:offsets[cluster + 1]] for cluster in closest]
+        rows.append(np.arange(meta["partitioned"], count))
+        # Sorted rows read the memory-mapped file front to back
+        return np.sort(np.concatenate(rows))
+
+    def search(self, vector, k=5, exclude_scan=None, probes=PROBES):
+        """The k most similar scans: [{"patient_id", "scan_id", "similarity"}], best first."""
+        meta = self.state()
+        if not meta["count"]:
+            return []
+        query = normalize(vector)
+        rows = self.candidates(query, meta, probes)
+        vectors = self._vectors(meta["count"], meta["dim"])
+        scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+        self.stats["queries"] += 1
+        self.stats["rows_scanned"] += len(rows)
+        # A few spare results in case the query scan itself is among them
+        wanted = min(len(rows), k + 4)
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        top = top[np.argsort(-scores[top])]
+        found = self._describe(rows[top].tolist())
+        hits = []
+        for row, score in zip(rows[top].tolist(), scores[top].tolist()):
+            patient_id, scan_id = found[row]
+            if scan_id == exclude_scan:
+                continue
+            hits.append({"patient_id": patient_id, "scan_id": scan_id, "similarity": round(score, 4)})
+        return hits[:k]
+
+    def _describe(self, rows):
+        with db.connect(self.db) as conn:
+            found = conn.execute(
+                f"SELECT row, patient_id, scan_id FROM rows WHERE row IN ({','.join('?' * len(rows))})", rows
+            ).fetchall()
+        return {row: (patient_id, scan_id) for row, patient_id, scan_id in found}
+
+    def vector(self, patient_id, scan_id):
+        """The stored embedding of one scan, or None."""
+        meta = self.state()
+        with db.connect(self.db) as conn:
+            found = conn.execute(
+                "SELECT row FROM rows WHERE patient_id = ? AND scan_id = ?", (patient_id, scan_id)
+            ).fetchone()
+        if found is None or found[0] >= meta["count"]:
+            return None
+        return np.asarray(self._vectors(meta["count"], meta["dim"])[found[0]], dtype=np.float32)
+
+    def patient_scans(self, patient_id, vector):
+        """Every scan of one patient with its similarity to vector, oldest first."""
+        meta = self.state()
+        with db.connect(self.db) as conn:
+            found = conn.execute(
+                "SELECT row, scan_id FROM rows WHERE patient_id = ? AND row < ? ORDER BY row",
+                (patient_id, meta["count"])
+            ).fetchall()
+        if not found:
+            return []
+        rows = [row for row, _ in found]
+        scores = np.asarray(self._vectors(meta["count"], meta["dim"])[rows], dtype=np.float32) @ normalize(vector)
+        return [
+            {"patient_id": patient_id, "scan_id": scan_id, "similarity": round(score, 4)}
+            for (_, scan_id), score in zip(found, scores.tolist())
+        ]
+
+
+class ScanIndexes:
+    """One ScanIndex per embedding space, opened on first use.
+
+    Embeddings from different models are not comparable, so each model that
+    embeds scans its own way gets its own index folder under root.
+    """
+
+    def __init__(self, root=INDEX_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.indexes = {}
+
+    def get(self, space):
+        with self.lock:
+            index = self.indexes.get(space)
+            if index is None:
+                index = self.indexes[space] = ScanIndex(os.path.join(self.root, space))
+            return index
+
+
+# ----------------- Benchmark -----------------
+def _clustered_vectors(centres, count, rng, noise=0.5):
+    labels = rng.integers(len(centres), size=count)
+    return normalize(centres[labels] + noise * rng.standard_normal((count, centres.shape[1])) / np.sqrt(centres.shape[1]))
+
+
+def benchmark(folder, count=300000, dim=256, queries=200, k=10, batch=20000):
+    """Fill a fresh index with synthetic clustered embeddings, then time queries and measure recall@k."""
+    rng = np.random.default_rng(7)
+    centres = normalize(rng.standard_normal((500, dim)))
+    index = ScanIndex(folder)
+    started = time.perf_counter()
+    for offset in range(0, count, batch):
+        vectors = _clustered_vectors(centres, min(batch, count - offset), rng)
+        index.add_many((f"P{(offset + i) % 5000}", f"S{offset + i}", vector) for i, vector in enumerate(vectors))
+    while index.maintaining:
+        time.sleep(0.1)
+    index.maintain()
+    build_seconds = time.perf_counter() - started
+
+    probes = _clustered_vectors(centres, queries, rng)
+    latencies, recall = [], []
+    meta = index.state()
+    stored = np.asarray(index._vectors(meta["count"], meta["dim"]), dtype=np.float32)
+    for query in probes:
+        query_started = time.perf_counter()
+        hits = index.search(query, k)
+        latencies.append((time.perf_counter() - query_started) * 1000)
+        exact = set(np.argsort(-(stored @ query))[:k].tolist())
+        recall.append(len({int(hit["scan_id"][1:]) for hit in hits} & exact) / k)
+    return {
+        "scans": meta["count"],
+        "lists": meta["lists"],
+        "build_seconds": round(build_seconds, 1),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        f"recall_at_{k}": round(float(np.mean(recall)), 3),
+        "rows_per_query": index.stats["rows_scanned"] // index.stats["queries"]
+    }
+
+
+# ----------------- Command Line -----------------
+def main(argv=None):
+    import json
+
+    import scans
+    import state
+
+    parser = argparse.ArgumentParser(description="Similar-scan index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Index every archived scan not yet in the index")
+    build.add_argument("--state", default="sqlite:///data/state.sqlite3", help="Shared state backend URL")
+    build.add_argument("--version", help="Model version whose embeddings to use (default: the one serving)")
+    commands.add_parser("status", help="Rows and partitions per embedding space")
+    bench = commands.add_parser("bench", help="Time queries on synthetic embeddings")
+    bench.add_argument("folder", help="Scratch folder for the benchmark index")
+    bench.add_argument("--count", type=int, default=300000)
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        print(json.dumps(benchmark(args.folder, args.count), indent=2))
+    elif args.command == "status":
+        spaces = sorted(os.listdir(INDEX_DIR)) if os.path.isdir(INDEX_DIR) else []
+        print(json.dumps({space: ScanIndexes().get(space).state() for space in spaces}, indent=2))
+    else:
+        store = state.SharedState(state.open_backend(args.state), cache_ttl=0)
+        report = scans.index_archive(store, ScanIndexes(), args.version)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
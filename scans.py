@@ -0,0 +1,253 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from PIL import Image
+
+import classifier
+import state
+
+SCAN_DIR = "data/scans"
+
+BATCH_SIZE = 32
+# Chunks queued per worker, enough to keep every worker busy without loading the whole archive
+CHUNKS_PER_WORKER = 2
+
+SIMILAR_SCANS = 5
+
+
+# ----------------- Archive -----------------
+def scan_id(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()[:32]
+
+
+def scan_path(scan_dir, scan_id):
+    return os.path.join(scan_dir, scan_id[:2], scan_id)
+
+
+def save(image_bytes, scan_dir=SCAN_DIR):
+    """Store the image under its content hash; the same scan is only stored once."""
+    sid = scan_id(image_bytes)
+    path = scan_path(scan_dir, sid)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(image_bytes)
+        os.replace(path + ".tmp", path)
+    return sid
+
+
+def archive(scans, image_bytes, prediction, model, scan_dir=SCAN_DIR):
+    """Save an analysed upload and add it to the end of the patient's scan list.
+
+    A scan uploaded again is moved to the end with this analysis, so it is the latest again.
+    """
+    sid = save(image_bytes, scan_dir)
+    for i, entry in enumerate(scans):
+        if entry["scan_id"] == sid:
+            del scans[i]
+            break
+    entry = {"scan_id": sid, "uploaded": datetime.datetime.now(), "prediction": prediction, "model": model}
+    scans.append(entry)
+    return entry
+
+
+def latest_prediction(scans):
+    # By upload time rather than position, as lists merged from other sessions need not be in order
+    return max(scans, key=lambda entry: entry["uploaded"])["prediction"] if scans else None
+
+
+# ----------------- Similar Scans -----------------
+def labelled(store, hits):
+    """Add each hit's current label and upload time, read from its patient's scan list."""
+    keys = sorted({f"patient:{hit['patient_id']}:scans" for hit in hits})
+    entries = {}
+    for key, (_, raw) in store.get_many(keys).items():
+        for entry in state.decode(raw) if raw is not None else []:
+            entries[(key.split(":")[1], entry["scan_id"])] = entry
+    results = []
+    for hit in hits:
+        entry = entries.get((hit["patient_id"], hit["scan_id"]))
+        if entry is not None:
+            results.append({**hit, "label": entry["prediction"], "uploaded": entry["uploaded"]})
+    return results
+
+
+def similar_scans(store, index, patient_id, scan_id, k=SIMILAR_SCANS):
+    """(the patient's other scans, the k closest scans of other patients), each labelled, best first."""
+    vector = index.vector(patient_id, scan_id)
+    if vector is None:
+        return [], []
+    own = [hit for hit in index.patient_scans(patient_id, vector) if hit["scan_id"] != scan_id]
+    own.sort(key=lambda hit: -hit["similarity"])
+    # Extra candidates since the patient's own scans are among the closest
+    others = [hit for hit in index.search(vector, 2 * k, exclude_scan=scan_id) if hit["patient_id"] != patient_id]
+    return labelled(store, own), labelled(store, others[:k])
+
+
+def index_archive(store, indexes, version=None, models_dir=classifier.MODELS_DIR, scan_dir=SCAN_DIR, batch_size=BATCH_SIZE):
+    """Embed every archived scan missing from the version's index, e.g. after promoting a model that embeds its own way."""
+    model = classifier.load_version(version or classifier.read_pointer(models_dir)["current"], models_dir)
+    index = indexes.get(model.embedding)
+    stats = {"embedding": model.embedding, "added": 0, "missing": 0}
+    batch = []
+    for patient_id in sorted({key.split(":")[1] for key in store.backend.keys("patient:*:scans")}):
+        _, scans = store.get(f"patient:{patient_id}:scans")
+        for entry in scans or []:
+            if index.vector(patient_id, entry["scan_id"]) is not None:
+                continue
+            try:
+                with Image.open(scan_path(scan_dir, entry["scan_id"])) as image:
+                    batch.append((patient_id, entry["scan_id"], model.embed(image.convert("RGB"))))
+            except (OSError, ValueError):
+                stats["missing"] += 1
+            if len(batch) == batch_size:
+                stats["added"] += index.add_many(batch)
+                batch = []
+    stats["added"] += index.add_many(batch)
+    return stats
+
+
+# ----------------- Re-scoring -----------------
+_worker_model = None
+
+
+def _init_worker(version, models_dir):
+    # Each worker loads the model once and keeps it for all its chunks
+    global _worker_model
+    _worker_model = classifier.load_version(version, models_dir)
+
+
+def _score_chunk(scan_dir, chunk):
+    """[(patient_id, scan_id)] -> ([(patient_id, scan_id, label)], missing)."""
+    images, found, missing = [], [], []
+    for patient_id, sid in chunk:
+        try:
+            with Image.open(scan_path(scan_dir, sid)) as image:
+                images.append(image.convert("RGB"))
+            found.append((patient_id, sid))
+        except (OSError, ValueError):
+            missing.append((patient_id, sid))
+    labels = _worker_model.predict_batch(images) if images else []
+    return [(patient_id, sid, label) for (patient_id, sid), label in zip(found, labels)], missing
+
+
+def stale_scans(store, version):
+    """(patient_id, scan_id) for every archived scan not yet scored by version."""
+    for patient_id in sorted({key.split(":")[1] for key in store.backend.keys("patient:*:scans")}):
+        _, scans = store.get(f"patient:{patient_id}:scans")
+        for entry in scans or []:
+            if entry.get("model") != version:
+                yield patient_id, entry["scan_id"]
+
+
+def write_back(store, patient_id, labels, version):
+    """Set the new predictions on the patient's scan list; sessions pick them up on their next sync."""
+    rescored = datetime.datetime.now()
+
+    def apply(scans):
+        scans = scans or []
+        for entry in scans:
+            if entry["scan_id"] in labels:
+                entry.update(prediction=labels[entry["scan_id"]], model=version, rescored=rescored)
+        return scans
+
+    store.update(f"patient:{patient_id}:scans", apply, retries=state.CONFLICT_RETRIES)
+
+
+def rescore(store, version, models_dir=classifier.MODELS_DIR, scan_dir=SCAN_DIR,
+            workers=None, batch_size=BATCH_SIZE, max_seconds=None, progress=None):
+    """Re-score every scan not yet scored by version across a process pool.
+
+    Results are written back per finished chunk, and scans already carrying the
+    target version are skipped, so an interrupted or time-boxed run resumes
+    where it stopped when started again.
+    """
+    # Fail before starting workers if the version cannot load
+    classifier.load_version(version, models_dir)
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    stats = {"version": version, "workers": workers, "scored": 0, "changed": 0, "missing": 0, "stopped_early": False}
+    previous = {}
+    todo = iter(stale_scans(store, version))
+
+    def next_chunk():
+        chunk = []
+        for patient_id, sid in todo:
+            chunk.append((patient_id, sid))
+            if len(chunk) == batch_size:
+                break
+        return chunk
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(version, models_dir)) as pool:
+        pending = set()
+        while True:
+            out_of_time = max_seconds is not None and time.perf_counter() - started > max_seconds
+            while not out_of_time and len(pending) < workers * CHUNKS_PER_WORKER:
+                chunk = next_chunk()
+                if not chunk:
+                    break
+                pending.add(pool.submit(_score_chunk, scan_dir, chunk))
+            if not pending:
+                stats["stopped_early"] = out_of_time and bool(next_chunk())
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results, missing = future.result()
+                by_patient = {}
+                for patient_id, sid, label in results:
+                    by_patient.setdefault(patient_id, {})[sid] = label
+                for patient_id, labels in by_patient.items():
+                    if patient_id not in previous:
+                        _, scans = store.get(f"patient:{patient_id}:scans")
+                        previous[patient_id] = {entry["scan_id"]: entry["prediction"] for entry in scans or []}
+                    stats["changed"] += sum(previous[patient_id].get(sid) != label for sid, label in labels.items())
+                    write_back(store, patient_id, labels, version)
+                stats["scored"] += len(results)
+                stats["missing"] += len(missing)
+            if progress:
+                elapsed = time.perf_counter() - started
+                progress(stats["scored"], stats["scored"] / elapsed if elapsed else 0.0)
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    stats["scans_per_second"] = round(stats["scored"] / stats["seconds"], 2) if stats["seconds"] else 0.0
+    return stats
+
+
+# ----------------- Command Line -----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan archive tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    job = commands.add_parser("rescore", help="Re-score archived scans with a model version")
+    job.add_argument("--version", help="Defaults to the version the registry is serving")
+    job.add_argument("--state", default="sqlite:///data/state.sqlite3", help="Shared state backend URL")
+    job.add_argument("--models-dir", default=classifier.MODELS_DIR)
+    job.add_argument("--scan-dir", default=SCAN_DIR)
+    job.add_argument("--workers", type=int, help="Processes (default: one per CPU)")
+    job.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    job.add_argument("--max-minutes", type=float, help="Stop queueing work after this long; rerun to resume")
+    args = parser.parse_args(argv)
+
+    version = args.version or classifier.read_pointer(args.models_dir)["current"]
+    store = state.SharedState(state.open_backend(args.state), cache_ttl=0)
+
+    def progress(scored, rate):
+        print(f"\r{scored} scans, {rate:.1f}/s", end="", file=sys.stderr, flush=True)
+
+    report = rescore(
+        store, version, args.models_dir, args.scan_dir,
+        workers=args.workers, batch_size=args.batch_size,
+        max_seconds=args.max_minutes * 60 if args.max_minutes else None,
+        progress=progress
+    )
+    print(file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
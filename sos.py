@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+PRIORITY_ORDER = ["High", "Medium", "Low"]
+# Alerts stay in the shared store this long, and each replica checks for an acknowledgement this often
+ALERT_TTL_SECONDS = 7 * 24 * 3600
+ACK_POLL_SECONDS = 0.5
+
+
+# ----------------- Channels -----------------
+class OutboxChannel:
+    """Local stand-in for an SMS, call or email provider.
+
+    Messages are appended to data/outbox/<channel>.jsonl; a real provider only
+    has to implement the same send(contact, alert) method.
+    """
+
+    def __init__(self, name, folder, field="phone", deadline=5.0, latency=0.0):
+        self.name = name
+        self.path = os.path.join(folder, f"{name}.jsonl")
+        self.field = field
+        self.deadline = deadline
+        self.latency = latency
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def accepts(self, contact):
+        return bool(contact.get(self.field))
+
+    def send(self, contact, alert):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "alert_id": alert["id"],
+                "to": contact[self.field],
+                "name": contact["name"],
+                "message": alert["message"],
+                "sent_at": time.time()
+            }) + "\n")
+        return "delivered"
+
+
+def default_channels(folder):
+    return [
+        OutboxChannel("sms", folder, "phone", deadline=5.0),
+        OutboxChannel("call", folder, "phone", deadline=15.0),
+        OutboxChannel("email", folder, "email", deadline=10.0)
+    ]
+
+
+def contact_priority(contact):
+    # Contacts saved before priorities existed are Medium, as the form defaults to
+    return contact.get("priority") or "Medium"
+
+
+def priority_tiers(contacts):
+    tiers = []
+    for priority in PRIORITY_ORDER:
+        tier = [c for c in contacts if contact_priority(c) == priority]
+        if tier:
+            tiers.append((priority, tier))
+    others = [c for c in contacts if contact_priority(c) not in PRIORITY_ORDER]
+    if others:
+        tiers.append(("Other", others))
+    return tiers
+
+
+# ----------------- Dispatcher -----------------
+class SOSDispatcher:
+    """Fan an SOS out to emergency contacts, one priority tier at a time.
+
+    Every contact in a tier is notified on every channel at once. Each send has
+    its channel's deadline; a slow channel is recorded as timed out and never
+    holds up the others. If nobody in the tier acknowledges within ack_timeout
+    the next tier is alerted.
+
+    Alerts live in the shared state store, so any replica can show an alert's
+    status or take its acknowledgement while the replica that raised it sends.
+    """
+
+    def __init__(self, channels, store, ack_timeout=60.0, max_workers=32):
+        self.channels = channels
+        self.store = store
+        self.ack_timeout = ack_timeout
+        # One pool per channel so a slow provider cannot starve the others
+        self.executors = {
+            channel.name: ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"sos-{channel.name}")
+            for channel in channels
+        }
+
+    def _update(self, alert_id, fn):
+        self.store.update(f"sos:{alert_id}", lambda alert: fn(alert) if alert else alert, ttl=ALERT_TTL_SECONDS)
+
+    def trigger(self, patient_id, contacts, message):
+        alert = {
+            "id": uuid.uuid4().hex[:12],
+            "patient_id": patient_id,
+            "message": message,
+            "created": time.time(),
+            "status": "sending",
+            "tier": None,
+            "receipts": [],
+            "acknowledged_by": None
+        }
+        self.store.update(f"sos:{alert['id']}", lambda _: alert, ttl=ALERT_TTL_SECONDS)
+        threading.Thread(target=self._run, args=(alert, [dict(c) for c in contacts]), daemon=True).start()
+        return alert
+
+    def acknowledge(self, alert_id, contact_name):
+        acknowledged = []
+
+        def apply(alert):
+            acknowledged.clear()
+            if alert["acknowledged_by"]:
+                return alert
+            acknowledged.append(True)
+            return {**alert, "acknowledged_by": contact_name, "status": "acknowledged"}
+
+        if self.get(alert_id) is None:
+            return False
+        self._update(alert_id, apply)
+        return bool(acknowledged)
+
+    def get(self, alert_id):
+        if not alert_id:
+            return None
+        return self.store.get(f"sos:{alert_id}")[1]
+
+    def _acknowledged(self, alert_id):
+        alert = self.get(alert_id)
+        return bool(alert and alert["acknowledged_by"])
+
+    def _set_status(self, alert_id, **fields):
+        # Never overwrite an acknowledgement taken meanwhile, possibly on another replica
+        self._update(alert_id, lambda alert: alert if alert["acknowledged_by"] else {**alert, **fields})
+
+    def _receipt(self, alert, tier, contact, channel, status, started, detail=""):
+        receipt = {
+            "tier": tier,
+            "contact": contact["name"],
+            "channel": channel.name,
+            "status": status,
+            "latency_ms": round((time.time() - started) * 1000),
+            "at": time.time(),
+            "detail": detail
+        }
+        self._update(alert["id"], lambda current: {**current, "receipts": current["receipts"] + [receipt]})
+
+    def _send_tier(self, alert, tier, contacts):
+        started = time.time()
+        pending = {}
+        for contact in contacts:
+            for channel in self.channels:
+                if channel.accepts(contact):
+                    future = self.executors[channel.name].submit(channel.send, contact, alert)
+                    pending[future] = (contact, channel, started + channel.deadline)
+
+        while pending:
+            now = time.time()
+            next_deadline = min(deadline for _, _, deadline in pending.values())
+            done, _ = wait(pending, timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                contact, channel, _ = pending.pop(future)
+                try:
+                    self._receipt(alert, tier, contact, channel, future.result(), started)
+                except Exception as e:
+                    self._receipt(alert, tier, contact, channel, "failed", started, str(e))
+            now = time.time()
+            for future, (contact, channel, deadline) in list(pending.items()):
+                if deadline <= now:
+                    del pending[future]
+                    self._receipt(alert, tier, contact, channel, "timeout", started)
+
+    def _wait_for_ack(self, alert_id):
+        deadline = time.time() + self.ack_timeout
+        while not self._acknowledged(alert_id):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(ACK_POLL_SECONDS, remaining))
+        return True
+
+    def _run(self, alert, contacts):
+        for tier, members in priority_tiers(contacts):
+            if self._acknowledged(alert["id"]):
+                return
+            self._set_status(alert["id"], tier=tier)
+            self._send_tier(alert, tier, members)
+            self._set_status(alert["id"], status=f"waiting for {tier} priority contacts")
+            if self._wait_for_ack(alert["id"]):
+                return
+        self._set_status(alert["id"], status="unacknowledged" if contacts else "no contacts")
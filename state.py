@@ -0,0 +1,629 @@
+import argparse
+import collections
+import datetime
+import fnmatch
+import json
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import chatlog
+import db
+
+# Lists shared by every session of a patient, on any replica
+PATIENT_FIELDS = ["notifications", "medications", "emergency_contacts", "progress", "chat_history", "scans"]
+
+# Per-browser-session values, restored when a replica restarts
+SESSION_FIELDS = ["patient_id", "last_prediction", "last_exercise_summary", "last_sos_alert"]
+
+CACHE_TTL_SECONDS = 1.0
+CACHE_SIZE = 1024
+SESSION_TTL_SECONDS = 7 * 24 * 3600
+CONFLICT_RETRIES = 10
+
+
+class VersionConflict(Exception):
+    """Another writer updated the key since it was read."""
+
+    def __init__(self, key, expected, actual):
+        super().__init__(f"{key}: expected version {expected}, found {actual}")
+        self.key = key
+        self.expected = expected
+        self.actual = actual
+
+
+# ----------------- Encoding -----------------
+# Session values hold dates and times, which JSON has no type for
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {"__time__": value.isoformat()}
+    if isinstance(value, chatlog.ChatHistory):
+        return {"__chat__": value.dump()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def _object_hook(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return datetime.date.fromisoformat(obj["__date__"])
+        if "__time__" in obj:
+            return datetime.time.fromisoformat(obj["__time__"])
+        if "__chat__" in obj:
+            return chatlog.ChatHistory.load(obj["__chat__"])
+    return obj
+
+
+def encode(value):
+    return json.dumps(value, default=_default, sort_keys=True, ensure_ascii=False)
+
+
+def decode(text):
+    return json.loads(text, object_hook=_object_hook)
+
+
+# ----------------- SQLite Backend -----------------
+class SQLiteBackend:
+    """Versioned key-value rows in one SQLite file, shared by every process on the node."""
+
+    def __init__(self, path):
+        self.path = path
+        db.prepare(path)
+        with db.connect(path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY, version INTEGER, value TEXT, expires REAL
+                )
+            """)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                f"SELECT key, version, value FROM kv WHERE key IN ({','.join('?' * len(keys))}) "
+                "AND (expires IS NULL OR expires > ?)",
+                [*keys, time.time()]
+            ).fetchall()
+        return {key: (version, value) for key, version, value in rows}
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with db.connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT version FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+            ).fetchone()
+            actual = row[0] if row else 0
+            if actual != expected:
+                conn.execute("ROLLBACK")
+                raise VersionConflict(key, expected, actual)
+            conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?)", (key, expected + 1, value, expires))
+            conn.execute("COMMIT")
+        return expected + 1
+
+    def keys(self, pattern):
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT key FROM kv WHERE key GLOB ? AND (expires IS NULL OR expires > ?)", (pattern, time.time())
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+# ----------------- Redis Backend -----------------
+class RespError(Exception):
+    pass
+
+
+class RespConnection:
+    """Just enough of the Redis wire protocol (RESP2) for the commands used here."""
+
+    def __init__(self, host, port, db=0, timeout=5.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.sock.makefile("rb")
+        if db:
+            self.command("SELECT", db)
+
+    def command(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b"".join(parts))
+        return self._reply()
+
+    def _reply(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self.file.read(size + 2)[:-2]
+            return data.decode()
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self._reply() for _ in range(count)]
+        raise RespError(f"Unexpected reply {line!r}")
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class RedisBackend:
+    """Versioned values in Redis (or the local stand-in) using WATCH/MULTI/EXEC.
+
+    Each value is stored as {"version": n, "value": ...}; a write only commits if
+    nobody touched the key between WATCH and EXEC.
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0):
+        self.host = host
+        self.port = port
+        self.db = db
+        # WATCH is per connection, so each thread gets its own
+        self.local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = RespConnection(self.host, self.port, self.db)
+        return conn
+
+    def _call(self, *args):
+        try:
+            return self._conn().command(*args)
+        except (ConnectionError, OSError):
+            # One reconnect covers a restarted server; a second failure is real
+            self.local.conn = None
+            return self._conn().command(*args)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        found = {}
+        for key, raw in zip(keys, self._call("MGET", *keys)):
+            if raw is not None:
+                stored = json.loads(raw)
+                found[key] = (stored["version"], stored["value"])
+        return found
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        conn = self._conn()
+        try:
+            conn.command("WATCH", key)
+        except (ConnectionError, OSError):
+            self.local.conn = None
+            raise
+        try:
+            raw = conn.command("GET", key)
+            actual = json.loads(raw)["version"] if raw is not None else 0
+            if actual != expected:
+                raise VersionConflict(key, expected, actual)
+            conn.command("MULTI")
+            payload = json.dumps({"version": expected + 1, "value": value})
+            if ttl:
+                conn.command("SET", key, payload, "EX", int(ttl))
+            else:
+                conn.command("SET", key, payload)
+            if conn.command("EXEC") is None:
+                raise VersionConflict(key, expected, None)
+        finally:
+            conn.command("UNWATCH")
+        return expected + 1
+
+    def keys(self, pattern):
+        return self._call("KEYS", pattern)
+
+
+# ----------------- Local Redis Stand-in -----------------
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    """In-memory server speaking the Redis protocol, for development and tests.
+
+    Supports PING, SELECT, GET, SET (with EX), MGET, DEL, KEYS, EXPIRE, TTL and
+    WATCH/MULTI/EXEC/DISCARD/UNWATCH. Data lives only as long as the process.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _RespHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+        self.expires = {}
+        # Bumped on every write so WATCH can spot changes
+        self.revisions = collections.defaultdict(int)
+
+    def live(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+            self.revisions[key] += 1
+        return key in self.data
+
+    def write(self, key, value=None, ttl=None):
+        if value is None:
+            existed = self.live(key)
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        else:
+            existed = True
+            self.data[key] = value
+            if ttl:
+                self.expires[key] = time.time() + ttl
+            else:
+                self.expires.pop(key, None)
+        self.revisions[key] += 1
+        return existed
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.watched = {}
+        self.queued = None
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            name = args[0].upper()
+            try:
+                reply = self.dispatch(name, args[1:])
+            except Exception as e:
+                reply = RespError(f"ERR {e}")
+            self.wfile.write(self.encode(reply))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            size = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(size + 2)[:-2].decode())
+        return args
+
+    def encode(self, reply):
+        if isinstance(reply, RespError):
+            return f"-{reply}\r\n".encode()
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, bool):
+            return b":%d\r\n" % int(reply)
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self.encode(item) for item in reply)
+        if isinstance(reply, _Status):
+            return f"+{reply.text}\r\n".encode()
+        data = reply.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def dispatch(self, name, args):
+        server = self.server
+        if name == "MULTI":
+            self.queued = []
+            return _OK
+        if name == "DISCARD":
+            self.queued = None
+            self.watched = {}
+            return _OK
+        if self.queued is not None and name != "EXEC":
+            self.queued.append((name, args))
+            return _Status("QUEUED")
+        with server.lock:
+            if name == "WATCH":
+                for key in args:
+                    server.live(key)
+                    self.watched[key] = server.revisions[key]
+                return _OK
+            if name == "UNWATCH":
+                self.watched = {}
+                return _OK
+            if name == "EXEC":
+                queued, self.queued = self.queued, None
+                watched, self.watched = self.watched, {}
+                if queued is None:
+                    raise ValueError("EXEC without MULTI")
+                for key, revision in watched.items():
+                    server.live(key)
+                    if server.revisions[key] != revision:
+                        return None
+                return [self.run(queued_name, queued_args) for queued_name, queued_args in queued]
+            return self.run(name, args)
+
+    def run(self, name, args):
+        server = self.server
+        if name == "PING":
+            return _Status("PONG")
+        if name == "SELECT":
+            return _OK
+        if name == "GET":
+            return server.data[args[0]] if server.live(args[0]) else None
+        if name == "MGET":
+            return [server.data[key] if server.live(key) else None for key in args]
+        if name == "SET":
+            ttl = int(args[3]) if len(args) >= 4 and args[2].upper() == "EX" else None
+            server.write(args[0], args[1], ttl)
+            return _OK
+        if name == "DEL":
+            return sum(server.write(key) for key in args)
+        if name == "KEYS":
+            return [key for key in list(server.data) if server.live(key) and fnmatch.fnmatchcase(key, args[0])]
+        if name == "EXPIRE":
+            if not server.live(args[0]):
+                return 0
+            server.expires[args[0]] = time.time() + int(args[1])
+            return 1
+        if name == "TTL":
+            if not server.live(args[0]):
+                return -2
+            expires = server.expires.get(args[0])
+            return -1 if expires is None else int(expires - time.time())
+        raise ValueError(f"unknown command '{name}'")
+
+
+class _Status:
+    def __init__(self, text):
+        self.text = text
+
+
+_OK = _Status("OK")
+
+
+# ----------------- Shared State -----------------
+def open_backend(url):
+    """sqlite:///data/state.sqlite3 or redis://host:port/db"""
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if parsed.scheme == "redis":
+        return RedisBackend(parsed.hostname or "localhost", parsed.port or 6379, int(parsed.path.strip("/") or 0))
+    raise ValueError(f"Unsupported state backend: {url}")
+
+
+class SharedState:
+    """Versioned reads and writes with a short-lived local read cache.
+
+    Reads within CACHE_TTL_SECONDS of the last one are served from memory; writes
+    go straight to the backend and raise VersionConflict if the key moved on.
+    """
+
+    def __init__(self, backend, cache_ttl=CACHE_TTL_SECONDS, cache_size=CACHE_SIZE):
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _cache_put(self, key, entry):
+        with self.lock:
+            self.cache[key] = (time.monotonic() + self.cache_ttl, entry)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def get_many(self, keys):
+        """{key: (version, raw)}; missing keys come back as (0, None)."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self.lock:
+            for key in keys:
+                cached = self.cache.get(key)
+                if cached and cached[0] > now:
+                    found[key] = cached[1]
+                else:
+                    missing.append(key)
+        if missing:
+            fetched = self.backend.get_many(missing)
+            for key in missing:
+                entry = fetched.get(key, (0, None))
+                found[key] = entry
+                self._cache_put(key, entry)
+        return found
+
+    def get(self, key):
+        version, raw = self.get_many([key])[key]
+        return version, None if raw is None else decode(raw)
+
+    def set(self, key, value, version, ttl=None):
+        raw = encode(value)
+        try:
+            new_version = self.backend.compare_and_set(key, version, raw, ttl)
+        except VersionConflict:
+            with self.lock:
+                self.cache.pop(key, None)
+            raise
+        self._cache_put(key, (new_version, raw))
+        return new_version
+
+    def update(self, key, fn, retries=5, ttl=None):
+        """Read-modify-write, retried on conflict."""
+        for _ in range(retries):
+            version, value = self.get(key)
+            try:
+                return self.set(key, fn(value), version, ttl)
+            except VersionConflict:
+                continue
+        raise VersionConflict(key, version, None)
+
+    def patients(self):
+        """(patient_id, record) for every patient with shared state, for cohort exports."""
+        ids = sorted({key.split(":")[1] for key in self.backend.keys("patient:*")})
+        for patient_id in ids:
+            keys = [f"patient:{patient_id}:{field}" for field in PATIENT_FIELDS]
+            entries = self.get_many(keys)
+            yield patient_id, {
+                field: decode(entries[key][1]) if entries[key][1] is not None else empty(field)
+                for field, key in zip(PATIENT_FIELDS, keys)
+            }
+
+
+# ----------------- Streamlit Session Sync -----------------
+def empty(field):
+    """The value a patient field starts with."""
+    return chatlog.ChatHistory() if field == "chat_history" else []
+
+
+def entries(items):
+    """(identity, item) pairs: an item's id when it has one, else its content and which copy it is.
+
+    Counting copies keeps two identical entries (the same reminder added
+    twice) distinct, so a merge never folds them into one.
+    """
+    seen = {}
+    keyed = []
+    for item in items:
+        if isinstance(item, dict) and item.get("id"):
+            key = ("id", item["id"])
+        else:
+            content = encode(item)
+            key = (content, seen.get(content, 0))
+            seen[content] = key[1] + 1
+        keyed.append((key, item))
+    return keyed
+
+
+def merge_lists(base, local, remote):
+    """Three-way merge of list fields: keep the other writer's changes plus ours."""
+    if isinstance(local, chatlog.ChatHistory):
+        return chatlog.merge(base, local, remote)
+    base_items = dict(entries(base))
+    local_items = dict(entries(local))
+    removed = base_items.keys() - local_items.keys()
+    # Entries with an id that this session edited in place
+    edited = {key for key, item in local_items.items()
+              if key[0] == "id" and key in base_items and encode(item) != encode(base_items[key])}
+    merged = []
+    present = set()
+    for key, item in entries(remote):
+        if key in removed:
+            continue
+        merged.append(local_items[key] if key in edited else item)
+        present.add(key)
+    for key, item in local_items.items():
+        if key not in base_items and not (key[0] == "id" and key in present):
+            merged.append(item)
+    return merged
+
+
+class SessionSync:
+    """Mirror a browser session's state into the shared store.
+
+    sync() runs at the top of every script run: it first flushes anything this
+    session changed since the last sync (a run can end early at a rerun), then
+    pulls newer versions written by other sessions or replicas.
+    """
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+        # key -> (version, raw) as last seen by this session
+        self.synced = {}
+
+    def _keys(self, patient_id):
+        keys = {f"session:{self.session_id}": None}
+        keys.update({f"patient:{patient_id}:{field}": field for field in PATIENT_FIELDS})
+        return keys
+
+    def _value(self, state, field):
+        if field is None:
+            return {name: state.get(name) for name in SESSION_FIELDS}
+        return state.get(field, empty(field))
+
+    def _pull(self, state, keys):
+        entries = self.store.get_many(list(keys))
+        for key, field in keys.items():
+            version, raw = entries[key]
+            if raw is None or version <= self.synced.get(key, (0, None))[0]:
+                continue
+            value = decode(raw)
+            if field is None:
+                state.update({name: item for name, item in value.items() if item is not None})
+            elif field == "chat_history":
+                # Histories saved before the compact form are plain lists
+                state[field] = chatlog.ChatHistory.of(value)
+            else:
+                state[field] = value
+            self.synced[key] = (version, raw)
+
+    def flush(self, state):
+        for key, field in self._keys(state["patient_id"]).items():
+            value = self._value(state, field)
+            raw = encode(value)
+            # Nothing stored yet means the defaults; no need to write those
+            default = encode(dict.fromkeys(SESSION_FIELDS) if field is None else empty(field))
+            version, synced_raw = self.synced.get(key, (0, default))
+            if raw == synced_raw:
+                continue
+            ttl = SESSION_TTL_SECONDS if field is None else None
+            local = value
+            for _ in range(CONFLICT_RETRIES):
+                try:
+                    version = self.store.set(key, value, version, ttl)
+                    break
+                except VersionConflict:
+                    # Re-apply this session's changes on top of the newest version
+                    version, remote = self.store.get(key)
+                    if field is not None:
+                        value = merge_lists(decode(synced_raw), local, remote or [])
+            else:
+                raise VersionConflict(key, version, None)
+            if field is not None:
+                state[field] = value
+            self.synced[key] = (version, encode(value))
+
+    def sync(self, state):
+        if not self.synced:
+            # First run of this session on this replica: restore the saved session,
+            # then the patient it points at, before writing anything back
+            self._pull(state, {f"session:{self.session_id}": None})
+            self._pull(state, self._keys(state["patient_id"]))
+        self.flush(state)
+        self._pull(state, self._keys(state["patient_id"]))
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+# ----------------- Command Line -----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared state tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    server = commands.add_parser("serve", help="Run the local Redis-protocol stand-in")
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        print(f"Serving on redis://{args.host}:{args.port}/0")
+        with LocalRedisServer((args.host, args.port)) as server:
+            server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import argparse
+import datetime
+import html
+import re
+import threading
+import time
+
+# ----------------- Compilation -----------------
+# {field}, {field|filter}, and {?field}...{/field} around a part shown only when field is truthy
+TOKEN_RE = re.compile(r"\{(\?|/)?([a-z_][a-z0-9_]*)(?:\|([a-z_]+))?\}")
+
+FILTERS = {
+    "time": lambda value: value.strftime("%I:%M %p"),
+    "date": lambda value: value.strftime("%b %d, %Y")
+}
+
+FRAGMENT_CACHE_SIZE = 20000
+
+
+def escape(value):
+    return html.escape(value if isinstance(value, str) else str(value), quote=True)
+
+
+class Template:
+    """An HTML fragment compiled once into a Python function.
+
+    Every field is HTML-escaped, so user text can never inject markup. The
+    fields a template reads are known after compiling, which is what keys the
+    fragment cache.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.fields = []
+        # Parse into nested parts: literal strings, (field, filter) and (section field, parts)
+        stack = [("", [])]
+        position = 0
+        for match in TOKEN_RE.finditer(source):
+            if match.start() > position:
+                stack[-1][1].append(source[position:match.start()])
+            position = match.end()
+            section, name, filter_name = match.groups()
+            if name not in self.fields:
+                self.fields.append(name)
+            if section == "?":
+                stack.append((name, []))
+            elif section == "/":
+                if len(stack) == 1 or stack[-1][0] != name:
+                    raise ValueError(f"Unbalanced section {{/{name}}}")
+                opened, parts = stack.pop()
+                stack[-1][1].append((opened, parts, None))
+            else:
+                if filter_name and filter_name not in FILTERS:
+                    raise ValueError(f"Unknown filter '{filter_name}'")
+                stack[-1][1].append((name, None, filter_name))
+        if len(stack) > 1:
+            raise ValueError(f"Unclosed section {{?{stack[-1][0]}}}")
+        if source[position:]:
+            stack[0][1].append(source[position:])
+
+        # One expression per template: a join over literals, escaped fields and conditional sections
+        code = (
+            f"def render(ctx):\n    return {self._expression(stack[0][1])}\n"
+            f"def key(ctx):\n    return ({''.join(f'ctx.get({name!r}), ' for name in self.fields)})\n"
+        )
+        namespace = {"escape": escape, "FILTERS": FILTERS}
+        exec(compile(code, f"<template {self.fields}>", "exec"), namespace)
+        self.render = namespace["render"]
+        self.key = namespace["key"]
+
+    def _expression(self, parts):
+        terms = []
+        for part in parts:
+            if isinstance(part, str):
+                terms.append(repr(part))
+            elif part[1] is not None:
+                terms.append(f"({self._expression(part[1])} if ctx.get({part[0]!r}) else '')")
+            elif part[2]:
+                terms.append(f"escape(FILTERS[{part[2]!r}](ctx[{part[0]!r}]))")
+            else:
+                terms.append(f"escape(ctx[{part[0]!r}])")
+        return f"''.join(({', '.join(terms)},))"
+
+
+# ----------------- Fragment Cache -----------------
+class FragmentCache:
+    """Rendered fragments keyed by template and the values they were rendered from.
+
+    Shared by every session in the process, since the key is the content
+    itself; an unchanged row is rendered once however often pages rerun.
+    Hits take no lock; the oldest entries are evicted first.
+    """
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def render(self, template, ctx):
+        try:
+            key = (template, template.key(ctx))
+            fragment = self.entries.get(key)
+        except TypeError:
+            # Unhashable values (lists, dicts) are simply rendered every time
+            return template.render(ctx)
+        if fragment is None:
+            fragment = template.render(ctx)
+            with self.lock:
+                self.entries[key] = fragment
+                while len(self.entries) > self.max_entries:
+                    del self.entries[next(iter(self.entries))]
+        return fragment
+
+
+fragments = FragmentCache()
+
+
+def render(template, item, **extra):
+    """Render one list item (plus any derived values), reusing the cached fragment when unchanged."""
+    return fragments.render(template, {**item, **extra} if extra else item)
+
+
+# ----------------- Page Templates -----------------
+PAGE_HEADER = Template("""
+        <div style="display: flex; align-items: center; gap: 1rem; margin-bottom: 1.5rem;">
+            <h2>{title}</h2>
+            <div class="status-indicator status-completed">
+                <span>{status}</span>
+            </div>
+        </div>
+""")
+
+REMINDER_ROW = Template("""
+                        <div style="padding: 0.5rem 0;">
+                            <p style="margin: 0; font-weight: 500;">⏰ {time|time}</p>
+                            <p style="margin: 0; font-size: 0.9rem; color: var(--secondary);">{message}</p>
+                            <p style="margin: 0; font-size: 0.8rem; color: var(--dark); opacity: 0.7;">{frequency}</p>
+                        </div>
+""")
+
+MEDICATION_ROW = Template("""
+                        <div style="padding: 0.5rem 0; border-bottom: 1px solid #eee;">
+                            <p style="margin: 0; font-weight: 500;">{name} <span style="font-size: 0.9rem; color: var(--secondary);">{dosage}mg</span></p>
+                            <p style="margin: 0; font-size: 0.9rem;">⏰ {time|time} • {frequency}</p>
+                            {?notes}<p style='margin: 0; font-size: 0.8rem; color: var(--secondary);'>📝 {notes}</p>{/notes}
+                        </div>
+""")
+
+PRIORITY_COLORS = {
+    "High": "var(--danger)",
+    "Medium": "var(--warning)",
+    "Low": "var(--success)"
+}
+
+CONTACT_ROW = Template("""
+                        <div style="padding: 0.5rem 0; border-bottom: 1px solid #eee;">
+                            <p style="margin: 0; font-weight: 500;">{name}</p>
+                            <p style="margin: 0; font-size: 0.9rem;">📞 {phone}</p>
+                            <p style="margin: 0; font-size: 0.8rem; color: var(--secondary);">
+                                {relation} •
+                                <span style="color: {priority_color};">{priority} priority</span>
+                            </p>
+                        </div>
+""")
+
+TIP_CARD = Template("""
+                    <div class="card" style="margin-bottom: 1rem;">
+                        <div style="display: flex; align-items: center; gap: 1rem; margin-bottom: 0.5rem;">
+                            <div style="font-size: 1.5rem;">{icon}</div>
+                            <h4 style="margin: 0;">{title}</h4>
+                        </div>
+                        <p style="margin: 0.5rem 0; font-size: 0.9rem;">{content}</p>
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <span style="font-size: 0.8rem; color: var(--secondary);">{category}</span>
+                            <button style="background: none; border: none; color: var(--primary); cursor: pointer; font-size: 0.8rem;">
+                                More Info
+                            </button>
+                        </div>
+                    </div>
+""")
+
+PROGRESS_ENTRY = Template("""
+                    <div style="padding: 0.8rem; margin: 0.5rem 0; background-color: #f8f9fa; border-radius: 8px;">
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <strong>{date|date}</strong>
+                            <span style="font-size: 1.2rem;">{mood}</span>
+                        </div>
+                        <div style="display: flex; align-items: center; gap: 1rem; margin: 0.5rem 0;">
+                            <div style="font-size: 0.9rem;">Score: <strong>{score}/100</strong></div>
+                        </div>
+                        {?notes}<div style='font-size: 0.9rem; color: var(--secondary);'>{notes}</div>{/notes}
+                    </div>
+""")
+
+
+def contact_row(contact):
+    return render(CONTACT_ROW, contact, priority_color=PRIORITY_COLORS.get(contact["priority"], "var(--secondary)"))
+
+
+# ----------------- Benchmark -----------------
+def _fstring_medication(med):
+    # The per-item f-string the Medications page used before templates
+    return f"""
+                        <div style="padding: 0.5rem 0; border-bottom: 1px solid #eee;">
+                            <p style="margin: 0; font-weight: 500;">{med['name']} <span style="font-size: 0.9rem; color: var(--secondary);">{med['dosage']}mg</span></p>
+                            <p style="margin: 0; font-size: 0.9rem;">⏰ {med['time'].strftime('%I:%M %p')} • {med['frequency']}</p>
+                            {f"<p style='margin: 0; font-size: 0.8rem; color: var(--secondary);'>📝 {med['notes']}</p>" if med['notes'] else ""}
+                        </div>
+                    """
+
+
+def _sample_medications(count):
+    return [
+        {
+            "id": f"med-{i}", "name": f"Medication {i} <b>", "dosage": 5 + i % 20,
+            "time": datetime.time(i % 24, i % 60), "frequency": "Twice daily",
+            "notes": "Take with food & water" if i % 3 else "", "last_taken": None
+        }
+        for i in range(count)
+    ]
+
+
+def _time_per_pass(fn, items, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def benchmark(counts=(1000, 10000), repeat=20):
+    """Milliseconds to render a whole medication list: f-strings, compiled template, warm fragment cache."""
+    results = []
+    for count in counts:
+        meds = _sample_medications(count)
+        cache = FragmentCache(max_entries=max(count, FRAGMENT_CACHE_SIZE))
+        cold_started = time.perf_counter()
+        for med in meds:
+            cache.render(MEDICATION_ROW, med)
+        cold_ms = (time.perf_counter() - cold_started) * 1000
+        results.append({
+            "items": count,
+            "fstring_ms": round(_time_per_pass(_fstring_medication, meds, repeat), 2),
+            "template_ms": round(_time_per_pass(MEDICATION_ROW.render, meds, repeat), 2),
+            "cache_cold_ms": round(cold_ms, 2),
+            "cache_warm_ms": round(_time_per_pass(lambda med: cache.render(MEDICATION_ROW, med), meds, repeat), 2)
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark list rendering")
+    parser.add_argument("--items", type=int, action="append", help="List sizes (default: 1000 and 10000)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+    for row in benchmark(args.items or (1000, 10000), args.repeat):
+        print(
+            f"{row['items']:>7} items  f-string {row['fstring_ms']:8.2f} ms  template {row['template_ms']:8.2f} ms  "
+            f"cache cold {row['cache_cold_ms']:8.2f} ms  warm {row['cache_warm_ms']:8.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
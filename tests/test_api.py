@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from starlette.exceptions import HTTPException
+
+import api
+
+
+def medication(**fields):
+    return {"name": "Donepezil", "dosage": 10, "time": "08:00", "frequency": "Once daily", **fields}
+
+
+def test_parse_items_rejects_only_bad_items():
+    items = [medication(), medication(dosage="ten"), medication(name="Memantine", dosage="5"), medication(dosage=10 ** 12)]
+    accepted, rejected = api.parse_items("medications", "P1", items)
+    assert [item["name"] for item in accepted] == ["Donepezil", "Memantine"]
+    assert accepted[1]["dosage"] == 5
+    assert [entry["index"] for entry in rejected] == [1, 3]
+
+
+def test_parse_items_keeps_validation_failures_per_item():
+    items = [{"date": "2024-01-01", "score": 50, "mood": "🙂"}, {"date": "2024-01-02", "score": 500, "mood": "🙂"},
+             {"date": "2024-01-03", "score": True, "mood": "🙂"}]
+    accepted, rejected = api.parse_items("progress", "P1", items)
+    assert [item["score"] for item in accepted] == [50]
+    assert [entry["index"] for entry in rejected] == [1, 2]
+
+
+def request(tokens=None, authorization=None, **query):
+    return SimpleNamespace(
+        app=SimpleNamespace(state=SimpleNamespace(tokens=tokens or {})),
+        headers={"authorization": authorization} if authorization else {},
+        query_params=query
+    )
+
+
+@api.integration
+async def patient_route(request):
+    return "ok"
+
+
+@api.admin_only
+async def admin_route(request):
+    return "ok"
+
+
+def status(handler, request):
+    try:
+        return asyncio.run(handler(request))
+    except HTTPException as error:
+        return error.status_code
+
+
+def test_routes_need_a_configured_token():
+    assert status(patient_route, request(authorization="Bearer anything")) == 404
+    assert status(admin_route, request({"api": "secret"}, "Bearer secret")) == 404
+
+
+def test_routes_reject_missing_and_wrong_tokens():
+    tokens = {"api": "secret", "admin": "root"}
+    assert status(patient_route, request(tokens)) == 401
+    assert status(patient_route, request(tokens, "Bearer wrong")) == 401
+    assert status(admin_route, request(tokens, "Bearer secret")) == 401
+
+
+def test_routes_accept_any_of_their_roles():
+    tokens = {"api": "secret", "admin": "root"}
+    assert status(patient_route, request(tokens, "Bearer secret")) == "ok"
+    assert status(patient_route, request(tokens, "Bearer root")) == "ok"
+    assert status(admin_route, request(tokens, "Bearer root")) == "ok"
+
+
+@pytest.mark.parametrize("raw", ["ten", "", "1e", "nan", "inf"])
+def test_query_number_rejects_non_numbers(raw):
+    with pytest.raises(HTTPException) as error:
+        api.query_number(request(k=raw), "k", 5, api.MAX_SIMILAR, cast=float)
+    assert error.value.status_code == 400
+
+
+def test_query_number_clamps_and_defaults():
+    assert api.query_number(request(), "k", 5, api.MAX_SIMILAR) == 5
+    assert api.query_number(request(k="0"), "k", 5, api.MAX_SIMILAR) == 1
+    assert api.query_number(request(k="100000"), "k", 5, api.MAX_SIMILAR) == api.MAX_SIMILAR
+    assert api.query_number(request(hours="0.5"), "hours", 24.0, 366 * 24, cast=float, minimum=0.01) == 0.5
+    with pytest.raises(HTTPException):
+        api.query_number(request(k="2.5"), "k", 5, api.MAX_SIMILAR)
@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+
+import intents
+
+
+def test_reminder_reads_time_and_frequency():
+    command = intents.route("remind me to take a walk at 6:30pm every weekday")
+    assert command["intent"] == "add_reminder"
+    assert command["slots"] == {"time": datetime.time(18, 30), "message": "Take a walk", "frequency": "Weekdays"}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("remind me to call Anna at 12am", datetime.time(0, 0)),
+    ("remind me to call Anna at 12pm", datetime.time(12, 0)),
+    ("remind me to call Anna at 7", datetime.time(7, 0)),
+    ("remind me to call Anna at bedtime", datetime.time(21, 0)),
+    ("remind me to call Anna", datetime.time(8, 0))
+])
+def test_reminder_times(text, expected):
+    assert intents.route(text)["slots"]["time"] == expected
+
+
+def test_medication_slots():
+    command = intents.route("add Donepezil 10mg twice daily at 8am with food")
+    assert command["intent"] == "add_medication"
+    assert command["slots"] == {"name": "Donepezil", "dosage": 10, "time": datetime.time(8, 0),
+                                "frequency": "Twice daily", "notes": "Take with food"}
+
+
+def test_contact_slots():
+    command = intents.route("add my daughter Anna as emergency contact +1 555 123 4567")
+    assert command["intent"] == "add_contact"
+    assert command["slots"]["phone"] == "+1 555 123 4567"
+    assert command["slots"]["relation"] == "Family Member"
+
+
+@pytest.mark.parametrize("text, date, score", [
+    ("log my score as 70 on 2024-03-05", datetime.date(2024, 3, 5), 70),
+    ("my score is 70 on March 5, 2024", datetime.date(2024, 3, 5), 70),
+    ("log my score as 2 out of 3", None, 67),
+    ("log my score as 45/50 on 2024-3-5", datetime.date(2024, 3, 5), 90)
+])
+def test_progress_dates_and_fractions(text, date, score):
+    slots = intents.route(text)["slots"]
+    assert slots["score"] == score
+    assert slots["date"] == (date or datetime.date.today())
+
+
+def test_yesterday():
+    slots = intents.route("log my score as 60 yesterday")["slots"]
+    assert slots["date"] == datetime.date.today() - datetime.timedelta(days=1)
+
+
+@pytest.mark.parametrize("text", [
+    "what is dementia?",
+    "log my progress",
+    "log my score as 5 out of 3",
+    "add a medication",
+    "",
+    "remind me " * 40
+])
+def test_open_questions_and_incomplete_commands_are_not_routed(text):
+    assert intents.route(text) is None
+
+
+def test_dose_taken_marks_the_named_medication():
+    state = {"medications": [{"id": "m1", "name": "Donepezil", "dosage": 10, "time": datetime.time(8, 0),
+                              "frequency": "Once daily", "last_taken": None}]}
+    reply = intents.apply(intents.route("I took my donepezil"), state)
+    assert "Donepezil" in reply
+    assert state["medications"][0]["last_taken"] is not None
@@ -0,0 +1,47 @@
+import pytest
+
+import ratelimit
+
+
+def bucket(tmp_path, **limits):
+    return ratelimit.TokenBucket(str(tmp_path / "ratelimit.sqlite3"), **limits)
+
+
+def test_acquire_times_out_once_the_requests_are_spent(tmp_path):
+    limiter = bucket(tmp_path, rpm=2, tpm=1000)
+    limiter.acquire("P1", 10)
+    limiter.acquire("P2", 10)
+    with pytest.raises(ratelimit.RateLimitTimeout) as error:
+        limiter.acquire("P1", 10, timeout=0.1)
+    assert 0 < error.value.wait <= 30
+
+
+def test_processes_share_one_bucket(tmp_path):
+    bucket(tmp_path, rpm=1, tpm=1000).acquire("P1", 10)
+    assert bucket(tmp_path, rpm=1, tpm=1000).estimate_wait(10) > 0
+
+
+def test_settle_charges_the_real_token_count(tmp_path):
+    limiter = bucket(tmp_path, rpm=60, tpm=1000)
+    limiter.acquire("P1", 100)
+    assert limiter.estimate_wait(800) == pytest.approx(0, abs=0.1)
+    limiter.settle(100, 900)
+    # Only about 100 tokens are left, so 800 more need most of a minute
+    assert limiter.estimate_wait(800) > 30
+
+
+def test_penalize_blocks_every_caller(tmp_path):
+    limiter = bucket(tmp_path, rpm=60, tpm=1000)
+    limiter.penalize(retry_after=20)
+    assert limiter.estimate_wait(1) > 15
+    with pytest.raises(ratelimit.RateLimitTimeout):
+        limiter.acquire("P1", 1, timeout=0.1)
+
+
+def test_abandoned_tickets_leave_the_queue(tmp_path):
+    limiter = bucket(tmp_path, rpm=1, tpm=1000)
+    limiter.acquire("P1", 10)
+    with pytest.raises(ratelimit.RateLimitTimeout):
+        limiter.acquire("P2", 10, timeout=0.1)
+    # P2's ticket is gone, so a new caller only waits for the refill
+    assert limiter.estimate_wait(10) <= 60
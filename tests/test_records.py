@@ -0,0 +1,86 @@
+import datetime
+import json
+
+import pyarrow.parquet as pq
+
+import activity
+import records
+import state
+
+
+def patient_record():
+    return {
+        "progress": [{"date": datetime.date(2024, 3, 5), "score": 70, "mood": "🙂", "notes": ""}],
+        "medications": [{"id": "m1", "name": "Donepezil", "dosage": 10, "time": datetime.time(8, 0),
+                         "frequency": "Once daily", "notes": "", "last_taken": None}],
+        "emergency_contacts": [{"name": "Anna", "phone": "+1 555 123 4567", "relation": "Family Member",
+                                "priority": "High"}],
+        "notifications": [{"time": datetime.time(18, 30), "message": "Walk", "frequency": "Weekdays", "active": True}],
+        "chat_history": [{"role": "user", "content": "hi"}, {"role": "bot", "content": "Hello!"}]
+    }
+
+
+def test_parquet_round_trip(tmp_path):
+    record = patient_record()
+    report = records.export_records([("P1", record), ("P2", {"progress": record["progress"]})], tmp_path)
+    assert report == {"patients": 2, "rows": {"progress": 2, "medications": 1, "emergency_contacts": 1,
+                                              "notifications": 1, "chat_history": 2}}
+
+    loaded, imported = records.load_patient(tmp_path, "P1")
+    assert loaded == record
+    assert all(stats["rejected"] == 0 for stats in imported.values())
+
+
+def test_invalid_rows_are_rejected_and_kept_aside(tmp_path):
+    progress = [{"date": datetime.date(2024, 3, 5), "score": 70, "mood": "🙂", "notes": ""},
+                {"date": datetime.date(2024, 3, 6), "score": 700, "mood": "🙂", "notes": ""},
+                {"date": datetime.date(2024, 3, 7), "score": 60, "mood": "?", "notes": ""}]
+    records.export_records([("P1", {"progress": progress})], tmp_path / "export")
+
+    loaded, report = records.load_patient(tmp_path / "export", "P1")
+    assert [entry["score"] for entry in loaded["progress"]] == [70]
+    assert report["progress"]["rejected"] == 2
+
+    records.import_records(tmp_path / "export", lambda *args: None, rejects_dir=tmp_path / "rejects")
+    assert (tmp_path / "rejects" / "progress.00000.csv").exists()
+
+
+def test_import_resumes_after_the_last_finished_batch(tmp_path):
+    progress = [{"date": datetime.date(2024, 3, day), "score": day, "mood": "🙂", "notes": ""} for day in range(1, 11)]
+    records.export_records([("P1", {"progress": progress})], tmp_path / "export")
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"progress": 2}))
+
+    batches = []
+    report = records.import_records(tmp_path / "export", lambda table, index, batch: batches.append(index),
+                                    checkpoint_path=str(checkpoint), tables=["progress"], batch_rows=3)
+    assert batches == [2, 3]
+    assert report["progress"]["skipped_batches"] == 2
+    assert json.loads(checkpoint.read_text()) == {"progress": 4}
+
+
+def test_store_sink_merges_into_the_shared_record(tmp_path):
+    record = patient_record()
+    records.export_records([("P1", record)], tmp_path / "export")
+    store = state.SharedState(state.SQLiteBackend(str(tmp_path / "state.sqlite3")), cache_ttl=0)
+    store.set("patient:P1:progress", [{"date": datetime.date(2024, 3, 1), "score": 50, "mood": "😐", "notes": ""}], 0)
+    activity_db = str(tmp_path / "activity.sqlite3")
+
+    records.import_records(tmp_path / "export", records.store_sink(store, activity_db))
+
+    patients = dict(store.patients())
+    assert [entry["score"] for entry in patients["P1"]["progress"]] == [50, 70]
+    assert [med["name"] for med in patients["P1"]["medications"]] == ["Donepezil"]
+    assert [message["content"] for message in patients["P1"]["chat_history"]] == ["hi", "Hello!"]
+    kinds = [event["kind"] for event in activity.ActivityLog(activity_db, "P1").events()]
+    assert sorted(kinds) == ["contacts_updated", "medication_added", "progress_logged"]
+
+
+def test_export_events_streams_the_activity_log(tmp_path):
+    activity_db = str(tmp_path / "activity.sqlite3")
+    activity.ActivityLog(activity_db, "P1").record("progress_logged", {"score": 70})
+    activity.ActivityLog(activity_db, "P2").record("progress_logged", {"score": 60})
+
+    assert records.export_events(activity_db, tmp_path / "out", patient_ids=["P2"]) == 1
+    events = pq.read_table(tmp_path / "out" / "events.parquet").to_pylist()
+    assert [(event["patient_id"], json.loads(event["payload"])) for event in events] == [("P2", {"score": 60})]
@@ -0,0 +1,73 @@
+import chatlog
+import state
+
+
+def reminder(message, **fields):
+    return {"time": "08:00", "message": message, "frequency": "Daily", "active": True, **fields}
+
+
+def test_merge_keeps_both_writers_additions():
+    base = [reminder("Walk")]
+    local = base + [reminder("Lunch")]
+    remote = base + [reminder("Call Anna")]
+    assert [r["message"] for r in state.merge_lists(base, local, remote)] == ["Walk", "Call Anna", "Lunch"]
+
+
+def test_merge_keeps_identical_entries_apart():
+    # The same reminder added once here and once elsewhere is two reminders
+    base = [reminder("Walk")]
+    merged = state.merge_lists(base, base + [reminder("Walk")], base + [reminder("Walk")])
+    assert [r["message"] for r in merged] == ["Walk", "Walk", "Walk"]
+
+
+def test_merge_applies_local_removals():
+    base = [reminder("Walk"), reminder("Lunch")]
+    merged = state.merge_lists(base, [reminder("Lunch")], base + [reminder("Call Anna")])
+    assert [r["message"] for r in merged] == ["Lunch", "Call Anna"]
+
+
+def test_merge_keeps_local_edits_of_items_with_ids():
+    base = [{"id": "m1", "name": "Donepezil", "last_taken": None}, {"id": "m2", "name": "Memantine", "last_taken": None}]
+    local = [{"id": "m1", "name": "Donepezil", "last_taken": "2024-03-05T08:00:00"}, base[1]]
+    remote = [base[0], {"id": "m2", "name": "Memantine", "last_taken": "2024-03-05T09:00:00"}]
+    merged = state.merge_lists(base, local, remote)
+    assert [m["last_taken"] for m in merged] == ["2024-03-05T08:00:00", "2024-03-05T09:00:00"]
+
+
+def test_merge_does_not_duplicate_an_id_added_on_both_sides():
+    added = {"id": "m3", "name": "Rivastigmine"}
+    merged = state.merge_lists([], [added], [added])
+    assert merged == [added]
+
+
+def test_chat_merge_appends_only_new_local_messages():
+    base = chatlog.ChatHistory([{"role": "user", "content": "hi"}])
+    local = chatlog.ChatHistory(list(base) + [{"role": "bot", "content": "hello"}])
+    remote = chatlog.ChatHistory(list(base) + [{"role": "user", "content": "from another tab"}])
+    merged = state.merge_lists(base, local, remote)
+    assert [m["content"] for m in merged] == ["hi", "from another tab", "hello"]
+
+
+def test_update_retries_after_a_conflict(tmp_path):
+    store = state.SharedState(state.SQLiteBackend(str(tmp_path / "state.sqlite3")), cache_ttl=0)
+    other = state.SharedState(state.SQLiteBackend(str(tmp_path / "state.sqlite3")), cache_ttl=0)
+    calls = []
+
+    def append(value):
+        calls.append(value)
+        if len(calls) == 1:
+            # Another replica writes between our read and our write
+            other.update("patient:P1:progress", lambda current: (current or []) + ["remote"])
+        return (value or []) + ["local"]
+
+    store.update("patient:P1:progress", append)
+    assert store.get("patient:P1:progress")[1] == ["remote", "local"]
+    assert len(calls) == 2
+
+
+def test_chat_history_round_trips_through_the_store(tmp_path):
+    store = state.SharedState(state.SQLiteBackend(str(tmp_path / "state.sqlite3")))
+    history = chatlog.ChatHistory({"role": "user", "content": f"message {i}"} for i in range(100))
+    store.set("patient:P1:chat_history", history, 0)
+    _, loaded = state.SharedState(store.backend).get("patient:P1:chat_history")
+    assert [m["content"] for m in loaded] == [m["content"] for m in history]
@@ -0,0 +1,340 @@
+import argparse
+import atexit
+import datetime
+import io
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import db
+import ratelimit
+
+USAGE_DB = "data/usage.sqlite3"
+
+# Calls are buffered and written in one transaction every FLUSH_SECONDS, or
+# sooner once FLUSH_CALLS are waiting
+FLUSH_SECONDS = 2.0
+FLUSH_CALLS = 200
+# Calls kept while the database is unavailable; the oldest are dropped beyond this
+MAX_BUFFERED = 10000
+
+# USD per million tokens: (prompt, cached prompt, output). Models not listed,
+# such as the local GGUF model, cost nothing.
+PRICES = {
+    "models/gemini-1.5-pro-latest": (1.25, 0.3125, 5.00),
+    "models/gemini-1.5-pro-002": (1.25, 0.3125, 5.00),
+    "models/gemini-1.5-flash-latest": (0.075, 0.01875, 0.30),
+    "models/gemini-1.5-flash-002": (0.075, 0.01875, 0.30)
+}
+
+# Chat turns answered without a model call of their own: from the prefetched
+# answer cache, from the knowledge index alone, or by joining an identical call in flight
+HIT_STATUSES = ("answer_cache", "local_answer", "coalesced")
+ERROR_STATUSES = ("error", "rate_limited", "busy")
+
+CALL_COLUMNS = [
+    "ts", "day", "patient_id", "page", "model", "priority", "status", "error",
+    "input_tokens", "cached_tokens", "output_tokens", "estimated",
+    "queue_ms", "first_token_ms", "latency_ms", "retries", "cost_usd"
+]
+ROLLUP_COLUMNS = [
+    "calls", "model_calls", "errors", "retries", "input_tokens", "cached_tokens", "output_tokens",
+    "queue_ms", "first_tokens", "first_token_ms", "latency_ms", "cost_usd", "cache_hits", "context_hits"
+]
+# Summed milliseconds and dollars; every other rollup column is a count
+REAL_COLUMNS = ["queue_ms", "first_token_ms", "latency_ms", "cost_usd"]
+GROUPS = ["day", "patient_id", "page", "model"]
+
+
+def cost(model, input_tokens, cached_tokens, output_tokens):
+    prompt, cached, output = PRICES.get(model, (0.0, 0.0, 0.0))
+    return ((input_tokens - cached_tokens) * prompt + cached_tokens * cached + output_tokens * output) / 1e6
+
+
+def rollup_delta(call):
+    """What one call adds to its (day, patient, page, model) rollup row."""
+    model_call = call["status"] not in HIT_STATUSES
+    return {
+        "calls": 1,
+        "model_calls": int(model_call),
+        "errors": int(call["status"] in ERROR_STATUSES),
+        "retries": call["retries"],
+        "input_tokens": call["input_tokens"],
+        "cached_tokens": call["cached_tokens"],
+        "output_tokens": call["output_tokens"],
+        "queue_ms": call["queue_ms"] or 0.0,
+        "first_tokens": int(call["first_token_ms"] is not None),
+        "first_token_ms": call["first_token_ms"] or 0.0,
+        "latency_ms": call["latency_ms"] if model_call else 0.0,
+        "cost_usd": call["cost_usd"],
+        "cache_hits": int(not model_call),
+        "context_hits": int(call["cached_tokens"] > 0)
+    }
+
+
+# ----------------- Ledger -----------------
+class Ledger:
+    """Every model call's tokens, latency, cache use, retries and outcome.
+
+    record() only appends to an in-memory buffer; a writer thread inserts the
+    buffered calls and folds them into per day/patient/page/model rollup rows
+    in a single transaction, so the chat path never waits on SQLite and the
+    dashboards read rollups instead of scanning calls.
+    """
+
+    def __init__(self, path=USAGE_DB, flush_seconds=FLUSH_SECONDS, flush_calls=FLUSH_CALLS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.flush_calls = flush_calls
+        db.prepare(path)
+        with db.connect(path) as conn:
+            conn.executescript(f"""
+                CREATE TABLE IF NOT EXISTS calls (
+                    ts REAL, day TEXT, patient_id TEXT, page TEXT, model TEXT, priority INTEGER,
+                    status TEXT, error TEXT, input_tokens INTEGER, cached_tokens INTEGER,
+                    output_tokens INTEGER, estimated INTEGER, queue_ms REAL, first_token_ms REAL,
+                    latency_ms REAL, retries INTEGER, cost_usd REAL
+                );
+                CREATE INDEX IF NOT EXISTS calls_day ON calls (day);
+                CREATE TABLE IF NOT EXISTS rollups (
+                    day TEXT, patient_id TEXT, page TEXT, model TEXT,
+                    {", ".join(f"{column} {'REAL' if column in REAL_COLUMNS else 'INTEGER'}" for column in ROLLUP_COLUMNS)},
+                    PRIMARY KEY (day, patient_id, page, model)
+                );
+            """)
+        self.cond = threading.Condition()
+        self.buffer = []
+        self.stats = {"recorded": 0, "written": 0, "flushes": 0, "dropped": 0, "write_errors": 0}
+        threading.Thread(target=self._run, daemon=True, name="usage-ledger").start()
+        atexit.register(self.flush)
+
+    def record(self, patient_id, page, model, status="ok", priority=ratelimit.PRIORITY_INTERACTIVE, error=None,
+               input_tokens=0, cached_tokens=0, output_tokens=0, estimated=False,
+               queue_ms=None, first_token_ms=None, latency_ms=0.0, retries=0, ts=None):
+        ts = time.time() if ts is None else ts
+        call = {
+            "ts": ts,
+            "day": datetime.date.fromtimestamp(ts).isoformat(),
+            "patient_id": patient_id or "",
+            "page": page or "",
+            "model": model,
+            "priority": priority,
+            "status": status,
+            "error": error,
+            "input_tokens": input_tokens,
+            "cached_tokens": cached_tokens,
+            "output_tokens": output_tokens,
+            "estimated": int(estimated),
+            "queue_ms": queue_ms,
+            "first_token_ms": first_token_ms,
+            "latency_ms": latency_ms,
+            "retries": retries,
+            "cost_usd": cost(model, input_tokens, cached_tokens, output_tokens)
+        }
+        with self.cond:
+            self.buffer.append(call)
+            self.stats["recorded"] += 1
+            if len(self.buffer) >= self.flush_calls:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait(self.flush_seconds)
+            self.flush()
+
+    def flush(self):
+        with self.cond:
+            calls, self.buffer = self.buffer, []
+        if not calls:
+            return 0
+        rollups = {}
+        for call in calls:
+            key = (call["day"], call["patient_id"], call["page"], call["model"])
+            delta = rollup_delta(call)
+            total = rollups.setdefault(key, dict.fromkeys(ROLLUP_COLUMNS, 0))
+            for column in ROLLUP_COLUMNS:
+                total[column] += delta[column]
+        try:
+            with db.connect(self.path) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    f"INSERT INTO calls VALUES ({', '.join('?' * len(CALL_COLUMNS))})",
+                    [[call[column] for column in CALL_COLUMNS] for call in calls]
+                )
+                conn.executemany(
+                    f"INSERT INTO rollups VALUES ({', '.join('?' * (4 + len(ROLLUP_COLUMNS)))}) "
+                    f"ON CONFLICT (day, patient_id, page, model) DO UPDATE SET "
+                    f"{', '.join(f'{column} = {column} + excluded.{column}' for column in ROLLUP_COLUMNS)}",
+                    [list(key) + [total[column] for column in ROLLUP_COLUMNS] for key, total in rollups.items()]
+                )
+                conn.execute("COMMIT")
+        except sqlite3.Error:
+            # Put the calls back for the next flush, keeping the newest if the database stays down
+            with self.cond:
+                self.buffer = calls + self.buffer
+                overflow = len(self.buffer) - MAX_BUFFERED
+                if overflow > 0:
+                    del self.buffer[:overflow]
+                    self.stats["dropped"] += overflow
+                self.stats["write_errors"] += 1
+            return 0
+        self.stats["written"] += len(calls)
+        self.stats["flushes"] += 1
+        return len(calls)
+
+    # ----------------- Reports -----------------
+    def rollup(self, start, end, by=("day",)):
+        """Totals and averages for [start, end], grouped by any of day, patient_id, page and model."""
+        by = [column for column in GROUPS if column in by]
+        select = ", ".join(by + [f"SUM({column})" for column in ROLLUP_COLUMNS])
+        group = f" GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}" if by else ""
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                f"SELECT {select} FROM rollups WHERE day BETWEEN ? AND ?{group}",
+                (start.isoformat(), end.isoformat())
+            ).fetchall()
+        report = pd.DataFrame(rows, columns=by + ROLLUP_COLUMNS)
+        if not by:
+            report = report.dropna()
+        report = report.fillna(0).astype({column: int for column in ROLLUP_COLUMNS if column not in REAL_COLUMNS})
+        model_calls = report["model_calls"].where(report["model_calls"] > 0)
+        report["avg_queue_ms"] = (report["queue_ms"] / model_calls).round(1)
+        report["avg_first_token_ms"] = (report["first_token_ms"] / report["first_tokens"].where(report["first_tokens"] > 0)).round(1)
+        report["avg_latency_ms"] = (report["latency_ms"] / model_calls).round(1)
+        report["cache_hit_rate"] = (report["cache_hits"] / report["calls"].where(report["calls"] > 0)).round(3)
+        report["context_hit_rate"] = (report["context_hits"] / model_calls).round(3)
+        report["cost_usd"] = report["cost_usd"].round(4)
+        return report.drop(columns=["queue_ms", "first_tokens", "first_token_ms", "latency_ms"])
+
+    def latency(self, start, end, by="page"):
+        """p50/p95 time to first token and total latency of model calls, from the raw calls."""
+        if by not in GROUPS:
+            raise ValueError(f"Cannot group by {by!r}")
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                f"SELECT {by}, first_token_ms, latency_ms FROM calls "
+                f"WHERE day BETWEEN ? AND ? AND status = 'ok'",
+                (start.isoformat(), end.isoformat())
+            ).fetchall()
+        groups = {}
+        for key, first_token_ms, latency_ms in rows:
+            groups.setdefault(key, ([], []))
+            if first_token_ms is not None:
+                groups[key][0].append(first_token_ms)
+            groups[key][1].append(latency_ms)
+        report = []
+        for key, (first_tokens, latencies) in sorted(groups.items()):
+            first_tokens, latencies = np.array(first_tokens), np.array(latencies)
+            report.append({
+                by: key,
+                "calls": len(latencies),
+                "first_token_p50_ms": _percentile(first_tokens, 50),
+                "first_token_p95_ms": _percentile(first_tokens, 95),
+                "latency_p50_ms": _percentile(latencies, 50),
+                "latency_p95_ms": _percentile(latencies, 95)
+            })
+        return report
+
+    def calls(self, start, end):
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(CALL_COLUMNS)} FROM calls WHERE day BETWEEN ? AND ? ORDER BY ts",
+                (start.isoformat(), end.isoformat())
+            ).fetchall()
+        return pd.DataFrame(rows, columns=CALL_COLUMNS)
+
+    def export(self, start, end, fmt="csv"):
+        """Every call in [start, end] as CSV or Parquet bytes."""
+        frame = self.calls(start, end)
+        if fmt == "parquet":
+            buffer = io.BytesIO()
+            frame.to_parquet(buffer, index=False)
+            return buffer.getvalue()
+        return frame.to_csv(index=False).encode("utf-8")
+
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)), 1) if len(values) else None
+
+
+# ----------------- Call Timing -----------------
+class CallTimer:
+    """Timings for one model call, recorded to the ledger when it ends."""
+
+    def __init__(self, ledger, patient_id, page, model, priority):
+        self.ledger = ledger
+        self.patient_id = patient_id
+        self.page = page
+        self.model = model
+        self.priority = priority
+        self.started = time.perf_counter()
+        self.waiting = self.started
+        self.sent = None
+        self.first_token = None
+        self.queue_ms = 0.0
+        self.retries = 0
+
+    def acquired(self):
+        self.sent = time.perf_counter()
+        self.queue_ms += (self.sent - self.waiting) * 1000
+
+    def chunk(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def retry(self):
+        self.retries += 1
+        self.waiting = time.perf_counter()
+
+    def finish(self, status="ok", error=None, usage=None, model=None, prompt="", reply=""):
+        if self.ledger is None:
+            return
+        input_tokens = getattr(usage, "prompt_token_count", None)
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        estimated = input_tokens is None
+        if estimated and status in ("ok", "abandoned"):
+            # Backends that report no usage are billed by the same estimate the rate limiter uses
+            input_tokens, output_tokens = ratelimit.estimate_tokens(prompt), ratelimit.estimate_tokens(reply)
+        now = time.perf_counter()
+        self.ledger.record(
+            self.patient_id, self.page, model or self.model, status=status, priority=self.priority,
+            error=error, input_tokens=input_tokens or 0, output_tokens=output_tokens or 0,
+            cached_tokens=getattr(usage, "cached_content_token_count", None) or 0, estimated=estimated,
+            queue_ms=round(self.queue_ms, 1),
+            first_token_ms=round((self.first_token - self.sent) * 1000, 1) if self.first_token and self.sent else None,
+            latency_ms=round((now - self.started) * 1000, 1), retries=self.retries
+        )
+
+
+# ----------------- Command Line -----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LLM usage ledger")
+    parser.add_argument("--db", default=USAGE_DB)
+    parser.add_argument("--days", type=int, default=7, help="Days back from today to include")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", help="Print rollups")
+    report.add_argument("--by", nargs="*", default=["day"], choices=GROUPS)
+    export = commands.add_parser("export", help="Write every call to a file")
+    export.add_argument("out", help="Output path ending in .csv or .parquet")
+    args = parser.parse_args(argv)
+
+    ledger = Ledger(args.db)
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=args.days - 1)
+    if args.command == "report":
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(ledger.rollup(start, end, args.by).to_string(index=False))
+        return
+    fmt = "parquet" if args.out.endswith(".parquet") else "csv"
+    with open(args.out, "wb") as f:
+        f.write(ledger.export(start, end, fmt))
+    print(f"Wrote {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()